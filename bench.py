@@ -0,0 +1,1412 @@
+"""
+Micro-benchmarks for the bot's hot paths. They run offline against main.py's real code.
+
+Usage:
+    python bench.py scheduler [--guilds 10000] [--period 1.0] [--duration 5.0]
+    python bench.py alert [--plays 20]   (needs ffmpeg and libopus)
+    python bench.py purge [--channels 20] [--messages 3000] [--latency 0.05]
+    python bench.py store [--sessions 10000] [--transitions 3] [--guilds 200] [--members 5] [--latency 0.05]
+    python bench.py memory [--guilds 100000] [--members 1000000]
+    python bench.py drift [--hours 24] [--minute 0.03] [--study 50] [--break 10]
+    python bench.py voice [--members 2000] [--events 200000] [--join-share 0.1]
+    python bench.py status [--guilds 20] [--days 1] [--milestones 10,5,1]
+    python bench.py gateway [--guilds 1000] [--members 100] [--large-share 0.1] [--large-members 1000]
+    python bench.py actors [--messages 200000] [--guilds 1,100,1000]
+    python bench.py intents [--guilds 100] [--members 50] [--messages 50000]
+    python bench.py cluster [--guilds 40] [--members 5] [--shards 4] [--workers 1,2,4] [--minute 10] [--rate 0]
+    python bench.py supervise [--interval 0.2] [--stop-after 4.0]
+"""
+import argparse
+import asyncio
+import contextlib
+import datetime
+import gc
+import io
+import itertools
+import json
+import os
+import random
+import re
+import resource
+import selectors
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault("tokenbot", "")
+
+import main  # noqa: E402
+
+
+async def _measure_lag(stop: asyncio.Event, interval: float, samples: list) -> None:
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        before = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(loop.time() - before - interval)
+
+
+def _report(name: str, guilds: int, cpu: float, wakeups: int, mem: int, tasks: int, lag: list) -> None:
+    lag = sorted(lag) or [0.0]
+    print(
+        f"{name:<10} guilds={guilds} tasks={tasks} mem={mem / 1024:.0f}KiB "
+        f"({mem / guilds:.0f}B/guild) cpu={cpu:.3f}s wakeups={wakeups} "
+        f"({cpu / max(wakeups, 1) * 1e6:.1f}us/wakeup) "
+        f"lag_p50={lag[len(lag) // 2] * 1000:.2f}ms lag_max={lag[-1] * 1000:.2f}ms"
+    )
+
+
+async def _legacy_timers(guilds: int, period: float, duration: float) -> None:
+    """The old model: a cycle task plus a countdown task per guild, each sleeping on its own."""
+    wakeups = 0
+
+    async def sleeper(offset: float) -> None:
+        nonlocal wakeups
+        await asyncio.sleep(offset)
+        while True:
+            await asyncio.sleep(period)
+            wakeups += 1
+
+    tracemalloc.start()
+    tasks = []
+    for _ in range(guilds):
+        offset = random.random() * period
+        tasks.append(asyncio.create_task(sleeper(offset)))  # cycle task
+        tasks.append(asyncio.create_task(sleeper(offset)))  # countdown task
+    await asyncio.sleep(0)
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    stop, lag = asyncio.Event(), []
+    monitor = asyncio.create_task(_measure_lag(stop, 0.05, lag))
+    cpu = time.process_time()
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu
+    stop.set()
+    ntasks = len(asyncio.all_tasks())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, monitor, return_exceptions=True)
+    _report("legacy", guilds, cpu, wakeups, mem, ntasks, lag)
+
+
+async def _scheduler_timers(guilds: int, period: float, duration: float) -> None:
+    """The shared scheduler: one handle per guild, re-armed from an absolute deadline."""
+    sched = main.TimerScheduler()
+    wakeups = 0
+    handles = {}
+
+    def step(guild_id: int, when: float) -> None:
+        nonlocal wakeups
+        wakeups += 1
+        handles[guild_id] = sched.call_at(when + period, step, guild_id, when + period)
+
+    tracemalloc.start()
+    now = sched.time()
+    for guild_id in range(guilds):
+        when = now + random.random() * period
+        handles[guild_id] = sched.call_at(when, step, guild_id, when)
+    await asyncio.sleep(0)
+    mem = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    stop, lag = asyncio.Event(), []
+    monitor = asyncio.create_task(_measure_lag(stop, 0.05, lag))
+    cpu = time.process_time()
+    await asyncio.sleep(duration)
+    cpu = time.process_time() - cpu
+    stop.set()
+    ntasks = len(asyncio.all_tasks())
+    # !stop for every guild: O(1) cancel each
+    cancel_start = time.perf_counter()
+    for handle in handles.values():
+        handle.cancel()
+    cancel_us = (time.perf_counter() - cancel_start) / guilds * 1e6
+    await monitor
+    _report("scheduler", guilds, cpu, wakeups, mem, ntasks, lag)
+    print(f"{'':<10} cancel={cancel_us:.2f}us/guild pending_after_cancel={len(sched)}")
+
+
+def bench_scheduler(args: argparse.Namespace) -> None:
+    asyncio.run(_legacy_timers(args.guilds, args.period, args.duration))
+    asyncio.run(_scheduler_timers(args.guilds, args.period, args.duration))
+
+
+def _play_alert(source) -> float:
+    """Drain a source the way discord.py's AudioPlayer does; returns seconds to the first frame."""
+    encoder = None if source.is_opus() else main.discord.opus.Encoder()
+    start = time.perf_counter()
+    first = None
+    while True:
+        data = source.read()
+        if not data:
+            break
+        if encoder is not None:
+            data = encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+        if first is None:
+            first = time.perf_counter() - start
+    source.cleanup()
+    return first or 0.0
+
+
+def _cpu_seconds() -> float:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def bench_alert(args: argparse.Namespace) -> None:
+    if not main.discord.opus.is_loaded() and not main.discord.opus._load_default():
+        raise SystemExit("libopus is not available")
+    start = time.perf_counter()
+    frames = main._encode_alert_frames(main.ALERT_AUDIO_FULL_PATH)
+    print(f"one-time decode+encode: {(time.perf_counter() - start) * 1000:.1f}ms, {len(frames)} frames")
+
+    legacy = lambda: main.discord.PCMVolumeTransformer(  # noqa: E731
+        main.discord.FFmpegPCMAudio(main.ALERT_AUDIO_FULL_PATH), volume=main.ALERT_VOLUME
+    )
+    preencoded = lambda: main.PreencodedAudio(frames)  # noqa: E731
+    for name, factory in (("ffmpeg", legacy), ("preencoded", preencoded)):
+        cpu = _cpu_seconds()
+        latencies = sorted(_play_alert(factory()) for _ in range(args.plays))
+        cpu = _cpu_seconds() - cpu
+        print(
+            f"{name:<11} cpu/alert={cpu / args.plays * 1000:.2f}ms "
+            f"first_frame_p50={latencies[len(latencies) // 2] * 1000:.2f}ms "
+            f"first_frame_max={latencies[-1] * 1000:.2f}ms"
+        )
+
+
+class _FakeMessage:
+    __slots__ = ("id", "author")
+
+    def __init__(self, message_id: int, author: str):
+        self.id = message_id
+        self.author = author
+
+
+class _FakePurgeChannel:
+    """A text channel backed by an in-memory 'HTTP' layer that charges `latency` per request."""
+
+    def __init__(self, messages: list, latency: float, stats: dict):
+        self.messages = messages  # newest first
+        self.latency = latency
+        self.stats = stats
+
+    async def _request(self, route: str) -> None:
+        self.stats[route] = self.stats.get(route, 0) + 1
+        await asyncio.sleep(self.latency)
+
+    async def history(self, limit: int = 100):
+        # Paginated like the real endpoint: 100 messages per request
+        snapshot = list(self.messages[:limit])
+        for i in range(0, len(snapshot), 100):
+            await self._request("GET messages")
+            for m in snapshot[i:i + 100]:
+                yield m
+
+    async def delete_messages(self, objs) -> None:
+        await self._request("POST bulk-delete" if len(objs) > 1 else "DELETE message")
+        ids = {o.id for o in objs}
+        self.messages = [m for m in self.messages if m.id not in ids]
+
+    def get_partial_message(self, message_id: int):
+        channel = self
+
+        class _Partial:
+            async def delete(self) -> None:
+                await channel._request("DELETE message")
+                channel.messages = [m for m in channel.messages if m.id != message_id]
+
+        return _Partial()
+
+    async def purge(self, limit: int, check) -> list:
+        """Mirrors discord.py's TextChannel.purge: serial bulk deletes, single deletes past 14 days."""
+        cutoff = main.discord.utils.time_snowflake(main.discord.utils.utcnow() - main.BULK_DELETE_MAX_AGE)
+        deleted, batch = [], []
+        async for m in self.history(limit=limit):
+            if not check(m):
+                continue
+            if m.id > cutoff:
+                batch.append(m)
+                if len(batch) == 100:
+                    await self.delete_messages(batch)
+                    deleted += batch
+                    batch = []
+            else:
+                await self.get_partial_message(m.id).delete()
+                deleted.append(m)
+        if batch:
+            await self.delete_messages(batch)
+            deleted += batch
+        return deleted
+
+
+def _fake_purge_channels(count: int, messages: int, latency: float, stats: dict) -> list:
+    rng = random.Random(7)
+    now = main.discord.utils.utcnow()
+    channels = []
+    for _ in range(count):
+        msgs = []
+        for i in range(messages):
+            # Newest first; the oldest tenth is past the 14-day bulk-delete window
+            age = datetime.timedelta(days=15.5 * i / messages, seconds=i)
+            author = "bot" if rng.random() < 0.3 else "user"
+            msgs.append(_FakeMessage(main.discord.utils.time_snowflake(now - age), author))
+        channels.append(_FakePurgeChannel(msgs, latency, stats))
+    return channels
+
+
+async def _legacy_purge(channels: list) -> int:
+    """The old !clear: channel after channel, up to 10 rounds of purge(limit=1000)."""
+    total = 0
+    for ch in channels:
+        for _ in range(10):
+            count = len(await ch.purge(limit=1000, check=lambda m: m.author == "bot"))
+            total += count
+            if count == 0:
+                break
+    return total
+
+
+def bench_purge(args: argparse.Namespace) -> None:
+    for name in ("sequential", "engine"):
+        stats: dict = {}
+        channels = _fake_purge_channels(args.channels, args.messages, args.latency, stats)
+        start = time.perf_counter()
+        if name == "sequential":
+            deleted = asyncio.run(_legacy_purge(channels))
+        else:
+            job = main.PurgeJob(None, lambda m: m.author == "bot", "bench")
+            deleted = asyncio.run(job.run(channels, report=False))
+        wall = time.perf_counter() - start
+        left = sum(m.author == "bot" for ch in channels for m in ch.messages)
+        calls = " ".join(f"{route}={n}" for route, n in sorted(stats.items()))
+        print(f"{name:<10} wall={wall:.2f}s deleted={deleted} left={left} requests: {calls}")
+
+
+def _stored_session(guild_id: int, started_wall: float) -> "main.StoredSession":
+    return main.StoredSession(
+        guild_id=guild_id, study_minutes=50, break_minutes=10, phase="study", label="Study",
+        phase_number=1, segment_minutes=50, started_wall=started_wall, study_count=0,
+        pending_extension=0, status_channel_id=1, status_message_id=guild_id, voice_channel_id=2,
+        announce_channel_id=3,
+    )
+
+
+def bench_store(args: argparse.Namespace) -> None:
+    if args.run:
+        _store_resume_run(args)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        now = time.time()
+        # One commit per phase transition (what a naive write-through store would do)
+        naive = main.SessionStore(os.path.join(tmp, "naive.db"))
+        start = time.perf_counter()
+        for round_ in range(args.transitions):
+            for guild_id in range(args.sessions):
+                naive._write({guild_id: _stored_session(guild_id, now + round_)})
+        naive_cost = (time.perf_counter() - start) / (args.sessions * args.transitions)
+
+        # Coalesced: save() only records the row; one transaction per flush interval
+        store = main.SessionStore(os.path.join(tmp, "batched.db"))
+        store._schedule_flush = lambda: None  # flush explicitly below instead of via the scheduler
+        save_time = flush_time = 0.0
+        for round_ in range(args.transitions):
+            start = time.perf_counter()
+            for guild_id in range(args.sessions):
+                store.save(_stored_session(guild_id, now + round_))
+            save_time += time.perf_counter() - start
+            start = time.perf_counter()
+            store.flush_sync()
+            flush_time += time.perf_counter() - start
+        writes = args.sessions * args.transitions
+        print(
+            f"write/transition: naive={naive_cost * 1e6:.1f}us "
+            f"batched save={save_time / writes * 1e6:.2f}us (event loop) + commit={flush_time / writes * 1e6:.1f}us (thread)"
+        )
+
+        # Resume: load every row and fast-forward to the running segment after an hour of downtime
+        start = time.perf_counter()
+        rows = store.load_all()
+        loaded = time.perf_counter() - start
+        start = time.perf_counter()
+        advanced = sum(main._fast_forward(row, now + 3600)[1] for row in rows)
+        forwarded = time.perf_counter() - start
+        print(
+            f"resume {len(rows)} sessions: load={loaded * 1000:.1f}ms fast-forward={forwarded * 1000:.1f}ms "
+            f"({advanced} advanced past missed phases)"
+        )
+
+        env = dict(os.environ, SESSION_DB_PATH=os.path.join(tmp, "resume.db"))
+        cmd = [sys.executable, os.path.abspath(__file__), "store", "--run", "--guilds", str(args.guilds),
+               "--members", str(args.members), "--latency", str(args.latency)]
+        out = subprocess.run(cmd, capture_output=True, text=True, env=env)
+        if out.returncode != 0:
+            print(f"full resume failed:\n{out.stderr}")
+            return
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(
+            f"full resume of {r['guilds']} guilds x {args.members} members (latency {args.latency * 1000:.0f}ms): "
+            f"_resume_sessions returned={r['returned'] * 1000:.0f}ms status posted={r['posted'] * 1000:.0f}ms "
+            f"members muted={r['muted'] * 1000:.0f}ms (after READY) 429s={r['ratelimited']}"
+        )
+
+
+def _store_resume_run(args: argparse.Namespace) -> None:
+    """
+    Full resume after a restart: every guild has a stored cycle and main.bot starts against a fake Discord.
+    Times from READY until on_ready's _resume_sessions returns, until every resumed guild has posted its
+    status message and until all of its members are muted again.
+    """
+    from fake_discord import FakeDiscord
+
+    main.ALERT_AUDIO_FULL_PATH = os.path.join(tempfile.gettempdir(), "no-alert.mp3")
+    server = FakeDiscord(latency=args.latency)
+    guilds = [server.add_guild(members=args.members) for _ in range(args.guilds)]
+    now = time.time()
+    # Stored 90 minutes ago: fast-forwarded past a study and a break into the next study, with a new status
+    main.session_store._write({guild.id: _stored_session(guild.id, now - 90 * 60) for guild in guilds})
+    marks = {}
+    resume_sessions = main._resume_sessions
+
+    async def traced() -> int:
+        resumed = await resume_sessions()
+        marks["returned"] = time.perf_counter()
+        return resumed
+
+    main._resume_sessions = traced
+
+    def posted(guild) -> bool:
+        session = main.sessions.get(guild.id)
+        return session is not None and session.status_message_id != 0
+
+    def muted(guild) -> bool:
+        return all(guild.members[user_id]["mute"] for user_id in guild.voice_states if user_id != server.bot_user_id)
+
+    async def run() -> dict:
+        await server.attach(main.bot)
+        start = time.perf_counter()
+        server.gateway.ready()
+        deadline = start + 300
+        while time.perf_counter() < deadline and ("posted" not in marks or "muted" not in marks):
+            await asyncio.sleep(0.005)
+            if "posted" not in marks and all(posted(guild) for guild in guilds):
+                marks["posted"] = time.perf_counter()
+            if "muted" not in marks and all(muted(guild) for guild in guilds):
+                marks["muted"] = time.perf_counter()
+        return {"guilds": len(guilds), "ratelimited": sum(server.ratelimited.values()),
+                **{name: mark - start for name, mark in marks.items()}}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(run())
+    print(json.dumps(result))
+
+
+class _LegacyDarkChannels:
+    __slots__ = ("voice", "text")
+
+    def __init__(self) -> None:
+        self.voice = None
+        self.text = None
+
+
+def _legacy_guild_state(guilds: int, members: int, now: float) -> list:
+    """The dict-per-field layout main.py used before GuildSession, filled like a busy cycle leaves it."""
+    phase, study_count, announce, remaining, original_name, voice_id, status_id, extension = ({} for _ in range(8))
+    dark_channels, countdowns, recent_edit = {}, {}, {}
+    for gid in range(guilds):
+        phase[gid] = "study"
+        study_count[gid] = 3
+        announce[gid] = 10 ** 17 + gid
+        remaining[gid] = 1500
+        original_name[gid] = main.DARK_VOICE_CHANNEL_NAME
+        voice_id[gid] = 10 ** 17 + gid
+        status_id[gid] = 10 ** 17 + gid
+        extension[gid] = 0
+        dark_channels[gid] = _LegacyDarkChannels()
+        countdowns[gid] = main.deque([(10 ** 17 + gid, 10 ** 17 + gid)], maxlen=main.COUNTDOWN_REGISTRY_SIZE)
+    for i in range(members):
+        recent_edit[(i % guilds, 10 ** 17 + i)] = now
+    return [phase, study_count, announce, remaining, original_name, voice_id, status_id, extension,
+            dark_channels, countdowns, recent_edit]
+
+
+def _session_state(guilds: int, members: int, now: float) -> dict:
+    sessions = {}
+    for gid in range(guilds):
+        session = sessions[gid] = main.GuildSession(gid)
+        session.phase = "study"
+        session.study_count = 3
+        session.announce_channel_id = 10 ** 17 + gid
+        session.voice_channel_id = 10 ** 17 + gid
+        session.status_message_id = 10 ** 17 + gid
+        session.countdown_messages = main.deque([(10 ** 17 + gid, 10 ** 17 + gid)], maxlen=main.COUNTDOWN_REGISTRY_SIZE)
+    for i in range(members):
+        sessions[i % guilds].mark_edited(10 ** 17 + i, now)
+    return sessions
+
+
+def _traced(build, *args):
+    tracemalloc.start()
+    try:
+        result = build(*args)
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_memory(args: argparse.Namespace) -> None:
+    """
+    Memory of both layouts per guild, and per tracked member: each layout is measured again with no
+    members and with a tenth of them, so (total - baseline) / members shows whether a member's cost
+    stays flat as they are added (a session's first tracked member also pays for its guild's table).
+    """
+    guilds, members = args.guilds, args.members
+    now = time.monotonic()
+    for name, build in (("dicts", _legacy_guild_state), ("sessions", _session_state)):
+        state, baseline = _traced(build, guilds, 0, now)
+        del state
+        per_member = []
+        for count in (members // 10, members):
+            state, mem = _traced(build, guilds, count, now)
+            del state
+            per_member.append(f"{(mem - baseline) / max(count, 1):.0f}B/member@{count}")
+        print(f"{name:<10} guilds={guilds} members={members} mem={mem / 2 ** 20:.1f}MiB "
+              f"({baseline / guilds:.0f}B/guild, {' '.join(per_member)})")
+    sessions = _session_state(guilds, members, now)
+
+    # One more edit per guild after the cooldown: the expired entries go, the legacy table never shrinks
+    later = now + main.PER_MEMBER_EDIT_COOLDOWN_SECONDS
+    for gid, session in sessions.items():
+        session.mark_edited(gid, later)
+    tracked = sum(len(s.recent_edits) for s in sessions.values())
+    print(f"after ttl  tracked edits: dicts={members} sessions={tracked}")
+
+    # A guild flooded with distinct members stays at the cap
+    session = main.GuildSession(0)
+    for member_id in range(members):
+        session.mark_edited(member_id, now)
+    print(f"flooded    one guild, {members} members: tracked={len(session.recent_edits)} "
+          f"(cap {main.EDIT_DEBOUNCE_MAX_ENTRIES})")
+
+
+class _PreciseSelector(selectors.DefaultSelector):
+    """epoll rounds timeouts up to whole milliseconds; at scaled minutes that alone would add drift."""
+
+    def select(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            ready = super().select(0)
+            if ready or (deadline is not None and time.monotonic() >= deadline):
+                return ready
+            time.sleep(0.0002 if deadline is None else min(0.0002, max(0.0, deadline - time.monotonic())))
+
+
+class _DriftMessage:
+    def __init__(self, channel: "_DriftChannel", content: str):
+        self.id = next(channel.ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = main.bot.user
+        self.content = content
+
+    async def edit(self, content: str) -> None:
+        await self.channel.request()
+        self.content = content
+        self.channel.shown(content)
+
+    async def delete(self) -> None:
+        await self.channel.request()
+
+
+class _DriftChannel(main.discord.TextChannel):
+    """dark-chat with slow, jittery HTTP; records when each countdown value became visible."""
+
+    name = main.DARK_CHAT_CHANNEL_NAME
+
+    def __init__(self, guild, scale: float, rng: random.Random):
+        self.guild = guild
+        self.id = 5
+        self.ids = itertools.count(main.discord.utils.time_snowflake(main.discord.utils.utcnow()))
+        self.scale = scale
+        self.rng = rng
+        self.timeline: list = []
+
+    async def request(self) -> None:
+        # Usually ~0.3s; one request in 20 is stuck behind a rate limit for 5-20s
+        latency = self.rng.uniform(5, 20) if self.rng.random() < 0.05 else self.rng.uniform(0.1, 0.5)
+        await asyncio.sleep(latency * self.scale)
+
+    def shown(self, content: str) -> None:
+        if content.startswith("["):
+            self.timeline.append((asyncio.get_running_loop().time(), content))
+
+    async def send(self, content: str) -> _DriftMessage:
+        await self.request()
+        self.shown(content)
+        return _DriftMessage(self, content)
+
+    async def history(self, limit: int = 100):
+        return
+        yield
+
+    async def delete_messages(self, messages) -> None:
+        await self.request()
+
+    def get_partial_message(self, message_id: int):
+        return _DriftMessage(self, "")
+
+
+class _DriftVoice:
+    name = main.DARK_VOICE_CHANNEL_NAME
+    id = 7
+    members: list = []
+
+
+class _DriftGuild:
+    id = 1
+    voice_client = None
+    system_channel = None
+    me = None
+
+    def __init__(self, scale: float, rng: random.Random):
+        self.text_channels = [_DriftChannel(self, scale, rng)]
+        self.voice_channels = [_DriftVoice()]
+
+    def get_channel(self, channel_id: int):
+        return None
+
+
+async def _legacy_countdown(channel: _DriftChannel, label: str, number: int, minutes: int, minute: float) -> None:
+    """The old _countdown_task: sleep a minute, subtract a minute, edit."""
+    remaining = minutes
+    msg = await channel.send(main._countdown_content(label, number, remaining, minutes))
+    while remaining > 0:
+        await asyncio.sleep(minute)
+        remaining -= 1
+        await msg.edit(content=main._countdown_content(label, number, remaining, minutes))
+
+
+async def _legacy_cycle(guild: _DriftGuild, study: int, brk: int, minute: float) -> None:
+    """The old _cycle_task: a separate sleep per phase, then awaited announcements."""
+    channel = guild.text_channels[0]
+    count, countdown = 0, None
+    try:
+        while True:
+            countdown = asyncio.ensure_future(_legacy_countdown(channel, "S", count + 1, study, minute))
+            await asyncio.sleep(study * minute)
+            count += 1
+            await channel.send(f"✅ Finished {study}m. cycle: {count}.")
+            countdown.cancel()
+            countdown = asyncio.ensure_future(_legacy_countdown(channel, "B", 0, brk, minute))
+            await asyncio.sleep(brk * minute)
+            countdown.cancel()
+    finally:
+        if countdown is not None:
+            countdown.cancel()
+
+
+async def _loop_stalls(scale: float, rng: random.Random) -> None:
+    # Blocking work elsewhere on the loop: a 0.5-3s stall every couple of minutes
+    while True:
+        await asyncio.sleep(rng.uniform(60, 180) * scale)
+        time.sleep(rng.uniform(0.5, 3.0) * scale)
+
+
+_COUNTDOWN_RE = re.compile(r"\[(S|B) #(\d+): (\d+)/(\d+)\]")
+
+
+def _drift_report(name: str, timeline: list, t0: float, study: int, brk: int, minute: float, hours: float) -> None:
+    """Compare each shown value with the moment it was due on an ideal, drift-free schedule."""
+    period = study + brk
+    lateness = []
+    for shown_at, content in timeline:
+        label, number, remaining, total = _COUNTDOWN_RE.match(content).groups()
+        if label == "S":
+            due = (int(number) - 1) * period + study - int(remaining)
+        else:
+            # Break values do not carry the cycle number: take the nearest break with that value
+            offset = study + brk - int(remaining)
+            due = round(((shown_at - t0) / minute - offset) / period) * period + offset
+        lateness.append((shown_at - t0) / minute * 60.0 - due * 60.0)
+    # Phase boundaries: when each new segment's first value appeared
+    starts = [late for (_, content), late in zip(timeline, lateness) if content.endswith(
+        f"{study:02d}/{study:02d}]") or content.endswith(f"{brk:02d}/{brk:02d}]")]
+    ordered = sorted(lateness)
+    print(
+        f"{name:<9} {hours:g}h values shown={len(timeline)} lateness: p50={ordered[len(ordered) // 2]:.1f}s "
+        f"p99={ordered[int(len(ordered) * 0.99)]:.1f}s max={ordered[-1]:.1f}s | "
+        f"phase starts late by: first={starts[0]:.1f}s last={starts[-1]:.1f}s"
+    )
+
+
+def bench_drift(args: argparse.Namespace) -> None:
+    minute = args.minute
+    scale = minute / 60.0
+    main.SECONDS_PER_MINUTE = minute
+    main.ALERT_AUDIO_FULL_PATH = os.devnull + ".missing"
+    duration = args.hours * 60 * minute
+    for name in ("legacy", "deadlines"):
+        rng = random.Random(11)
+        guild = _DriftGuild(scale, rng)
+        main.bot.get_guild = lambda guild_id: guild
+
+        async def run() -> float:
+            stalls = asyncio.ensure_future(_loop_stalls(scale, rng))
+            t0 = asyncio.get_running_loop().time()
+            if name == "legacy":
+                task = asyncio.ensure_future(_legacy_cycle(guild, args.study, args.brk, minute))
+                await asyncio.sleep(duration)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+                await asyncio.sleep(0)
+            else:
+                main._start_cycle(guild, args.study, args.brk)
+                await asyncio.sleep(duration)
+                main._cancel_cycle(guild.id)
+            stalls.cancel()
+            return t0
+
+        with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+            main.session_store = main.SessionStore(os.path.join(tmp, "drift.db"))
+            main.scheduler = main.TimerScheduler()
+            loop = asyncio.SelectorEventLoop(_PreciseSelector())
+            try:
+                t0 = loop.run_until_complete(run())
+            finally:
+                main.session_store.flush_sync()
+                loop.close()
+        _drift_report(name, guild.text_channels[0].timeline, t0, args.study, args.brk, minute, args.hours)
+
+
+class _FloodVoice(main.discord.VoiceChannel):
+    def __init__(self, channel_id: int):
+        self.id = channel_id
+        self.name = main.DARK_VOICE_CHANNEL_NAME if channel_id == 7 else f"room-{channel_id}"
+
+
+class _FloodVoiceState:
+    __slots__ = ("channel", "mute")
+
+    def __init__(self, channel, mute: bool):
+        self.channel = channel
+        self.mute = mute
+
+
+class _FloodMember:
+    bot = False
+
+    def __init__(self, member_id: int, guild):
+        self.id = member_id
+        self.guild = guild
+        self.voice = None
+
+    async def edit(self, mute: bool, reason: str) -> None:
+        self.voice.mute = mute
+
+
+class _FloodGuild:
+    id = 1
+    system_channel = None
+
+    def __init__(self, rooms: int):
+        self.voice_channels = [_FloodVoice(7)] + [_FloodVoice(100 + i) for i in range(rooms)]
+        self.text_channels: list = []
+        self._by_id = {c.id: c for c in self.voice_channels}
+
+    def get_channel(self, channel_id: int):
+        return self._by_id.get(channel_id)
+
+
+async def _legacy_voice_state_update(member, before, after) -> None:
+    """on_voice_state_update as it was before join batching: resolve the channel, queue each join at once."""
+    if member.bot:
+        return
+    guild = member.guild
+    session = main.sessions.get(guild.id)
+    phase = session.phase if session is not None else None
+    if not phase:
+        return
+    target_channel = None
+    vc_id = session.voice_channel_id
+    if vc_id:
+        ch = guild.get_channel(vc_id)
+        if isinstance(ch, main.discord.VoiceChannel):
+            target_channel = ch
+    if target_channel is None:
+        target_channel = main._dark_channels(guild).dark_voice
+    if target_channel is None:
+        return
+    joined_channel = after.channel
+    left_channel = before.channel
+    if joined_channel and target_channel and joined_channel.id == target_channel.id:
+        if after.mute != (phase == "study"):
+            session.mark_edited(member.id, time.monotonic())
+            main._queue_mute(member, phase == "study", "Learning cycle server mute (join/update)")
+    elif left_channel and target_channel and left_channel.id == target_channel.id and (
+            not joined_channel or joined_channel.id != target_channel.id):
+        if member.voice is not None and member.voice.mute:
+            now = time.monotonic()
+            if not session.edited_recently(member.id, now):
+                session.mark_edited(member.id, now)
+                main._queue_mute(member, False, "Learning cycle cleanup (left channel)")
+
+
+def _voice_flood(guild: _FloodGuild, members: int, events: int, join_share: float) -> list:
+    """Synthetic voice-state updates: moves between other rooms, plus joins/leaves of dark-voice."""
+    rng = random.Random(3)
+    dark, rooms = guild.voice_channels[0], guild.voice_channels[1:]
+    people = [_FloodMember(10 ** 17 + i, guild) for i in range(members)]
+    where = {m.id: rng.choice(rooms) for m in people}
+    flood = []
+    for _ in range(events):
+        member = rng.choice(people)
+        before = _FloodVoiceState(where[member.id], False)
+        if rng.random() < join_share:
+            target = rooms[0] if before.channel is dark else dark
+        else:
+            target = rng.choice(rooms) if before.channel is not dark else dark
+        where[member.id] = target
+        flood.append((member, before, _FloodVoiceState(target, False)))
+    return flood
+
+
+def bench_voice(args: argparse.Namespace) -> None:
+    handlers = (("legacy", _legacy_voice_state_update), ("fast-path", main.on_voice_state_update))
+    for name, handler in handlers:
+        main.sessions.clear()
+        guild = _FloodGuild(rooms=20)
+        flood = _voice_flood(guild, args.members, args.events, args.join_share)
+        session = main._session(guild.id)
+        session.phase = "study"
+        session.voice_channel_id = 7
+
+        async def run() -> tuple:
+            main.scheduler = main.TimerScheduler()
+            dispatcher = main._mute_dispatcher(guild.id)
+            submits = 0
+            submit = dispatcher.submit
+
+            def counting_submit(member, mute, reason):
+                nonlocal submits
+                submits += 1
+                submit(member, mute, reason)
+
+            dispatcher.submit = counting_submit
+            start = time.perf_counter()
+            for member, before, after in flood:
+                member.voice = after
+                await handler(member, before, after)
+            elapsed = time.perf_counter() - start
+            # Let the join window close, then count what reached the dispatcher (not the paced edits)
+            await asyncio.sleep(main.JOIN_BATCH_WINDOW_SECONDS * 2)
+            pending = len(dispatcher._pending)
+            if dispatcher._worker is not None:
+                dispatcher._worker.cancel()
+            return elapsed, submits, pending
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, submits, pending = asyncio.run(run())
+        print(
+            f"{name:<10} events={len(flood)} {len(flood) / elapsed / 1000:.0f}k events/s "
+            f"({elapsed / len(flood) * 1e6:.2f}us/event) dispatcher submits={submits} queued edits={pending}"
+        )
+
+
+def bench_status(args: argparse.Namespace) -> None:
+    """Each STATUS_MODE in its own simulate.py run (virtual time, fake Discord); API calls compared."""
+    simulate = os.path.join(os.path.dirname(os.path.abspath(__file__)), "simulate.py")
+    baseline = None
+    for mode in ("edit", "timestamp", "hybrid"):
+        cmd = [sys.executable, simulate, "--guilds", str(args.guilds), "--days", str(args.days),
+               "--status-mode", mode, "--milestones", args.milestones, "--check"]
+        out = subprocess.run(cmd, capture_output=True, text=True)
+        if out.returncode != 0:
+            print(f"{mode:<10} simulate.py failed:\n{out.stdout}{out.stderr}")
+            return
+        edits = int(re.search(r"countdown edits=(\d+)", out.stdout).group(1))
+        calls = int(re.search(r"api calls=(\d+)", out.stdout).group(1))
+        per_guild_day = args.guilds * args.days
+        baseline = baseline or calls
+        print(
+            f"{mode:<10} api calls/guild/day={calls / per_guild_day:.0f} countdown edits/guild/day={edits / per_guild_day:.0f} "
+            f"edits/s at 5000 guilds={edits / per_guild_day * 5000 / 86400:.1f} calls vs edit={calls / baseline:.0%}"
+        )
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize()
+
+
+def _gateway_run(args: argparse.Namespace) -> None:
+    """One cold start of main.bot against the fake gateway, under the profile main was imported with."""
+    from fake_discord import FakeDiscord
+    from simulate import VirtualTimeLoop
+
+    main.ALERT_AUDIO_FULL_PATH = os.path.join(tempfile.gettempdir(), "no-alert.mp3")
+    rng = random.Random(3)
+    # Virtual time: chunk requests wait on the gateway send limit without the benchmark waiting too
+    loop = VirtualTimeLoop()
+    asyncio.set_event_loop(loop)
+    server = FakeDiscord(latency=0.05)
+    for _ in range(args.guilds):
+        large = rng.random() < args.large_share
+        server.add_guild(members=args.large_members if large else args.members, in_voice=args.in_voice)
+    gc.collect()
+    rss_before = _rss_bytes()
+
+    async def cold_start() -> float:
+        await server.attach(main.bot)
+        started = loop.time()
+        server.gateway.ready()
+        await main.bot.wait_until_ready()
+        return loop.time() - started
+
+    cpu = _cpu_seconds()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        waited = loop.run_until_complete(cold_start())
+    # Virtual time only passes while the loop is idle, so add the real time spent processing
+    ready = waited + time.perf_counter() - start
+    cpu = _cpu_seconds() - cpu
+    gc.collect()
+    print(json.dumps({
+        "ready": ready, "cpu": cpu, "rss": _rss_bytes() - rss_before,
+        "members": sum(len(guild.members) for guild in main.bot.guilds),
+        "chunk_requests": server.gateway.requests, "gateway_bytes": server.gateway.bytes,
+    }))
+
+
+def bench_gateway(args: argparse.Namespace) -> None:
+    if args.run:
+        _gateway_run(args)
+        return
+    total = 0
+    rng = random.Random(3)
+    for _ in range(args.guilds):
+        total += args.large_members if rng.random() < args.large_share else args.members
+    print(f"{args.guilds} guilds, {total} members ({args.large_share:.0%} with {args.large_members}), "
+          f"{args.in_voice} in voice per guild")
+    with tempfile.TemporaryDirectory() as tmp:
+        for profile in ("full", "lean"):
+            env = dict(os.environ, GATEWAY_PROFILE=profile, SESSION_DB_PATH=os.path.join(tmp, f"{profile}.db"))
+            cmd = [sys.executable, os.path.abspath(__file__), "gateway", "--run", "--guilds", str(args.guilds),
+                   "--members", str(args.members), "--large-share", str(args.large_share),
+                   "--large-members", str(args.large_members), "--in-voice", str(args.in_voice)]
+            out = subprocess.run(cmd, capture_output=True, text=True, env=env)
+            if out.returncode != 0:
+                print(f"{profile:<6} failed:\n{out.stderr}")
+                return
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            print(
+                f"{profile:<6} time-to-ready={r['ready']:.1f}s cpu={r['cpu']:.2f}s rss=+{r['rss'] / 2 ** 20:.0f}MiB "
+                f"members cached={r['members']} chunk requests={r['chunk_requests']} "
+                f"gateway={r['gateway_bytes'] / 2 ** 20:.1f}MiB"
+            )
+
+
+def bench_actors(args: argparse.Namespace) -> None:
+    """Messages per second through guild actors: one guild flooded, then the same load over many guilds."""
+
+    def noop(_):
+        pass
+
+    async def one_await(_):
+        await asyncio.sleep(0)
+
+    async def run(guilds: int, handler, mode: str) -> tuple:
+        main.sessions.clear()
+        actors = [main._actor(guild_id) for guild_id in range(1, guilds + 1)]
+        per_actor = args.messages // guilds
+
+        async def sender(actor) -> None:
+            for i in range(per_actor):
+                if mode == "call":
+                    await actor.call("bench", handler, i)
+                else:
+                    await actor.send("bench", handler, i)
+
+        backpressure = sum(main.actor_backpressure_total.values.values())
+        start = time.perf_counter()
+        await asyncio.gather(*(sender(actor) for actor in actors))
+        while any(len(actor) or (actor._worker is not None and not actor._worker.done()) for actor in actors):
+            await asyncio.sleep(0)
+        elapsed = time.perf_counter() - start
+        return elapsed, per_actor * guilds, sum(main.actor_backpressure_total.values.values()) - backpressure
+
+    for guilds in (int(g) for g in args.guilds.split(",")):
+        for label, handler, mode in (("send sync", noop, "send"), ("send async", one_await, "send"),
+                                     ("call sync", noop, "call")):
+            elapsed, sent, waited = asyncio.run(run(guilds, handler, mode))
+            print(
+                f"guilds={guilds:<6} {label:<11} {sent / elapsed / 1000:6.0f}k msgs/s "
+                f"({sent / guilds / elapsed / 1000:.1f}k/s per actor, {elapsed / sent * 1e6:.2f}us/msg) "
+                f"backpressure waits={waited:.0f}"
+            )
+
+
+def _intents_run(args: argparse.Namespace) -> None:
+    """Chat traffic through the fake gateway into main.bot, under the COMMAND_MODE main was imported with."""
+    from fake_discord import FakeDiscord
+
+    main.ALERT_AUDIO_FULL_PATH = os.path.join(tempfile.gettempdir(), "no-alert.mp3")
+    if args.keep_message_events:
+        # Message events still subscribed, only their content withheld
+        main.bot._connection._intents.guild_messages = True
+    rng = random.Random(5)
+    words = ["study", "break", "anyone", "here", "lol", "ok", "thanks", "math", "exam", "tomorrow", "done", "brb"]
+    server = FakeDiscord(latency=0.0)
+    guilds = [server.add_guild(members=args.members, in_voice=0) for _ in range(args.guilds)]
+
+    async def run() -> dict:
+        await server.attach(main.bot)
+        server.gateway.ready()
+        await main.bot.wait_until_ready()
+        # Messages are built up front: only their delivery and handling is measured
+        traffic = []
+        for _ in range(args.messages):
+            guild = rng.choice(guilds)
+            author = rng.choice(server.member_ids(guild))
+            content = " ".join(rng.choice(words) for _ in range(rng.randint(2, 30)))
+            traffic.append(server.create_message(guild, guild.general_id, author, content))
+        idle = len(asyncio.all_tasks())
+        events, sent = sum(server.gateway.events.values()), server.gateway.bytes
+        cpu = time.process_time()
+        for i, payload in enumerate(traffic):
+            server.gateway.dispatch("MESSAGE_CREATE", payload)
+            if i % 100 == 99:
+                # Let the on_message handlers run, as the websocket reader would between frames
+                while len(asyncio.all_tasks()) > idle:
+                    await asyncio.sleep(0)
+        while len(asyncio.all_tasks()) > idle:
+            await asyncio.sleep(0)
+        cpu = time.process_time() - cpu
+        return {"cpu": cpu, "bytes": server.gateway.bytes - sent,
+                "delivered": sum(server.gateway.events.values()) - events,
+                "withheld": sum(server.gateway.withheld.values())}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(run())
+    print(json.dumps(result))
+
+
+def bench_intents(args: argparse.Namespace) -> None:
+    """
+    The same chat traffic (no commands) with "!" commands and the message_content intent, with message
+    events but no content, and with COMMAND_MODE=slash (no message events at all).
+    CPU covers decoding, parsing and on_message handling per delivered message; the fake gateway's JSON
+    encoding is included too, standing in for the inflate the real websocket reader does.
+    """
+    if args.run:
+        _intents_run(args)
+        return
+    print(f"{args.guilds} guilds x {args.members} members, {args.messages} chat messages")
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, mode, extra in (("prefix+content", "both", []), ("no content", "slash", ["--keep-message-events"]),
+                                   ("slash", "slash", [])):
+            env = dict(os.environ, COMMAND_MODE=mode, SESSION_DB_PATH=os.path.join(tmp, f"{label}.db"))
+            cmd = [sys.executable, os.path.abspath(__file__), "intents", "--run", "--guilds", str(args.guilds),
+                   "--members", str(args.members), "--messages", str(args.messages)] + extra
+            out = subprocess.run(cmd, capture_output=True, text=True, env=env)
+            if out.returncode != 0:
+                print(f"{label:<15} failed:\n{out.stderr}")
+                return
+            r = json.loads(out.stdout.strip().splitlines()[-1])
+            baseline = baseline or r
+            print(
+                f"{label:<15} delivered={r['delivered']:<7} withheld={r['withheld']:<7} "
+                f"gateway={r['bytes'] / 2 ** 20:.2f}MiB ({r['bytes'] / baseline['bytes']:.0%}) "
+                f"cpu={r['cpu']:.2f}s ({r['cpu'] / args.messages * 1e6:.1f}us/message, {r['cpu'] / baseline['cpu']:.0%})"
+            )
+
+
+def _cluster_run(args: argparse.Namespace) -> None:
+    """
+    One cluster worker: main.bot runs the shards main was imported with (SHARD_IDS) against a fake Discord
+    that holds every guild but only delivers those shards' guilds. Its guilds run cycles while chat and
+    voice traffic for them is fed in as fast as the worker handles it.
+    """
+    from fake_discord import GLOBAL_LIMIT_PER_SECOND, FakeDiscord
+
+    main.SECONDS_PER_MINUTE = args.minute
+    main.ALERT_AUDIO_FULL_PATH = os.path.join(tempfile.gettempdir(), "no-alert.mp3")
+    rng = random.Random(args.index)
+    words = ["study", "break", "anyone", "here", "lol", "ok", "thanks", "math", "exam", "tomorrow", "done", "brb"]
+    # The global limit is per bot token: each worker's server grants its share
+    server = FakeDiscord(latency=args.latency, global_limit=max(1, GLOBAL_LIMIT_PER_SECOND // int(args.workers)))
+    for _ in range(args.guilds):
+        server.add_guild(members=args.members)
+    boundaries = {}
+    begin_segment = main._begin_segment
+
+    async def traced(cycle, phase, *a, **kwargs):
+        started_at = kwargs.get("started_at")
+        boundaries.setdefault(cycle.guild.id, []).append((started_at if started_at is not None else main.scheduler.time(), phase))
+        return await begin_segment(cycle, phase, *a, **kwargs)
+
+    main._begin_segment = traced
+
+    async def run() -> dict:
+        loop = asyncio.get_running_loop()
+        await server.attach(main.bot)
+        server.gateway.ready()
+        await main.bot.wait_until_ready()
+        guilds = [guild for guild in server.guilds.values() if main.bot.get_guild(guild.id) is not None]
+        # All workers start together, once every one of them is up
+        await asyncio.sleep(max(0.0, args.start_at - time.time()))
+        for guild in guilds:
+            server.gateway.message(guild, guild.general_id, guild.owner_id, f"!learn {args.study} {args.brk}")
+        segments = [args.study if i % 2 == 0 else args.brk for i in range(args.transitions)]
+        deadline = loop.time() + (sum(segments) + 0.5) * args.minute
+        events = 0
+        cpu, start = time.process_time(), loop.time()
+        # This worker's share of the offered traffic (0: as fast as it takes it)
+        rate = args.rate * len(guilds) / args.guilds
+        while loop.time() < deadline:
+            if rate and events >= (loop.time() - start) * rate:
+                await asyncio.sleep(0.01)
+                continue
+            for _ in range(50):
+                guild = rng.choice(guilds)
+                author = rng.choice(server.member_ids(guild))
+                if rng.random() < 0.8:
+                    content = " ".join(rng.choice(words) for _ in range(rng.randint(2, 30)))
+                    server.gateway.message(guild, guild.general_id, author, content)
+                elif guild.voice_states.get(author, {}).get("channel_id") == str(guild.lobby_id):
+                    server.gateway.voice(guild, author, None)
+                elif author not in guild.voice_states:
+                    server.gateway.voice(guild, author, guild.lobby_id)
+                events += 1
+            # Let the event handlers run, as the websocket reader would between frames; handlers still
+            # waiting on the API are left to finish while the next frames are read
+            while sum(task.get_name().startswith("discord.py: on_") for task in asyncio.all_tasks()) > 100:
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+        elapsed, cpu = loop.time() - start, time.process_time() - cpu
+        latency = []
+        for when, guild_id, user_id, mute, reason in server.mute_edits:
+            if not reason.startswith("Learning cycle") or reason.startswith("Learning cycle server mute (join"):
+                continue
+            phase = "study" if mute else "break"
+            starts = [t for t, p in boundaries.get(guild_id, ()) if p == phase and t <= when]
+            if starts:
+                latency.append(when - starts[-1])
+        await main.session_store.flush()
+        return {"guilds": len(guilds), "events": events, "elapsed": elapsed, "cpu": cpu, "latency": latency,
+                "transitions": sum(len(b) - 1 for b in boundaries.values()),
+                "ratelimited": sum(server.ratelimited.values())}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = asyncio.run(run())
+    print(json.dumps(result))
+
+
+def bench_cluster(args: argparse.Namespace) -> None:
+    """
+    Throughput and phase-transition latency as the same guilds are spread over more worker processes.
+    With --rate the traffic is offered at a fixed total rate instead of as fast as the workers take it.
+    Every worker gets its shard range and environment from main's cluster supervisor helpers and they
+    share one session store, as in a CLUSTER_WORKERS deployment.
+    """
+    if args.run:
+        _cluster_run(args)
+        return
+
+    def percentile(values: list, q: float) -> float:
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+    print(f"{args.guilds} guilds x {args.members} members on {args.shards} shards, {os.cpu_count()} CPUs, "
+          f"minute={args.minute}s study={args.study} break={args.brk} offered={args.rate or 'flood'}")
+    for workers in (int(w) for w in args.workers.split(",")):
+        with tempfile.TemporaryDirectory() as tmp:
+            start_at = time.time() + 3.0 + workers
+            procs = []
+            for index, shard_ids in enumerate(main._shard_ranges(workers, max(args.shards, workers))):
+                env = main._worker_env(index, shard_ids, max(args.shards, workers), workers)
+                env["SESSION_DB_PATH"] = os.path.join(tmp, "sessions.db")
+                cmd = [sys.executable, os.path.abspath(__file__), "cluster", "--run", "--index", str(index),
+                       "--workers", str(workers), "--start-at", str(start_at), "--guilds", str(args.guilds),
+                       "--members", str(args.members), "--minute", str(args.minute), "--study", str(args.study),
+                       "--break", str(args.brk), "--transitions", str(args.transitions), "--latency", str(args.latency),
+                       "--rate", str(args.rate)]
+                procs.append(subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, env=env))
+            results = []
+            for proc in procs:
+                out, err = proc.communicate()
+                if proc.returncode != 0:
+                    print(f"workers={workers} failed:\n{err}")
+                    return
+                results.append(json.loads(out.strip().splitlines()[-1]))
+        events = sum(r["events"] for r in results)
+        elapsed = max(r["elapsed"] for r in results)
+        latency = [value for r in results for value in r["latency"]]
+        print(
+            f"workers={workers:<3} guilds/worker={'/'.join(str(r['guilds']) for r in results):<12} "
+            f"events={events / elapsed:7.0f}/s cpu={sum(r['cpu'] for r in results):.1f}s "
+            f"transitions={sum(r['transitions'] for r in results):<4} mute after boundary "
+            f"p50={percentile(latency, 0.5) * 1000:.0f}ms p99={percentile(latency, 0.99) * 1000:.0f}ms "
+            f"max={max(latency, default=0.0) * 1000:.0f}ms 429s={sum(r['ratelimited'] for r in results)}"
+        )
+
+
+# A fake cluster worker: plays its shard's plan, one step per start (the last step repeats). "crash" fails at
+# once, "stable-crash" fails after outliving CLUSTER_STABLE_SECONDS, "exit" finishes cleanly, "serve" runs until
+# SIGINT like a real worker and "hang" ignores SIGINT
+_FAKE_WORKER = """
+import json, os, signal, sys, time
+shard = os.environ["SHARD_IDS"]
+unit = float(os.environ["FAKE_WORKER_UNIT"])
+plan = json.loads(os.environ["FAKE_WORKER_PLAN"])[shard]
+with open(os.path.join(os.environ["FAKE_WORKER_DIR"], shard), "a+") as f:
+    f.seek(0)
+    runs = len(f.read())
+    f.write(".")
+step = plan[min(runs, len(plan) - 1)]
+if step == "crash":
+    time.sleep(unit / 4)
+    sys.exit(1)
+if step == "stable-crash":
+    time.sleep(unit * 6)
+    sys.exit(1)
+if step == "exit":
+    time.sleep(unit / 2)
+    sys.exit(0)
+if step == "hang":
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+try:
+    while True:
+        time.sleep(1)
+except KeyboardInterrupt:
+    sys.exit(0)
+"""
+
+# What each fake worker does on its successive starts
+_SUPERVISE_PLAN = {
+    "0": ["crash"],
+    "1": ["exit"],
+    "2": ["crash", "stable-crash", "serve"],
+    "3": ["hang"],
+    "4": ["serve"],
+}
+
+
+def _supervise_run(args: argparse.Namespace) -> None:
+    """
+    main._supervise over fake workers, with every cluster delay scaled to --interval; SIGTERM arrives after
+    --stop-after seconds. Prints one JSON line per supervisor log event, with its monotonic time.
+    """
+    unit = args.interval
+    main.SHARD_COUNT = main.CLUSTER_WORKERS = len(_SUPERVISE_PLAN)
+    main.IDENTIFY_INTERVAL_SECONDS = unit
+    main.CLUSTER_RESTART_BACKOFF_SECONDS = unit
+    main.CLUSTER_RESTART_BACKOFF_MAX_SECONDS = unit * 4
+    main.CLUSTER_STABLE_SECONDS = unit * 5
+    main.CLUSTER_STOP_TIMEOUT_SECONDS = unit * 3
+    main.CLUSTER_POLL_SECONDS = unit / 10
+    main._worker_command = lambda: [sys.executable, "-c", _FAKE_WORKER]
+    events = []
+    main._log = lambda level, event, **fields: events.append(dict(fields, event=event, at=time.monotonic()))
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(FAKE_WORKER_UNIT=str(unit), FAKE_WORKER_PLAN=json.dumps(_SUPERVISE_PLAN), FAKE_WORKER_DIR=tmp)
+        threading.Timer(args.stop_after, os.kill, (os.getpid(), signal.SIGTERM)).start()
+        main._supervise("")
+    events.append({"event": "bench.returned", "at": time.monotonic()})
+    for event in events:
+        print(json.dumps(event))
+
+
+def bench_supervise(args: argparse.Namespace) -> None:
+    """
+    The cluster supervisor against fake workers that crash, crash after a stable run, exit cleanly, serve
+    until stopped or ignore the stop. Checks identify spacing between all starts, restart backoff (doubling,
+    capped, reset after a stable run), clean exits not restarted, and SIGTERM stopping every worker, with
+    the hung one killed after CLUSTER_STOP_TIMEOUT_SECONDS. Exits 1 on any problem.
+    """
+    if args.run:
+        _supervise_run(args)
+        return
+    unit = args.interval
+    cmd = [sys.executable, os.path.abspath(__file__), "supervise", "--run", "--interval", str(unit),
+           "--stop-after", str(args.stop_after)]
+    proc = subprocess.run(cmd, capture_output=True, text=True, timeout=args.stop_after + unit * 20 + 30)
+    if proc.returncode != 0:
+        print(f"supervisor run failed:\n{proc.stderr}")
+        sys.exit(1)
+    events = [json.loads(line) for line in proc.stdout.splitlines()]
+    t0 = events[0]["at"]
+    by_worker = {}
+    for event in events:
+        if "worker" in event:
+            by_worker.setdefault(str(event["worker"]), []).append(event)
+    problems = []
+    # Popen runs between the supervisor's clock reading and the log line
+    slack = unit / 10
+
+    starts = [e for e in events if e["event"] == "cluster.worker_started"]
+    gaps = [b["at"] - a["at"] for a, b in zip(starts, starts[1:])]
+    if min(gaps, default=unit) < unit - slack:
+        problems.append(f"worker starts {min(gaps):.3f}s apart, identify interval is {unit}s")
+    stopping = next((e for e in events if e["event"] == "cluster.stopping"), None)
+    if stopping is None:
+        problems.append("SIGTERM did not stop the cluster")
+    elif any(e["at"] > stopping["at"] for e in starts):
+        problems.append("a worker was started after the stop")
+
+    crashes = [e for e in by_worker.get("0", ()) if e["event"] == "cluster.worker_failed"]
+    expected = [min(unit * 2 ** i, unit * 4) for i in range(len(crashes))]
+    if [round(e["restart_in"], 6) for e in crashes] != [round(b, 6) for b in expected]:
+        problems.append(f"crash-looping worker backoff {[e['restart_in'] for e in crashes]}, expected {expected}")
+    history = by_worker.get("0", ())
+    for failed, started in zip(history, history[1:]):
+        if failed["event"] == "cluster.worker_failed" and started["at"] - failed["at"] < failed["restart_in"] - slack:
+            problems.append(f"worker 0 restarted {started['at'] - failed['at']:.3f}s after failing, "
+                            f"backoff was {failed['restart_in']}s")
+
+    clean = by_worker.get("1", ())
+    if [e["event"] for e in clean] != ["cluster.worker_started", "cluster.worker_exited"] or clean[-1].get("code") != 0:
+        problems.append(f"cleanly exiting worker: {[e['event'] for e in clean]}")
+
+    stable = [e for e in by_worker.get("2", ()) if e["event"] == "cluster.worker_failed"]
+    if [round(e["restart_in"], 6) for e in stable] != [round(unit, 6)] * 2:
+        problems.append(f"stable-run worker backoff {[e['restart_in'] for e in stable]}, expected {[unit, unit]}")
+
+    killed = [e for e in events if e["event"] == "cluster.worker_killed"]
+    if [str(e["worker"]) for e in killed][:1] != ["3"] or any(str(e["worker"]) != "3" for e in killed):
+        problems.append(f"killed workers {[e['worker'] for e in killed]}, expected only the hung worker 3")
+    elif stopping is not None and killed[0]["at"] - stopping["at"] < unit * 3:
+        problems.append(f"hung worker killed {killed[0]['at'] - stopping['at']:.3f}s after the stop")
+    for worker in ("2", "4"):
+        exits = [e for e in by_worker.get(worker, ()) if e["event"] == "cluster.worker_exited"]
+        if not exits or exits[-1]["at"] < (stopping or exits[-1])["at"]:
+            problems.append(f"serving worker {worker} did not exit on the stop")
+    if events[-1]["event"] != "bench.returned" or events[-2]["event"] != "cluster.worker_exited":
+        problems.append("supervisor did not return after its last worker exited")
+
+    print(f"{len(_SUPERVISE_PLAN)} fake workers, identify interval {unit}s, SIGTERM at {args.stop_after}s")
+    for worker, history in sorted(by_worker.items()):
+        line = " ".join(
+            f"{e['at'] - t0:.2f}:{e['event'].split('.')[-1]}"
+            + (f"(restart_in={e['restart_in']:g})" if "restart_in" in e else "")
+            for e in history
+        )
+        print(f"worker {worker} {_SUPERVISE_PLAN[worker]}: {line}")
+    print(f"starts={len(starts)} min_gap={min(gaps, default=0.0):.3f}s "
+          f"stop_to_kill={(killed[0]['at'] - stopping['at']) if killed and stopping else 0.0:.3f}s "
+          f"stop_to_return={events[-1]['at'] - (stopping or events[-1])['at']:.3f}s")
+    for problem in problems:
+        print("PROBLEM:", problem)
+    if problems:
+        sys.exit(1)
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("scheduler", help="per-guild sleeping tasks vs the shared timer scheduler")
+    p.add_argument("--guilds", type=int, default=10000)
+    p.add_argument("--period", type=float, default=1.0, help="seconds between wakeups (one scaled minute)")
+    p.add_argument("--duration", type=float, default=5.0)
+    p.set_defaults(func=bench_scheduler)
+
+    p = sub.add_parser("alert", help="per-play ffmpeg decode+encode vs pre-encoded shared frames")
+    p.add_argument("--plays", type=int, default=20)
+    p.set_defaults(func=bench_alert)
+
+    p = sub.add_parser("purge", help="sequential !clear vs the concurrent purge engine on a fake HTTP backend")
+    p.add_argument("--channels", type=int, default=20)
+    p.add_argument("--messages", type=int, default=3000)
+    p.add_argument("--latency", type=float, default=0.05, help="seconds per fake HTTP request")
+    p.set_defaults(func=bench_purge)
+
+    p = sub.add_parser("store", help="session store write cost per phase transition and resume time")
+    p.add_argument("--sessions", type=int, default=10000)
+    p.add_argument("--transitions", type=int, default=3)
+    p.add_argument("--guilds", type=int, default=200, help="guilds started against the fake Discord for the full resume")
+    p.add_argument("--members", type=int, default=5, help="members per guild, all in dark-voice")
+    p.add_argument("--latency", type=float, default=0.05, help="fake HTTP round trip in seconds")
+    p.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    p.set_defaults(func=bench_store)
+
+    p = sub.add_parser("memory", help="per-guild state: one dict per field vs slotted GuildSession")
+    p.add_argument("--guilds", type=int, default=100000)
+    p.add_argument("--members", type=int, default=1000000, help="members with a recorded mute edit")
+    p.set_defaults(func=bench_memory)
+
+    p = sub.add_parser("drift", help="countdown lateness vs ideal phase boundaries over a long scaled run")
+    p.add_argument("--hours", type=float, default=24.0)
+    p.add_argument("--minute", type=float, default=0.03, help="real seconds per simulated minute")
+    p.add_argument("--study", type=int, default=50)
+    p.add_argument("--break", dest="brk", type=int, default=10)
+    p.set_defaults(func=bench_drift)
+
+    p = sub.add_parser("voice", help="on_voice_state_update throughput under a synthetic voice-state flood")
+    p.add_argument("--members", type=int, default=2000)
+    p.add_argument("--events", type=int, default=200000)
+    p.add_argument("--join-share", type=float, default=0.1, help="fraction of events entering or leaving dark-voice")
+    p.set_defaults(func=bench_voice)
+
+    p = sub.add_parser("status", help="API calls per STATUS_MODE (edit, timestamp, hybrid) over simulated days")
+    p.add_argument("--guilds", type=int, default=20)
+    p.add_argument("--days", type=float, default=1.0)
+    p.add_argument("--milestones", default="10,5,1", help="hybrid mode edit points (minutes left)")
+    p.set_defaults(func=bench_status)
+
+    p = sub.add_parser("gateway", help="cold start with GATEWAY_PROFILE=full vs lean: time-to-ready, RSS, members cached")
+    p.add_argument("--guilds", type=int, default=1000)
+    p.add_argument("--members", type=int, default=100, help="members per regular guild")
+    p.add_argument("--large-share", type=float, default=0.1, help="fraction of guilds above the large threshold")
+    p.add_argument("--large-members", type=int, default=1000, help="members per large guild")
+    p.add_argument("--in-voice", type=int, default=5, help="members per guild in dark-voice at startup")
+    p.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    p.set_defaults(func=bench_gateway)
+
+    p = sub.add_parser("actors", help="guild actor mailbox throughput: one flooded guild vs many")
+    p.add_argument("--messages", type=int, default=200000)
+    p.add_argument("--guilds", default="1,100,1000", help="comma-separated guild counts")
+    p.set_defaults(func=bench_actors)
+
+    p = sub.add_parser("intents", help="chat traffic cost with \"!\" commands vs COMMAND_MODE=slash: gateway bytes, CPU")
+    p.add_argument("--guilds", type=int, default=100)
+    p.add_argument("--members", type=int, default=50)
+    p.add_argument("--messages", type=int, default=50000)
+    p.add_argument("--keep-message-events", action="store_true", help=argparse.SUPPRESS)
+    p.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    p.set_defaults(func=bench_intents)
+
+    p = sub.add_parser("cluster", help="CLUSTER_WORKERS scaling: event throughput and phase-transition latency per worker count")
+    p.add_argument("--guilds", type=int, default=40)
+    p.add_argument("--members", type=int, default=5, help="members per guild, all in dark-voice")
+    p.add_argument("--shards", type=int, default=4, help="SHARD_COUNT (raised to the worker count if below it)")
+    p.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    p.add_argument("--minute", type=float, default=10.0, help="real seconds per cycle minute")
+    p.add_argument("--study", type=int, default=1)
+    p.add_argument("--break", dest="brk", type=int, default=1)
+    p.add_argument("--transitions", type=int, default=3, help="phase transitions per guild")
+    p.add_argument("--latency", type=float, default=0.02, help="fake HTTP round trip in seconds")
+    p.add_argument("--rate", type=float, default=0.0, help="chat and voice events per second offered in total (0: flood)")
+    p.add_argument("--index", type=int, default=0, help=argparse.SUPPRESS)
+    p.add_argument("--start-at", type=float, default=0.0, help=argparse.SUPPRESS)
+    p.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    p.set_defaults(func=bench_cluster)
+
+    p = sub.add_parser("supervise", help="cluster supervisor restarts, backoff, identify spacing and stop with fake workers")
+    p.add_argument("--interval", type=float, default=0.2, help="identify interval in seconds; the other cluster delays scale with it")
+    p.add_argument("--stop-after", type=float, default=4.0, help="seconds until the supervisor gets SIGTERM")
+    p.add_argument("--run", action="store_true", help=argparse.SUPPRESS)
+    p.set_defaults(func=bench_supervise)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,749 @@
+"""
+Offline stand-in for the parts of Discord this bot talks to.
+
+FakeDiscord keeps guilds, channels, members, voice states and messages in memory. It answers
+discord.py's REST calls through a fake aiohttp session with per-route rate limits and 429s
+shaped like the real API, so discord.py's own rate-limit handling runs unchanged. Gateway
+events (READY, GUILD_CREATE, MESSAGE_CREATE, VOICE_STATE_UPDATE, ...) are JSON-encoded and fed
+to the client's ConnectionState parsers, the same path the real websocket takes.
+
+    server = FakeDiscord(latency=0.05)
+    for _ in range(10):
+        server.add_guild(members=40)
+    await server.attach(main.bot)
+    server.gateway.ready()
+    server.gateway.message(guild, guild.general_id, guild.owner_id, "!learn 50 10")
+    server.gateway.interaction(guild, guild.general_id, guild.owner_id, "learn", {"study_minutes": 50, "break_minutes": 10})
+"""
+import asyncio
+import datetime
+import json
+import random
+import re
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+import discord
+from multidict import CIMultiDict
+
+API_PREFIX = urlsplit(discord.http.Route.BASE).path
+# Discord only sends offline members of guilds below this size in GUILD_CREATE
+LARGE_THRESHOLD = 250
+GLOBAL_LIMIT_PER_SECOND = 50
+MEMBER_CHUNK_SIZE = 1000
+# discord.py paces gateway sends (e.g. member chunk requests) at this many per minute; Discord allows 120
+GATEWAY_SENDS_PER_MINUTE = 110
+# Message events, subject to the GUILD_MESSAGES and MESSAGE_CONTENT intents
+MESSAGE_EVENTS = ("MESSAGE_CREATE", "MESSAGE_UPDATE", "MESSAGE_DELETE", "MESSAGE_DELETE_BULK")
+# Slash-command option types for values passed to FakeGateway.interaction without a synced command
+OPTION_TYPES = {bool: 5, int: 4, str: 3}
+EPHEMERAL_FLAG = 64
+GLOBAL_EXEMPT_BUCKETS = ("interaction-callback", "webhook-execute")
+
+
+def _route_label(method: str, pattern: str) -> str:
+    return method + " " + re.sub(r"[(][?]P<(\w+)>[^)]*[)]", r"{\1}", pattern)
+
+
+def _iso(wall: float) -> str:
+    return datetime.datetime.fromtimestamp(wall, datetime.timezone.utc).isoformat()
+
+
+class _Bucket:
+    """Server-side fixed window, like Discord's: `limit` requests per `per` seconds."""
+
+    __slots__ = ("limit", "per", "remaining", "reset_at")
+
+    def __init__(self, limit: int, per: float):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def take(self, now: float) -> Optional[float]:
+        """Consume one request; returns retry_after when the window is exhausted."""
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per
+        if self.remaining <= 0:
+            return self.reset_at - now
+        self.remaining -= 1
+        return None
+
+
+class FakeGuild:
+    """One guild's server-side state. Payloads are kept in Discord's JSON shapes."""
+
+    def __init__(self, server: "FakeDiscord", guild_id: int, name: str):
+        self.server = server
+        self.id = guild_id
+        self.name = name
+        self.owner_id = 0
+        self.roles: List[Dict[str, Any]] = []
+        self.channels: Dict[int, Dict[str, Any]] = {}
+        self.members: Dict[int, Dict[str, Any]] = {}
+        # user_id -> voice state (only members connected to a voice channel)
+        self.voice_states: Dict[int, Dict[str, Any]] = {}
+        # channel_id -> {message_id: payload}, oldest first
+        self.messages: Dict[int, Dict[int, Dict[str, Any]]] = {}
+        self.general_id = 0
+        self.dark_voice_id = 0
+        self.lobby_id = 0
+        self.bot_role_id = 0
+
+    def shard(self, shard_count: int) -> int:
+        """The gateway shard this guild is on, for a bot with `shard_count` shards."""
+        return (self.id >> 22) % shard_count
+
+    def add_channel(self, name: str, kind: int) -> Dict[str, Any]:
+        channel_id = self.server.snowflake()
+        payload: Dict[str, Any] = {
+            "id": str(channel_id), "guild_id": str(self.id), "type": kind, "name": name,
+            "position": len(self.channels), "permission_overwrites": [], "parent_id": None, "nsfw": False,
+        }
+        if kind == discord.ChannelType.voice.value:
+            payload.update(bitrate=64000, user_limit=0, rtc_region=None)
+        else:
+            payload.update(topic=None, last_message_id=None, rate_limit_per_user=0)
+            self.messages[channel_id] = {}
+        self.channels[channel_id] = payload
+        self.server.channel_guild[channel_id] = self
+        return payload
+
+    def add_member(self, user: Dict[str, Any], roles: Tuple[int, ...] = ()) -> Dict[str, Any]:
+        member = {
+            "user": user, "roles": [str(r) for r in roles], "joined_at": _iso(self.server.wall()), "deaf": False, "mute": False,
+            "flags": 0, "nick": None, "avatar": None, "premium_since": None, "pending": False,
+            "communication_disabled_until": None,
+        }
+        self.members[int(user["id"])] = member
+        return member
+
+    def join_voice(self, user_id: int, channel_id: Optional[int]) -> Dict[str, Any]:
+        """Move a member (None disconnects). Returns the VOICE_STATE_UPDATE payload."""
+        member = self.members[user_id]
+        state = self.voice_states.get(user_id)
+        if channel_id is None:
+            self.voice_states.pop(user_id, None)
+        elif state is None:
+            state = self.voice_states[user_id] = {
+                "user_id": str(user_id), "session_id": f"s{user_id}", "deaf": member["deaf"], "mute": member["mute"],
+                "self_deaf": False, "self_mute": False, "self_video": False, "suppress": False,
+                "request_to_speak_timestamp": None, "channel_id": str(channel_id),
+            }
+        else:
+            state["channel_id"] = str(channel_id)
+        return self.voice_event(user_id, channel_id)
+
+    def voice_event(self, user_id: int, channel_id: Optional[int]) -> Dict[str, Any]:
+        member = self.members[user_id]
+        return {
+            "guild_id": str(self.id), "channel_id": None if channel_id is None else str(channel_id),
+            "user_id": str(user_id), "member": member, "session_id": f"s{user_id}",
+            "deaf": member["deaf"], "mute": member["mute"], "self_deaf": False, "self_mute": False,
+            "self_video": False, "suppress": False, "request_to_speak_timestamp": None,
+        }
+
+    def payload(self, with_members: bool) -> Dict[str, Any]:
+        """GUILD_CREATE payload. Large guilds only carry the bot and members in voice."""
+        if with_members and len(self.members) <= LARGE_THRESHOLD:
+            members = list(self.members.values())
+        else:
+            wanted = set(self.voice_states) | {self.server.bot_user_id}
+            members = [self.members[user_id] for user_id in wanted if user_id in self.members]
+        return {
+            "id": str(self.id), "name": self.name, "icon": None, "owner_id": str(self.owner_id),
+            "afk_timeout": 300, "verification_level": 0, "default_message_notifications": 0,
+            "explicit_content_filter": 0, "mfa_level": 0, "features": [], "roles": self.roles, "emojis": [],
+            "stickers": [], "channels": list(self.channels.values()), "members": members,
+            "voice_states": list(self.voice_states.values()), "member_count": len(self.members),
+            "large": len(self.members) > LARGE_THRESHOLD, "unavailable": False, "system_channel_id": None,
+            "premium_tier": 0, "preferred_locale": "en-US", "nsfw_level": 0, "threads": [],
+            "stage_instances": [], "guild_scheduled_events": [], "soundboard_sounds": [],
+        }
+
+
+class _Response:
+    """Just enough of aiohttp.ClientResponse for discord.py's HTTPClient.request."""
+
+    def __init__(self, status: int, body: Any, headers: Dict[str, str]):
+        self.status = status
+        self.reason = {200: "OK", 204: "No Content", 400: "Bad Request", 403: "Forbidden",
+                       404: "Not Found", 429: "Too Many Requests"}.get(status, "Error")
+        self.headers = CIMultiDict(headers)
+        if body is None:
+            self._text = ""
+        else:
+            self._text = json.dumps(body)
+            self.headers["content-type"] = "application/json"
+
+    async def text(self, encoding: str = "utf-8") -> str:
+        return self._text
+
+
+class _RequestContext:
+    def __init__(self, server: "FakeDiscord", method: str, url: str, kwargs: Dict[str, Any]):
+        self._call = server.handle(method, url, kwargs)
+
+    async def __aenter__(self) -> _Response:
+        return await self._call
+
+    async def __aexit__(self, *exc: Any) -> None:
+        return None
+
+
+class _FakeSession:
+    """Replaces the aiohttp.ClientSession inside discord.py's HTTPClient."""
+
+    closed = False
+
+    def __init__(self, server: "FakeDiscord"):
+        self._server = server
+
+    def request(self, method: str, url: str, **kwargs: Any) -> _RequestContext:
+        return _RequestContext(self._server, method, url, kwargs)
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+class _FakeWebSocket:
+    """The gateway requests the client can make: only member chunking is supported."""
+
+    latency = 0.0
+
+    def __init__(self, gateway: "FakeGateway", shard_id: Optional[int] = None):
+        self._gateway = gateway
+        self.shard_id = shard_id
+        self._sends = _Bucket(GATEWAY_SENDS_PER_MINUTE, 60.0)
+
+    async def request_chunks(self, guild_id: int, query: Optional[str] = None, *, limit: int,
+                             user_ids: Optional[List[int]] = None, presences: bool = False,
+                             nonce: Optional[str] = None) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            wait = self._sends.take(loop.time())
+            if wait is None:
+                break
+            await asyncio.sleep(wait)
+        self._gateway.requests += 1
+        self._gateway.member_chunks(guild_id, user_ids, nonce)
+
+    def is_ratelimited(self) -> bool:
+        now = asyncio.get_running_loop().time()
+        return self._sends.remaining <= 0 and now < self._sends.reset_at
+
+
+class _FakeShard:
+    """What AutoShardedClient keeps per shard, as far as the client reads it."""
+
+    def __init__(self, ws: _FakeWebSocket):
+        self.id = ws.shard_id
+        self.ws = ws
+
+
+class FakeGateway:
+    """Delivers dispatch events to the attached client's parsers and counts what was sent."""
+
+    def __init__(self, server: "FakeDiscord"):
+        self.server = server
+        self.client: Optional[discord.Client] = None
+        self.events: Counter = Counter()
+        self.bytes = 0
+        # Events Discord would not send for the client's intents
+        self.withheld: Counter = Counter()
+        # Gateway sends from the client (member chunk requests)
+        self.requests = 0
+
+    def dispatch(self, event: str, data: Dict[str, Any]) -> None:
+        client = self.client
+        if client is None:
+            return
+        if event in MESSAGE_EVENTS:
+            data = self._visible_message(client, event, data)
+            if data is None:
+                self.withheld[event] += 1
+                return
+        raw = json.dumps(data)
+        self.bytes += len(raw)
+        self.events[event] += 1
+        parser = client._connection.parsers.get(event)
+        if parser is not None:
+            parser(json.loads(raw))
+
+    def _visible_message(self, client: discord.Client, event: str, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """What Discord sends of a message event: nothing without GUILD_MESSAGES, and without
+        MESSAGE_CONTENT no content unless the bot wrote the message or is mentioned in it."""
+        intents = client._connection._intents
+        if not intents.guild_messages:
+            return None
+        if event not in ("MESSAGE_CREATE", "MESSAGE_UPDATE") or intents.message_content:
+            return data
+        bot_id = str(self.server.bot_user_id)
+        if data.get("author", {}).get("id") == bot_id or any(u.get("id") == bot_id for u in data.get("mentions", ())):
+            return data
+        return dict(data, content="", embeds=[], attachments=[], components=[])
+
+    def dispatch_soon(self, event: str, data: Dict[str, Any]) -> None:
+        # Gateway events arrive independently of the HTTP response that caused them
+        asyncio.get_running_loop().call_soon(self.dispatch, event, data)
+
+    def ready(self) -> None:
+        """READY with every guild unavailable, then one GUILD_CREATE per guild. A sharded client gets a READY
+        per shard it runs, with only that shard's guilds; guilds on other shards are never sent."""
+        server = self.server
+        state = self.client._connection
+        sharded = isinstance(self.client, discord.AutoShardedClient)
+        for shard_id in state.shard_ids if sharded else (None,):
+            guilds = [guild for guild in server.guilds.values()
+                      if shard_id is None or guild.shard(state.shard_count) == shard_id]
+            data = {
+                "v": 10, "user": server.bot_user, "session_id": "fake-session", "resume_gateway_url": "",
+                "guilds": [{"id": str(guild.id), "unavailable": True} for guild in guilds],
+                "application": {"id": str(server.bot_user_id), "flags": 0},
+            }
+            if sharded:
+                data["shard"] = [shard_id, state.shard_count]
+            self.dispatch("READY", data)
+            for guild in guilds:
+                self.dispatch("GUILD_CREATE", guild.payload(with_members=state._intents.members))
+
+    def member_chunks(self, guild_id: int, user_ids: Optional[List[int]], nonce: Optional[str]) -> None:
+        guild = self.server.guilds[guild_id]
+        members = [guild.members[u] for u in user_ids if u in guild.members] if user_ids else list(guild.members.values())
+        chunks = [members[i:i + MEMBER_CHUNK_SIZE] for i in range(0, len(members), MEMBER_CHUNK_SIZE)] or [[]]
+        events = [{
+            "guild_id": str(guild_id), "members": chunk, "chunk_index": index,
+            "chunk_count": len(chunks), "nonce": nonce, "not_found": [],
+        } for index, chunk in enumerate(chunks)]
+        # Chunks arrive in order, one round trip after the request (timers with equal deadlines may run in any order)
+        asyncio.get_running_loop().call_later(self.server.latency, self._dispatch_all, "GUILD_MEMBERS_CHUNK", events)
+
+    def _dispatch_all(self, event: str, payloads: List[Dict[str, Any]]) -> None:
+        for data in payloads:
+            self.dispatch(event, data)
+
+    def message(self, guild: FakeGuild, channel_id: int, author_id: int, content: str) -> Dict[str, Any]:
+        """A member posts a message (e.g. a command)."""
+        payload = self.server.create_message(guild, channel_id, author_id, content)
+        self.dispatch("MESSAGE_CREATE", payload)
+        return payload
+
+    def interaction(self, guild: FakeGuild, channel_id: int, author_id: int, name: str,
+                    options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """A member runs a slash command. Option types come from the synced command when there is one;
+        pass a member option as ("user", user_id)."""
+        server = self.server
+        member = guild.members[author_id]
+        command = next((c for c in server.commands if c["name"] == name), None)
+        declared = {o["name"]: o["type"] for o in (command or {}).get("options", ())}
+        resolved: Dict[str, Dict[str, Any]] = {}
+        data_options = []
+        for option, value in (options or {}).items():
+            if isinstance(value, tuple) and value[0] == "user":
+                value = value[1]
+                kind = 6
+            else:
+                kind = declared.get(option, OPTION_TYPES.get(type(value), 3))
+            if kind == 6:
+                target = guild.members[int(value)]
+                resolved.setdefault("users", {})[str(value)] = target["user"]
+                resolved.setdefault("members", {})[str(value)] = dict(
+                    {k: v for k, v in target.items() if k != "user"}, permissions=str(server._bot_permissions(guild).value))
+                value = str(value)
+            data_options.append({"name": option, "type": kind, "value": value})
+        interaction_id, token = server.snowflake(), server.snowflake()
+        payload = {
+            "id": str(interaction_id), "application_id": str(server.bot_user_id), "type": 2, "token": str(token),
+            "version": 1, "guild_id": str(guild.id), "channel_id": str(channel_id),
+            "channel": dict(guild.channels[channel_id]),
+            "data": {"id": command["id"] if command else str(server.snowflake()), "name": name, "type": 1,
+                     "options": data_options, "resolved": resolved, "guild_id": str(guild.id)},
+            "member": dict(member, permissions=str(discord.Permissions.all().value if author_id == guild.owner_id else 0)),
+            "app_permissions": str(server._bot_permissions(guild).value), "locale": "en-US", "guild_locale": "en-US",
+            "entitlements": [], "authorizing_integration_owners": {"0": str(guild.id)}, "context": 0,
+            "attachment_size_limit": 10 * 2 ** 20,
+        }
+        server.interactions[token] = {"guild": guild, "channel_id": channel_id, "name": name, "acked": False}
+        self.dispatch("INTERACTION_CREATE", payload)
+        return payload
+
+    def voice(self, guild: FakeGuild, user_id: int, channel_id: Optional[int]) -> None:
+        """A member joins, moves between or leaves voice channels."""
+        self.dispatch("VOICE_STATE_UPDATE", guild.join_voice(user_id, channel_id))
+
+
+class FakeDiscord:
+    """
+    In-memory Discord: REST routes, rate limits and the gateway events they cause.
+    Counters: `calls` by route, `ratelimited` (429 responses) by route, and `mute_edits`
+    (loop time, guild_id, user_id, mute, audit reason) for every applied voice mute change.
+    """
+
+    # (method, path pattern, bucket name, major parameter, limit, per seconds).
+    # Limits approximate what Discord reports in X-Ratelimit-* headers for these routes.
+    ROUTES: List[Tuple[str, str, str, str, int, float]] = [
+        ("PATCH", r"/guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)", "member-edit", "guild_id", 10, 10.0),
+        ("GET", r"/guilds/(?P<guild_id>\d+)/members/(?P<user_id>\d+)", "member-get", "guild_id", 10, 1.0),
+        ("POST", r"/guilds/(?P<guild_id>\d+)/channels", "channel-create", "guild_id", 5, 10.0),
+        ("PATCH", r"/channels/(?P<channel_id>\d+)", "channel-edit", "channel_id", 2, 600.0),
+        ("POST", r"/channels/(?P<channel_id>\d+)/messages", "message-create", "channel_id", 5, 5.0),
+        ("GET", r"/channels/(?P<channel_id>\d+)/messages", "message-history", "channel_id", 5, 1.0),
+        ("POST", r"/channels/(?P<channel_id>\d+)/messages/bulk-delete", "message-bulk", "channel_id", 1, 1.0),
+        ("GET", r"/channels/(?P<channel_id>\d+)/messages/(?P<message_id>\d+)", "message-get", "channel_id", 5, 1.0),
+        ("PATCH", r"/channels/(?P<channel_id>\d+)/messages/(?P<message_id>\d+)", "message-edit", "channel_id", 5, 5.0),
+        ("DELETE", r"/channels/(?P<channel_id>\d+)/messages/(?P<message_id>\d+)", "message-delete", "channel_id", 5, 1.0),
+        ("PUT", r"/applications/(?P<application_id>\d+)/commands", "command-sync", "application_id", 2, 20.0),
+        ("POST", r"/interactions/(?P<interaction_id>\d+)/(?P<token>\d+)/callback", "interaction-callback",
+         "interaction_id", 5, 1.0),
+        ("POST", r"/webhooks/(?P<application_id>\d+)/(?P<token>\d+)", "webhook-execute", "token", 5, 2.0),
+    ]
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.5, seed: int = 1,
+                 wall: Callable[[], float] = time.time, limit_scale: float = 1.0,
+                 global_limit: int = GLOBAL_LIMIT_PER_SECOND):
+        # Request latency: `latency` seconds, plus up to `jitter` times that at random
+        self.latency = latency
+        # Rate limits (per route and global) are multiplied by this; below 1 forces rate limiting
+        self.limit_scale = limit_scale
+        # Requests per second across all routes; a server standing in for one worker of a cluster gets its
+        # share, as the real limit is per bot token
+        self.global_limit = global_limit
+        # Epoch time source for snowflakes and timestamps (a simulation passes its virtual clock)
+        self.wall = wall
+        self.jitter = jitter
+        self.rng = random.Random(seed)
+        self._last_id = 0
+        self.guilds: Dict[int, FakeGuild] = {}
+        self.channel_guild: Dict[int, FakeGuild] = {}
+        self.bot_user_id = self.snowflake()
+        self.bot_user = self.user(self.bot_user_id, "studybot", bot=True)
+        self.gateway = FakeGateway(self)
+        # Compiled routes, labelled like "PATCH /guilds/{guild_id}/members/{user_id}"
+        self._routes = [
+            (method, re.compile(pattern + "$"), _route_label(method, pattern),
+             name, major, max(1, int(limit * limit_scale)), per, getattr(self, "_" + name.replace("-", "_")))
+            for method, pattern, name, major, limit, per in self.ROUTES
+        ]
+        self._buckets: Dict[Tuple[str, str], _Bucket] = {}
+        self._global = _Bucket(max(1, int(global_limit * limit_scale)), 1.0)
+        self.calls: Counter = Counter()
+        self.ratelimited: Counter = Counter()
+        self.mute_edits: List[Tuple[float, int, int, bool, str]] = []
+        # Slash commands as last synced by the bot, and open interactions by token
+        self.commands: List[Dict[str, Any]] = []
+        self.interactions: Dict[int, Dict[str, Any]] = {}
+        # Called with (kind, guild, payload) for every change the bot makes: message_create,
+        # message_edit, message_delete, message_bulk_delete, member_edit and interaction_response
+        self.observers: List[Callable[[str, FakeGuild, Dict[str, Any]], None]] = []
+
+    # -- world building --
+    def snowflake(self, new_millisecond: bool = False) -> int:
+        """A new id. With `new_millisecond` it starts the next millisecond, so consecutive such ids (the guilds)
+        land on consecutive shards as real guild ids, created far apart, spread over them."""
+        now = discord.utils.time_snowflake(self.utcnow())
+        floor = ((self._last_id >> 22) + 1) << 22 if new_millisecond else self._last_id + 1
+        self._last_id = max(floor, now)
+        return self._last_id
+
+    def utcnow(self) -> datetime.datetime:
+        return datetime.datetime.fromtimestamp(self.wall(), datetime.timezone.utc)
+
+    def _notify(self, kind: str, guild: FakeGuild, data: Dict[str, Any]) -> None:
+        for observer in self.observers:
+            observer(kind, guild, data)
+
+    @staticmethod
+    def user(user_id: int, name: str, bot: bool = False) -> Dict[str, Any]:
+        return {"id": str(user_id), "username": name, "discriminator": "0", "global_name": None,
+                "avatar": None, "bot": bot}
+
+    def add_guild(self, members: int, in_voice: Optional[int] = None, dark_chat: bool = True,
+                  voice_name: str = "dark-voice", chat_name: str = "dark-chat",
+                  manage_channels: bool = True) -> FakeGuild:
+        """
+        A guild with #general, dark-voice, lobby (and dark-chat); `in_voice` members start in dark-voice.
+        Without `manage_channels` the bot's role can still mute members but cannot create channels.
+        """
+        guild_id = self.snowflake(new_millisecond=True)
+        guild = self.guilds[guild_id] = FakeGuild(self, guild_id, f"guild-{len(self.guilds)}")
+        everyone = discord.Permissions.general() | discord.Permissions.text() | discord.Permissions.voice()
+        bot_role = guild.bot_role_id = self.snowflake()
+        if manage_channels:
+            bot_permissions = discord.Permissions(administrator=True)
+        else:
+            everyone.update(manage_channels=False, manage_guild=False, manage_roles=False, manage_webhooks=False)
+            bot_permissions = discord.Permissions(mute_members=True, manage_messages=True)
+        guild.roles = [
+            {"id": str(guild_id), "name": "@everyone", "permissions": str(everyone.value), "position": 0,
+             "color": 0, "hoist": False, "managed": False, "mentionable": False, "flags": 0},
+            {"id": str(bot_role), "name": "studybot", "permissions": str(bot_permissions.value),
+             "position": 1, "color": 0, "hoist": False, "managed": True, "mentionable": False, "flags": 0},
+        ]
+        guild.general_id = int(guild.add_channel("general", 0)["id"])
+        guild.dark_voice_id = int(guild.add_channel(voice_name, 2)["id"])
+        guild.lobby_id = int(guild.add_channel("lobby", 2)["id"])
+        if dark_chat:
+            guild.add_channel(chat_name, 0)
+        guild.add_member(self.bot_user, roles=(bot_role,))
+        in_voice = members if in_voice is None else in_voice
+        for i in range(members):
+            user_id = self.snowflake()
+            guild.add_member(self.user(user_id, f"member-{i}"))
+            if i == 0:
+                guild.owner_id = user_id
+            if i < in_voice:
+                guild.join_voice(user_id, guild.dark_voice_id)
+        return guild
+
+    def member_ids(self, guild: FakeGuild) -> List[int]:
+        return [user_id for user_id in guild.members if user_id != self.bot_user_id]
+
+    async def attach(self, client: discord.Client) -> None:
+        """Point the client's HTTP layer and websocket at this server (instead of client.login/connect)."""
+        await client._async_setup_hook()
+        client.http._HTTPClient__session = _FakeSession(self)
+        client.http.token = "fake-token"
+        # What HTTPClient.static_login would have set up
+        client.http._global_over = asyncio.Event()
+        client.http._global_over.set()
+        client._connection.guild_ready_timeout = 0.05
+        if isinstance(client, discord.AutoShardedClient):
+            # What AutoShardedClient.launch_shards would have set up, one fake websocket per shard
+            state = client._connection
+            state.shard_count = client.shard_count
+            state.shard_ids = client.shard_ids or range(client.shard_count)
+            client._AutoShardedClient__shards = {
+                shard_id: _FakeShard(_FakeWebSocket(self.gateway, shard_id)) for shard_id in state.shard_ids
+            }
+        else:
+            client.ws = _FakeWebSocket(self.gateway)
+        self.gateway.client = client
+
+    def snapshot(self) -> Counter:
+        return Counter(self.calls)
+
+    # -- HTTP --
+    async def handle(self, method: str, url: str, kwargs: Dict[str, Any]) -> _Response:
+        path = urlsplit(url).path[len(API_PREFIX):]
+        for route_method, pattern, route, name, major, limit, per, handler in self._routes:
+            if route_method != method:
+                continue
+            match = pattern.match(path)
+            if match is None:
+                continue
+            params = {k: int(v) for k, v in match.groupdict().items()}
+            await asyncio.sleep(self.latency * (1.0 + self.rng.random() * self.jitter))
+            loop_now = asyncio.get_running_loop().time()
+            self.calls[route] += 1
+            bucket = self._buckets.get((name, str(params[major])))
+            if bucket is None:
+                bucket = self._buckets[(name, str(params[major]))] = _Bucket(limit, per)
+            # Interaction responses do not count against the global limit
+            retry_global = None if name in GLOBAL_EXEMPT_BUCKETS else self._global.take(loop_now)
+            retry_after = retry_global if retry_global is not None else bucket.take(loop_now)
+            headers = {
+                "X-Ratelimit-Bucket": name, "X-Ratelimit-Limit": str(limit),
+                "X-Ratelimit-Remaining": str(max(bucket.remaining, 0)),
+                "X-Ratelimit-Reset-After": f"{max(bucket.reset_at - loop_now, 0.0):.3f}",
+                "X-Ratelimit-Reset": f"{self.wall() + max(bucket.reset_at - loop_now, 0.0):.3f}",
+            }
+            if retry_after is not None:
+                self.ratelimited[route] += 1
+                headers["Via"] = "1.1 google"
+                return _Response(429, {"message": "You are being rate limited.", "retry_after": retry_after,
+                                       "global": retry_global is not None}, headers)
+            body = kwargs.get("data")
+            payload = json.loads(body) if isinstance(body, str) else {}
+            reason = unquote(kwargs.get("headers", {}).get("X-Audit-Log-Reason", ""))
+            status, result = handler(params, payload, kwargs.get("params") or {}, reason)
+            return _Response(status, result, headers)
+        return _Response(404, {"message": "404: Not Found", "code": 0}, {})
+
+    def _guild_of(self, channel_id: int) -> Optional[FakeGuild]:
+        return self.channel_guild.get(channel_id)
+
+    @staticmethod
+    def _error(status: int, code: int, message: str) -> Tuple[int, Dict[str, Any]]:
+        return status, {"message": message, "code": code}
+
+    def create_message(self, guild: FakeGuild, channel_id: int, author_id: int, content: str) -> Dict[str, Any]:
+        message_id = self.snowflake()
+        member = guild.members[author_id]
+        payload = {
+            "id": str(message_id), "channel_id": str(channel_id), "guild_id": str(guild.id),
+            "author": member["user"], "member": {k: v for k, v in member.items() if k != "user"},
+            "content": content, "timestamp": _iso(self.wall()), "edited_timestamp": None, "tts": False,
+            "mention_everyone": False, "mentions": [], "mention_roles": [], "attachments": [], "embeds": [],
+            "pinned": False, "type": 0, "flags": 0, "components": [],
+        }
+        guild.messages[channel_id][message_id] = payload
+        return payload
+
+    def _message_create(self, params, payload, query, reason):
+        guild = self._guild_of(params["channel_id"])
+        if guild is None or params["channel_id"] not in guild.messages:
+            return self._error(404, 10003, "Unknown Channel")
+        message = self.create_message(guild, params["channel_id"], self.bot_user_id, payload.get("content") or "")
+        self._notify("message_create", guild, message)
+        self.gateway.dispatch_soon("MESSAGE_CREATE", message)
+        return 200, message
+
+    def _command_sync(self, params, payload, query, reason):
+        self.commands = [dict(command, id=str(self.snowflake()), application_id=str(params["application_id"]),
+                              version=str(self.snowflake())) for command in payload]
+        return 200, self.commands
+
+    def _interaction_callback(self, params, payload, query, reason):
+        interaction = self.interactions.get(params["token"])
+        if interaction is None or interaction["acked"]:
+            return self._error(400, 40060, "Interaction has already been acknowledged.")
+        interaction["acked"] = True
+        kind = int(payload.get("type", 0))
+        flags = int((payload.get("data") or {}).get("flags") or 0)
+        self._notify("interaction_response", interaction["guild"], {"name": interaction["name"], "type": kind})
+        response = {"interaction": {"id": str(params["interaction_id"]), "type": 2,
+                                    "response_message_loading": kind == 5,
+                                    "response_message_ephemeral": bool(flags & EPHEMERAL_FLAG)}}
+        if kind == 4:
+            response["resource"] = {"type": 4, "message": self._interaction_message(interaction, payload.get("data") or {})}
+        return 200, response
+
+    def _webhook_execute(self, params, payload, query, reason):
+        interaction = self.interactions.get(params["token"])
+        if interaction is None:
+            return self._error(404, 10015, "Unknown Webhook")
+        return 200, self._interaction_message(interaction, payload)
+
+    def _interaction_message(self, interaction: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+        """A reply to an interaction; ephemeral ones are only seen by the invoking member, not kept in the channel."""
+        guild, channel_id = interaction["guild"], interaction["channel_id"]
+        message = self.create_message(guild, channel_id, self.bot_user_id, data.get("content") or "")
+        message["flags"] = int(data.get("flags") or 0)
+        if message["flags"] & EPHEMERAL_FLAG:
+            guild.messages[channel_id].pop(int(message["id"]), None)
+        else:
+            self.gateway.dispatch_soon("MESSAGE_CREATE", message)
+        return message
+
+    def _message_edit(self, params, payload, query, reason):
+        guild = self._guild_of(params["channel_id"])
+        message = guild.messages.get(params["channel_id"], {}).get(params["message_id"]) if guild else None
+        if message is None:
+            return self._error(404, 10008, "Unknown Message")
+        if "content" in payload:
+            message["content"] = payload["content"] or ""
+        message["edited_timestamp"] = _iso(self.wall())
+        self._notify("message_edit", guild, message)
+        self.gateway.dispatch_soon("MESSAGE_UPDATE", message)
+        return 200, message
+
+    def _message_delete(self, params, payload, query, reason):
+        guild = self._guild_of(params["channel_id"])
+        if guild is None or guild.messages.get(params["channel_id"], {}).pop(params["message_id"], None) is None:
+            return self._error(404, 10008, "Unknown Message")
+        deleted = {"id": str(params["message_id"]), "channel_id": str(params["channel_id"]), "guild_id": str(guild.id)}
+        self._notify("message_delete", guild, deleted)
+        self.gateway.dispatch_soon("MESSAGE_DELETE", deleted)
+        return 204, None
+
+    def _message_bulk(self, params, payload, query, reason):
+        guild = self._guild_of(params["channel_id"])
+        if guild is None:
+            return self._error(404, 10003, "Unknown Channel")
+        ids = [int(i) for i in payload.get("messages", [])]
+        cutoff = discord.utils.time_snowflake(self.utcnow() - datetime.timedelta(days=14))
+        if not 2 <= len(ids) <= 100 or any(i < cutoff for i in ids):
+            return self._error(400, 50034, "You can only bulk delete messages that are under 14 days old.")
+        messages = guild.messages[params["channel_id"]]
+        for message_id in ids:
+            messages.pop(message_id, None)
+        deleted = {"ids": [str(i) for i in ids], "channel_id": str(params["channel_id"]), "guild_id": str(guild.id)}
+        self._notify("message_bulk_delete", guild, deleted)
+        self.gateway.dispatch_soon("MESSAGE_DELETE_BULK", deleted)
+        return 204, None
+
+    def _message_history(self, params, payload, query, reason):
+        guild = self._guild_of(params["channel_id"])
+        if guild is None or params["channel_id"] not in guild.messages:
+            return self._error(404, 10003, "Unknown Channel")
+        limit = int(query.get("limit", 50))
+        ids = list(guild.messages[params["channel_id"]])
+        if "before" in query:
+            ids = [i for i in ids if i < int(query["before"])][-limit:]
+        elif "after" in query:
+            ids = [i for i in ids if i > int(query["after"])][:limit]
+        else:
+            ids = ids[-limit:]
+        messages = guild.messages[params["channel_id"]]
+        return 200, [messages[i] for i in reversed(ids)]
+
+    def _message_get(self, params, payload, query, reason):
+        guild = self._guild_of(params["channel_id"])
+        message = guild.messages.get(params["channel_id"], {}).get(params["message_id"]) if guild else None
+        if message is None:
+            return self._error(404, 10008, "Unknown Message")
+        return 200, message
+
+    def _channel_edit(self, params, payload, query, reason):
+        guild = self._guild_of(params["channel_id"])
+        if guild is None:
+            return self._error(404, 10003, "Unknown Channel")
+        channel = guild.channels[params["channel_id"]]
+        channel.update({k: v for k, v in payload.items() if k in ("name", "position", "topic")})
+        self.gateway.dispatch_soon("CHANNEL_UPDATE", channel)
+        return 200, channel
+
+    def set_bot_permissions(self, guild: FakeGuild, permissions: discord.Permissions) -> None:
+        """Change the bot role's permissions (e.g. grant Manage Channels) and send GUILD_ROLE_UPDATE."""
+        role = next(r for r in guild.roles if int(r["id"]) == guild.bot_role_id)
+        role["permissions"] = str(permissions.value)
+        self.gateway.dispatch("GUILD_ROLE_UPDATE", {"guild_id": str(guild.id), "role": role})
+
+    def _bot_permissions(self, guild: FakeGuild) -> discord.Permissions:
+        """Guild-level permissions of the bot: @everyone plus its own role."""
+        value = 0
+        for role in guild.roles:
+            if int(role["id"]) in (guild.id, guild.bot_role_id):
+                value |= int(role["permissions"])
+        return discord.Permissions(value)
+
+    def _channel_create(self, params, payload, query, reason):
+        guild = self.guilds.get(params["guild_id"])
+        if guild is None:
+            return self._error(404, 10004, "Unknown Guild")
+        permissions = self._bot_permissions(guild)
+        if not (permissions.administrator or permissions.manage_channels):
+            return self._error(403, 50013, "Missing Permissions")
+        channel = guild.add_channel(payload.get("name", "channel"), int(payload.get("type", 0)))
+        self.gateway.dispatch_soon("CHANNEL_CREATE", channel)
+        return 200, channel
+
+    def _member_get(self, params, payload, query, reason):
+        guild = self.guilds.get(params["guild_id"])
+        member = guild.members.get(params["user_id"]) if guild else None
+        if member is None:
+            return self._error(404, 10007, "Unknown Member")
+        return 200, member
+
+    def _member_edit(self, params, payload, query, reason):
+        guild = self.guilds.get(params["guild_id"])
+        member = guild.members.get(params["user_id"]) if guild else None
+        if member is None:
+            return self._error(404, 10007, "Unknown Member")
+        state = guild.voice_states.get(params["user_id"])
+        if "mute" in payload:
+            if state is None:
+                return self._error(400, 40032, "Target user is not connected to voice.")
+            mute = bool(payload["mute"])
+            if member["mute"] != mute:
+                self.mute_edits.append((asyncio.get_running_loop().time(), guild.id, params["user_id"], mute, reason))
+                self._notify("member_edit", guild, {"user_id": params["user_id"], "mute": mute, "reason": reason})
+            member["mute"] = state["mute"] = mute
+        if "nick" in payload:
+            member["nick"] = payload["nick"]
+        if state is not None:
+            self.gateway.dispatch_soon("VOICE_STATE_UPDATE", guild.voice_event(params["user_id"], int(state["channel_id"])))
+        return 200, member
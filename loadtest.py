@@ -0,0 +1,300 @@
+"""
+Offline load test: main.py's real commands and event handlers against fake_discord.FakeDiscord.
+
+N guilds with M members each (all starting in dark-voice) run `!learn STUDY BREAK` for a number
+of phase transitions while members join and leave dark-voice, then `!stop` and `!clear`.
+Reports API calls per stage and per phase transition, mute-enforcement latency after phase
+boundaries and after joins, 429 responses and event-loop lag.
+With COMMAND_MODE=slash the commands are sent as slash-command interactions instead.
+
+Usage:
+    python loadtest.py [--guilds 20] [--members 30] [--study 2] [--break 1] [--minute 10]
+                       [--transitions 4] [--latency 0.05] [--churn 0.2] [--stagger 5] [--burst 3]
+                       [--misconfigured 0.2] [--limit-scale 0.3] [--metrics out.prom]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import random
+import tempfile
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+os.environ.setdefault("tokenbot", "")
+_tmp = tempfile.TemporaryDirectory()
+os.environ["SESSION_DB_PATH"] = os.path.join(_tmp.name, "sessions.db")
+
+import main  # noqa: E402
+from fake_discord import FakeDiscord, FakeGuild  # noqa: E402
+
+
+# Option names of the commands sent as slash commands, in "!" argument order
+SLASH_OPTIONS = {"learn": ("study_minutes", "break_minutes"), "extendbreak": ("extra_minutes",), "clear": ("action",)}
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class LoadTest:
+    """Drives one run and collects what the report needs."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.server = FakeDiscord(latency=args.latency, limit_scale=args.limit_scale)
+        # The first `misconfigured` share of guilds has no dark-chat and no Manage Channels for the bot
+        misconfigured = int(args.guilds * args.misconfigured)
+        self.guilds: List[FakeGuild] = [
+            self.server.add_guild(members=args.members, dark_chat=i >= misconfigured, manage_channels=i >= misconfigured)
+            for i in range(args.guilds)
+        ]
+        self.rng = random.Random(5)
+        # guild_id -> [(boundary loop time, phase)]
+        self.boundaries: Dict[int, List[Tuple[float, str]]] = defaultdict(list)
+        # (guild_id, user_id) -> loop time of the latest join to dark-voice
+        self.joined_at: Dict[Tuple[int, int], float] = {}
+        self.stages: List[Tuple[str, Counter]] = []
+        self.lag: List[float] = []
+        # guild_id -> loop time !stop was sent / its confirmation was posted
+        self.stop_sent: Dict[int, float] = {}
+        self.stop_replied: Dict[int, float] = {}
+        self.server.observers.append(self._observe)
+
+    def _observe(self, kind: str, guild: FakeGuild, data: dict) -> None:
+        if kind == "message_create" and "📘 study finished" in data["content"]:
+            self.stop_replied.setdefault(guild.id, asyncio.get_running_loop().time())
+
+    def _trace_boundaries(self) -> None:
+        begin_segment = main._begin_segment
+
+        async def traced(cycle, phase, *args, **kwargs):
+            started_at = kwargs.get("started_at")
+            when = started_at if started_at is not None else main.scheduler.time()
+            self.boundaries[cycle.guild.id].append((when, phase))
+            return await begin_segment(cycle, phase, *args, **kwargs)
+
+        main._begin_segment = traced
+
+    def _stage(self, name: str) -> None:
+        self.stages.append((name, self.server.snapshot()))
+
+    async def _sample_lag(self, interval: float = 0.05) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            before = loop.time()
+            await asyncio.sleep(interval)
+            self.lag.append(loop.time() - before - interval)
+
+    async def _churn(self) -> None:
+        """Every second, each guild has a `churn` chance of one member hopping in or out of dark-voice."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(1.0)
+            for guild in self.guilds:
+                if self.rng.random() >= self.args.churn:
+                    continue
+                user_id = self.rng.choice(self.server.member_ids(guild))
+                state = guild.voice_states.get(user_id)
+                if state is not None and int(state["channel_id"]) == guild.dark_voice_id:
+                    self.server.gateway.voice(guild, user_id, guild.lobby_id)
+                else:
+                    self.joined_at[(guild.id, user_id)] = loop.time()
+                    self.server.gateway.voice(guild, user_id, guild.dark_voice_id)
+
+    async def _command(self, content: str, stagger: float = 0.0) -> None:
+        loop = asyncio.get_running_loop()
+        for guild in self.guilds:
+            if content == "!stop":
+                self.stop_sent[guild.id] = loop.time()
+            self._send(guild, content)
+            if stagger:
+                await asyncio.sleep(stagger / len(self.guilds))
+
+    def _send(self, guild: FakeGuild, content: str) -> None:
+        """The owner runs a command: a "!" message, or the slash command when the bot runs with COMMAND_MODE=slash."""
+        if main.COMMAND_MODE != "slash":
+            self.server.gateway.message(guild, guild.general_id, guild.owner_id, content)
+            return
+        name, *values = content[1:].split()
+        options = {option: int(value) if value.isdigit() else value
+                   for option, value in zip(SLASH_OPTIONS.get(name, ()), values)}
+        self.server.gateway.interaction(guild, guild.general_id, guild.owner_id, name, options)
+
+    async def _replied(self, timeout: float) -> None:
+        """Wait until every guild has posted its !stop confirmation (or the timeout passes)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while len(self.stop_replied) < len(self.guilds) and loop.time() < deadline:
+            await asyncio.sleep(0.1)
+
+    async def _settle(self, timeout: float) -> None:
+        """Wait until no guild has queued mute edits or a running purge (or the timeout passes)."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            busy = any(
+                s.purge_job is not None or (s.mute_dispatcher is not None and (s.mute_dispatcher._pending or s.mute_dispatcher._inflight))
+                for s in main.sessions.values()
+            )
+            if not busy:
+                return
+            await asyncio.sleep(0.1)
+
+    async def run(self) -> None:
+        args = self.args
+        bot = main.bot
+        self._trace_boundaries()
+        lag_task = asyncio.ensure_future(self._sample_lag())
+        self._stage("start")
+        await self.server.attach(bot)
+        self.server.gateway.ready()
+        await bot.wait_until_ready()
+        self._stage("ready")
+
+        await self._command(f"!learn {args.study} {args.brk}", stagger=args.stagger)
+        await asyncio.sleep(1.0)
+        # Impatient owners re-send !learn; each repeat is answered with an "already running" reply
+        for _ in range(args.burst):
+            await self._command(f"!learn {args.study} {args.brk}")
+        self._stage("learn")
+        churn_task = asyncio.ensure_future(self._churn())
+        segments = [args.study if i % 2 == 0 else args.brk for i in range(args.transitions)]
+        await asyncio.sleep(sum(segments) * args.minute - 1.0 + args.minute / 2)
+        churn_task.cancel()
+        self._stage("cycle")
+
+        await self._command("!stop")
+        # Settling only means something once every guild has taken the command and queued its unmutes
+        await self._replied(timeout=30.0)
+        await asyncio.sleep(0.5)
+        await self._settle(timeout=30.0)
+        self._stage("stop")
+        await self._command("!clear")
+        await asyncio.sleep(0.5)
+        await self._settle(timeout=60.0)
+        self._stage("clear")
+        lag_task.cancel()
+
+    def report(self) -> None:
+        args = self.args
+        server = self.server
+        print(f"guilds={args.guilds} members={args.members} minute={args.minute}s "
+              f"study={args.study} break={args.brk} latency={args.latency * 1000:.0f}ms")
+        for (_, before), (name, after) in zip(self.stages, self.stages[1:]):
+            calls = after - before
+            top = ", ".join(f"{route}={n}" for route, n in calls.most_common(4))
+            print(f"  {name:<6} calls={sum(calls.values()):<6} {top}")
+
+        cycle_calls = sum((self.stages[3][1] - self.stages[1][1]).values())
+        transitions = sum(len(b) - 1 for b in self.boundaries.values())
+        print(f"phase transitions={transitions} api calls/transition={cycle_calls / max(transitions, 1):.1f} "
+              f"(learn+cycle calls, incl. countdown edits)")
+
+        boundary_latency, join_latency = [], []
+        for when, guild_id, user_id, mute, reason in server.mute_edits:
+            if reason.startswith("Learning cycle server mute (join"):
+                joined = self.joined_at.get((guild_id, user_id))
+                if joined is not None and joined <= when:
+                    join_latency.append(when - joined)
+                continue
+            if not reason.startswith("Learning cycle"):
+                continue
+            phase = "study" if mute else "break"
+            starts = [t for t, p in self.boundaries.get(guild_id, ()) if p == phase and t <= when]
+            if starts:
+                boundary_latency.append(when - starts[-1])
+        for name, values in (("after boundary", boundary_latency), ("after join", join_latency)):
+            print(f"mute latency {name:<14} n={len(values):<5} p50={_percentile(values, 0.5) * 1000:.0f}ms "
+                  f"p99={_percentile(values, 0.99) * 1000:.0f}ms max={max(values, default=0.0) * 1000:.0f}ms")
+
+        replied, unmuted = [], []
+        last_unmute: Dict[int, float] = {}
+        for when, guild_id, user_id, mute, reason in server.mute_edits:
+            sent = self.stop_sent.get(guild_id)
+            if sent is not None and when >= sent and not mute:
+                last_unmute[guild_id] = when
+        for guild_id, sent in self.stop_sent.items():
+            if guild_id in self.stop_replied:
+                replied.append(self.stop_replied[guild_id] - sent)
+            if guild_id in last_unmute:
+                unmuted.append(last_unmute[guild_id] - sent)
+        for name, values in (("to reply", replied), ("to all unmuted", unmuted)):
+            print(f"!stop {name:<23} n={len(values):<5} p50={_percentile(values, 0.5) * 1000:.0f}ms "
+                  f"p99={_percentile(values, 0.99) * 1000:.0f}ms max={max(values, default=0.0) * 1000:.0f}ms")
+
+        limited = server.ratelimited
+        print(f"429 responses={sum(limited.values())} "
+              + ", ".join(f"{route}={n}" for route, n in limited.most_common(3)))
+        print(f"loop lag p50={_percentile(self.lag, 0.5) * 1000:.1f}ms p99={_percentile(self.lag, 0.99) * 1000:.1f}ms "
+              f"max={max(self.lag, default=0.0) * 1000:.1f}ms | gateway events={sum(server.gateway.events.values())} "
+              f"bytes={server.gateway.bytes} withheld by intents={sum(server.gateway.withheld.values())} "
+              f"(commands: {main.COMMAND_MODE})")
+        # The bot's own view (what /metrics would serve): calls by route and outcome, ignored errors
+        requests = sorted(main.api_requests_total.values.items(), key=lambda item: -item[1])
+        print("bot metrics: " + ", ".join(f"{route} [{status}]={n:.0f}" for (route, status), n in requests[:4]))
+        outbox = main.dark_chat_messages_total.values
+        saved = outbox.get(("merged",), 0) + outbox.get(("superseded",), 0)
+        print(f"dark-chat sends={outbox.get(('sent',), 0):.0f} saved={saved:.0f} "
+              f"(merged={outbox.get(('merged',), 0):.0f} superseded={outbox.get(('superseded',), 0):.0f})")
+        creates = main.dark_chat_create_total.values
+        print(f"dark-chat create attempts={creates.get(('created',), 0) + creates.get(('failed',), 0):.0f} "
+              f"failed={creates.get(('failed',), 0):.0f} skipped by negative cache={creates.get(('skipped',), 0):.0f}")
+        shed = main.api_shed_total.values
+        waits = main.api_gate_wait_seconds.values
+        print(f"api budget: {'on' if main.API_BUDGET_ENABLED else 'off'} pressure={main.api_budget._pressure.get(0, [0.0])[0]:.1f} "
+              f"guilds under pressure={sum(1 for g in main.api_budget._pressure if g)} gate rate={main.api_budget.rate():g}/s "
+              f"countdown edits skipped={shed.get(('countdown',), 0):.0f} cleanups deferred={shed.get(('cleanup',), 0):.0f} "
+              f"gate waits: " + (", ".join(f"{kind}={entry[2]}/{entry[1]:.1f}s" for (kind,), entry in sorted(waits.items())) or "none"))
+        drift = sum(main.reconcile_drift_total.values.values())
+        print(f"reconciler: passes={main.reconcile_passes_total.values.get((), 0):.0f} drift={drift:.0f} "
+              f"fixed={main.reconcile_fixed_total.values.get((), 0):.0f} interval={main._reconcile_interval:g}s")
+        swallowed = main.swallowed_errors_total.values
+        print("swallowed errors: " + (", ".join(f"{site}={n:.0f}" for (site,), n in sorted(swallowed.items())) or "none"))
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=30)
+    parser.add_argument("--study", type=int, default=2)
+    parser.add_argument("--break", dest="brk", type=int, default=1)
+    parser.add_argument("--minute", type=float, default=10.0, help="real seconds per cycle minute")
+    parser.add_argument("--transitions", type=int, default=4, help="phase transitions to run per guild")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake HTTP round trip in seconds")
+    parser.add_argument("--churn", type=float, default=0.2, help="per guild, chance per second of a member hopping")
+    parser.add_argument("--stagger", type=float, default=5.0, help="seconds over which guilds send !learn")
+    parser.add_argument("--misconfigured", type=float, default=0.0,
+                        help="share of guilds without dark-chat where the bot cannot create channels")
+    parser.add_argument("--limit-scale", type=float, default=1.0,
+                        help="multiply the fake server's rate limits (below 1 forces rate limiting)")
+    parser.add_argument("--burst", type=int, default=3, help="repeated !learn commands each guild sends once its cycle runs")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own output")
+    parser.add_argument("--metrics", help="write the bot's Prometheus metrics to this path at the end")
+    args = parser.parse_args()
+
+    main.SECONDS_PER_MINUTE = args.minute
+    # The fake gateway has no voice servers: no alert playback
+    main.ALERT_AUDIO_FULL_PATH = os.path.join(_tmp.name, "no-alert.mp3")
+    # discord.py logs every 429 it retries; they are counted in the report instead
+    logging.getLogger("discord").setLevel(logging.ERROR)
+    if args.verbose:
+        main._configure_logging("DEBUG")
+        main.LOG_HOT_PATHS = True
+    test = LoadTest(args)
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with output:
+        asyncio.run(test.run())
+    test.report()
+    if args.metrics:
+        with open(args.metrics, "w") as f:
+            f.write(main.metrics.render())
+
+
+if __name__ == "__main__":
+    main_cli()
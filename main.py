@@ -1,10 +1,27 @@
 import asyncio
+import bisect
+import contextvars
+import datetime
+import functools
+import hashlib
+import heapq
+import itertools
+import json
+import logging
 import os
+import signal
+import struct
+import subprocess
+import sys
 import time
-from typing import Dict, Optional, Tuple
+from collections import OrderedDict, deque
+from typing import Any, Callable, Coroutine, Deque, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
 import re
+import sqlite3
 
 import discord
+from aiohttp import web
+from discord import app_commands
 from discord.ext import commands
 
 
@@ -12,7 +29,7 @@ from discord.ext import commands
 # ---- Configuration ----
 # Bot token can be hardcoded below, or read from the DISCORD_TOKEN environment variable.
 # Replace the placeholder with your real token if you want it in-code.
-BOT_TOKEN: str = os.environ["tokenbot"]
+BOT_TOKEN: str = os.environ.get("tokenbot", "")
 
 # Fixed voice channel name as requested (cannot be customized)
 DARK_VOICE_CHANNEL_NAME = "dark-voice"
@@ -23,41 +40,1483 @@ DARK_CHAT_CHANNEL_NAME = "dark-chat"
 # Put an audio file next to this script and set the file name here (e.g., alert.mp3)
 ALERT_AUDIO_PATH = "alert.mp3"
 ALERT_AUDIO_FULL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ALERT_AUDIO_PATH)
+# Volume applied once when the alert is decoded
+ALERT_VOLUME = 1.1
+# Pre-encoded Opus frames of the alert, rebuilt whenever the audio file or volume changes
+ALERT_CACHE_PATH = ALERT_AUDIO_FULL_PATH + ".opus-frames"
+# Connect to voice this many seconds before a scheduled alert so playback starts on time
+VOICE_PRECONNECT_SECONDS = float(os.environ.get("VOICE_PRECONNECT_SECONDS", "5"))
+# Keep an idle voice connection this long after an alert before disconnecting
+VOICE_IDLE_TTL_SECONDS = float(os.environ.get("VOICE_IDLE_TTL_SECONDS", "90"))
+# Upper bound on simultaneous voice connections across all guilds
+MAX_VOICE_CONNECTIONS = int(os.environ.get("MAX_VOICE_CONNECTIONS", "50"))
+# Running cycles are persisted here so they resume after a restart or crash
+SESSION_DB_PATH = os.environ.get(
+    "SESSION_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions.db")
+)
+# Session writes are coalesced per guild and committed in one transaction this often
+SESSION_FLUSH_INTERVAL_SECONDS = 1.0
+# Leveled logging for the bot's own messages (logfmt lines on stderr)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# Per-event lines (every mute batch, alert, voice connect) are only built when this is on
+LOG_HOT_PATHS = os.environ.get("LOG_HOT_PATHS", "1" if LOG_LEVEL == "DEBUG" else "0") == "1"
+# Prometheus metrics at http://METRICS_HOST:METRICS_PORT/metrics (0 disables the endpoint)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+# How often the event loop's scheduling lag is sampled while metrics are served
+LOOP_LAG_SAMPLE_SECONDS = 0.5
+# Gateway/cache profile:
+#   "lean" - no member chunking at startup and only members in voice channels are cached;
+#            anyone else is looked up when a command needs them (member converters query the gateway)
+#   "full" - discord.py defaults: every member of every guild is requested at startup and kept
+GATEWAY_PROFILE = os.environ.get("GATEWAY_PROFILE", "lean").lower()
+# Command front end (every command exists both ways and runs the same code):
+#   "both"  - "!" prefix commands plus their slash-command twins; needs the message_content intent
+#   "slash" - slash commands only; nothing reads messages, so the bot subscribes to no message events
+#             (no message_content or guild_messages intent) and the gateway stops sending them
+COMMAND_MODE = os.environ.get("COMMAND_MODE", "both").lower()
+# How replies refer to commands ("!stop" or "/stop")
+COMMAND_SIGIL = "/" if COMMAND_MODE == "slash" else "!"
+# Digest of the slash commands last synced to Discord; the tree is synced again only when they change
+COMMAND_SYNC_PATH = SESSION_DB_PATH + ".commands"
+# Gateway shards: with SHARD_COUNT > 1 the bot connects as that many shards (guild shard = (guild_id >> 22) % SHARD_COUNT).
+# 0 means one connection, or Discord's recommended count in a cluster
+SHARD_COUNT = int(os.environ.get("SHARD_COUNT", "0"))
+# Shards this process runs, comma-separated (set for each worker by the cluster supervisor; empty: all of them)
+SHARD_IDS = [int(s) for s in os.environ.get("SHARD_IDS", "").split(",") if s.strip()]
+# Cluster mode: with CLUSTER_WORKERS > 1 this process only supervises that many worker processes. Each worker
+# runs a contiguous range of the shards and owns the cycles of the guilds on them
+CLUSTER_WORKERS = int(os.environ.get("CLUSTER_WORKERS", "1"))
 
 
 # ---- Bot Setup ----
 intents = discord.Intents.default()
-intents.message_content = True
+intents.message_content = COMMAND_MODE != "slash"
+# Prefix commands are the only reader of message events
+intents.guild_messages = COMMAND_MODE != "slash"
+intents.dm_messages = COMMAND_MODE != "slash"
 intents.guilds = True
 intents.members = True
 intents.voice_states = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
-
-
-# Per-guild running cycle tasks
-guild_id_to_task: Dict[int, asyncio.Task] = {}
-# Track current phase per guild: "study" or "break" (or None)
-guild_id_to_phase: Dict[int, Optional[str]] = {}
-# Track number of completed study phases for the current cycle per guild
-guild_id_to_study_count: Dict[int, int] = {}
-# Remember which text channel to announce in for each guild
-guild_id_to_announce_channel_id: Dict[int, int] = {}
-# Track remaining time and timer tasks per guild
-guild_id_to_remaining_time: Dict[int, int] = {}  # seconds
-guild_id_to_timer_task: Dict[int, asyncio.Task] = {}  # countdown task
-# Store original channel names to restore later
-guild_id_to_original_channel_name: Dict[int, str] = {}
-# Store target voice channel id for reliable edits (avoid name lookups)
-guild_id_to_voice_channel_id: Dict[int, int] = {}
-# Track the status message in dark-chat to edit countdown instead of renaming channels
-guild_id_to_status_message_id: Dict[int, int] = {}
-# Queue a one-time break extension (in minutes) to apply after current break ends
-guild_id_to_pending_break_extension_minutes: Dict[int, int] = {}
-# Debounce map to avoid spamming edits: (guild_id, member_id) -> last_edit_seconds
-recent_member_edit_time: Dict[Tuple[int, int], float] = {}
+
+def _gateway_options() -> Dict[str, Any]:
+    """commands.Bot options for GATEWAY_PROFILE."""
+    if GATEWAY_PROFILE == "full":
+        return {}
+    member_cache = discord.MemberCacheFlags.none()
+    member_cache.voice = True
+    return {
+        # Voice members arrive with GUILD_CREATE and voice state events; nobody else is needed up front
+        "chunk_guilds_at_startup": False,
+        "member_cache_flags": member_cache,
+        # Status messages are kept by reference/ID, nothing reads the message cache
+        "max_messages": None,
+    }
+
+
+def _shard_options() -> Dict[str, Any]:
+    """commands.AutoShardedBot options for SHARD_COUNT/SHARD_IDS; empty when the bot is not sharded."""
+    if not SHARD_IDS and SHARD_COUNT <= 1:
+        return {}
+    return {"shard_ids": SHARD_IDS or None, "shard_count": SHARD_COUNT}
+
+
+bot = (commands.AutoShardedBot if _shard_options() else commands.Bot)(
+    command_prefix="!" if COMMAND_MODE != "slash" else commands.when_mentioned,
+    intents=intents, **_gateway_options(), **_shard_options())
+
+
+# Countdown messages remembered per guild for cleanup
+COUNTDOWN_REGISTRY_SIZE = 50
+# Discord refuses bulk deletes of messages older than this
+BULK_DELETE_MAX_AGE = datetime.timedelta(days=14)
+# !clear / !clearcommands: channels purged at once, messages scanned per channel, progress report interval
+PURGE_CONCURRENCY = int(os.environ.get("PURGE_CONCURRENCY", "4"))
+# !clear scans what its old 10 rounds of purge(limit=1000) did; !clearcommands keeps its single 1000
+PURGE_MESSAGES_PER_CHANNEL = 10000
+CLEARCOMMANDS_MESSAGES_PER_CHANNEL = 1000
+PURGE_PROGRESS_INTERVAL_SECONDS = 5.0
+# Server-wide !unmute: progress report interval
+UNMUTE_PROGRESS_INTERVAL_SECONDS = 5.0
+# After dark-chat could not be created, use the fallback channel for this long before trying again
+# (channel, role and permission changes in the guild clear it earlier)
+DARK_CHAT_RETRY_SECONDS = float(os.environ.get("DARK_CHAT_RETRY_SECONDS", "600"))
+# Dark-chat outbox: Discord's message length limit and the per-channel send pacing (5 per 5 seconds)
+MESSAGE_MAX_LENGTH = 2000
+DARK_CHAT_BUCKET_CAPACITY = 5
+DARK_CHAT_BUCKET_REFILL_PER_SECOND = 1.0
 # Minimum seconds between server-mute edits for the same member
 PER_MEMBER_EDIT_COOLDOWN_SECONDS = 5.0
+# Upper bound on remembered member edit times per guild (older entries expire after the cooldown anyway)
+EDIT_DEBOUNCE_MAX_ENTRIES = 512
+# Length of one countdown step; every phase boundary, alert and countdown edit lands on a multiple of it
+SECONDS_PER_MINUTE = 60.0
+# How the per-phase status message counts down:
+#   "edit"      - edit the message every minute ([S #1: 49/50])
+#   "timestamp" - post once with the length and a Discord relative timestamp ([S #1: 50 min <t:END:R>]); the
+#                 client counts down, no edits
+#   "hybrid"    - like "timestamp", plus an edit when the minutes left reach one of STATUS_MILESTONES
+STATUS_MODE = os.environ.get("STATUS_MODE", "edit").lower()
+STATUS_MILESTONES = frozenset(int(m) for m in os.environ.get("STATUS_MILESTONES", "10,5,1").split(",") if m.strip())
+
+
+# ---- Guild sessions ----
+class GuildSession:
+    """
+    Everything the bot tracks for one guild, in one slotted record.
+    Optional parts (cycle, mute queue, countdown registry, debounce table) are allocated on first use.
+    """
+
+    __slots__ = (
+        "guild_id", "phase", "study_count", "announce_channel_id", "voice_channel_id",
+        "status_message_id", "pending_break_extension",
+        "cycle", "mute_dispatcher", "dark_voice", "dark_chat", "channels_indexed",
+        "countdown_messages", "countdown_history_scanned", "purge_job", "recent_edits", "pending_joins",
+        "unmute_hold", "actor", "outbox", "dark_chat_retry_at", "dark_chat_fallback",
+        "dark_chat_creating",
+    )
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        # Current phase: "study" or "break" (or None)
+        self.phase: Optional[str] = None
+        # Number of completed study phases for the current cycle
+        self.study_count = 0
+        # Text channel where the cycle was started; announcements fall back to it without dark-chat
+        self.announce_channel_id = 0
+        # Voice channel id captured at !learn (avoid name lookups)
+        self.voice_channel_id = 0
+        # Countdown status message in dark-chat
+        self.status_message_id = 0
+        # One-time break extension (in minutes) to apply after the current break ends
+        self.pending_break_extension = 0
+        # Running cycle (None means no cycle is running)
+        self.cycle: Optional["_Cycle"] = None
+        self.mute_dispatcher: Optional["MuteDispatcher"] = None
+        # Indexed dark-voice/dark-chat channels, kept current by channel events
+        self.dark_voice: Optional[discord.VoiceChannel] = None
+        self.dark_chat: Optional[discord.TextChannel] = None
+        self.channels_indexed = False
+        # Negative cache: dark-chat creation failed, use the fallback until this monotonic time
+        self.dark_chat_retry_at = 0.0
+        self.dark_chat_fallback: Optional[discord.TextChannel] = None
+        # The create request in flight, shared by everyone who finds dark-chat missing meanwhile
+        self.dark_chat_creating: Optional["asyncio.Future[Optional[discord.TextChannel]]"] = None
+        # Countdown messages the bot posted, oldest first: (channel_id, message_id)
+        self.countdown_messages: Optional[Deque[Tuple[int, int]]] = None
+        # Whether dark-chat history was scanned (since startup) for countdowns we lost track of
+        self.countdown_history_scanned = False
+        self.purge_job: Optional["PurgeJob"] = None
+        # member_id -> monotonic time of our last mute edit, oldest first
+        self.recent_edits: Optional[Dict[int, float]] = None
+        # Members who joined dark-voice during the current join window (None = no window open)
+        self.pending_joins: Optional[Dict[int, discord.Member]] = None
+        # Members unmuted by !unmute; the cycle leaves them unmuted until its next phase boundary
+        self.unmute_hold: Optional[Set[int]] = None
+        # Serializes this guild's commands, cycle steps and voice events (allocated on first message)
+        self.actor: Optional["GuildActor"] = None
+        # Announcements waiting to be sent to dark-chat (allocated on first message)
+        self.outbox: Optional["DarkChatOutbox"] = None
+
+    def hold_unmuted(self, member_ids: Iterable[int]) -> None:
+        """Keep these members unmuted for the rest of the current study phase (joins and updates skip them)."""
+        if self.phase != "study":
+            return
+        if self.unmute_hold is None:
+            self.unmute_hold = set()
+        self.unmute_hold.update(member_ids)
+
+    def edited_recently(self, member_id: int, now: float) -> bool:
+        last = self.recent_edits.get(member_id) if self.recent_edits else None
+        return last is not None and now - last < PER_MEMBER_EDIT_COOLDOWN_SECONDS
+
+    def mark_edited(self, member_id: int, now: float) -> None:
+        edits = self.recent_edits
+        if edits is None:
+            edits = self.recent_edits = {}
+        # Re-insert so the table stays ordered by edit time
+        edits.pop(member_id, None)
+        edits[member_id] = now
+        # Expire entries past the cooldown (they no longer block anything), then enforce the size cap
+        while True:
+            oldest_id = next(iter(edits))
+            if now - edits[oldest_id] < PER_MEMBER_EDIT_COOLDOWN_SECONDS and len(edits) <= EDIT_DEBOUNCE_MAX_ENTRIES:
+                break
+            del edits[oldest_id]
+            if not edits:
+                break
+
+
+# Every guild's session, created on first use
+sessions: Dict[int, GuildSession] = {}
+
+
+def _session(guild_id: int) -> GuildSession:
+    session = sessions.get(guild_id)
+    if session is None:
+        session = sessions[guild_id] = GuildSession(guild_id)
+    return session
+
+
+# ---- Clock ----
+class Clock:
+    """
+    Time source for everything the bot schedules or waits on.
+    now() is the event loop's monotonic clock (the scheduler, dispatchers and debounce run on it);
+    wall() is epoch time for persisted sessions and message ages. A simulation swaps `clock`
+    for one driven by a virtual-time event loop.
+    """
+
+    def now(self) -> float:
+        return asyncio.get_running_loop().time()
+
+    def wall(self) -> float:
+        return time.time()
+
+    async def sleep(self, seconds: float) -> None:
+        await asyncio.sleep(seconds)
+
+
+clock = Clock()
+
+
+# ---- Metrics and logging ----
+logger = logging.getLogger("darkbot")
+
+
+def _quote(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+def _logfmt_value(value: Any) -> str:
+    text = str(value)
+    if text and not any(c in text for c in ' "=\n'):
+        return text
+    return _quote(text)
+
+
+def _log(level: int, event: str, **fields: Any) -> None:
+    """Log one structured line, `event=<event> key=value ...`; nothing is formatted when the level is off."""
+    if logger.isEnabledFor(level):
+        logger.log(level, " ".join([f"event={event}"] + [f"{k}={_logfmt_value(v)}" for k, v in fields.items()]))
+
+
+class _LogfmtFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = f"ts={self.formatTime(record, '%Y-%m-%dT%H:%M:%S')} level={record.levelname.lower()} {record.getMessage()}"
+        if record.exc_info:
+            line += " traceback=" + _quote(self.formatException(record.exc_info))
+        return line
+
+
+def _configure_logging(level: Optional[str] = None) -> None:
+    """Write the bot's log lines to stderr at LOG_LEVEL. Harnesses that only import main stay quiet."""
+    handler = logging.StreamHandler()
+    handler.setFormatter(_LogfmtFormatter())
+    logger.handlers[:] = [handler]
+    logger.setLevel(level or LOG_LEVEL)
+    logger.propagate = False
+
+
+class _Metric:
+    """One metric family. Samples are keyed by a tuple of label values, in the order of `labels`."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], Any] = {}
+
+    def _labels(self, key: Tuple[str, ...], extra: Tuple[Tuple[str, str], ...] = ()) -> str:
+        pairs = list(zip(self.labels, key)) + list(extra)
+        return "{" + ",".join(f"{name}={_quote(value)}" for name, value in pairs) + "}" if pairs else ""
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self._labels(key)} {value:g}" for key, value in sorted(self.values.items())]
+
+
+class CounterMetric(_Metric):
+    kind = "counter"
+
+    def inc(self, *key: str, amount: float = 1.0) -> None:
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class GaugeMetric(_Metric):
+    """A gauge read from `collect` at scrape time, so nothing is updated on the hot path."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, collect: Callable[[], float]):
+        super().__init__(name, help_text)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        self.values[()] = float(self.collect())
+        return super().samples()
+
+
+class HistogramMetric(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)):
+        super().__init__(name, help_text, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *key: str) -> None:
+        entry = self.values.get(key)
+        if entry is None:
+            # [observations per bucket (the last one is +Inf), sum, count]
+            entry = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def samples(self) -> List[str]:
+        lines = []
+        bounds = [f"{bound:g}" for bound in self.buckets] + ["+Inf"]
+        for key, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, n in zip(bounds, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{self._labels(key, (('le', bound),))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {total:g}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process metrics rendered in the Prometheus text format on each scrape."""
+
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> CounterMetric:
+        return self._add(CounterMetric(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, collect: Callable[[], float]) -> GaugeMetric:
+        return self._add(GaugeMetric(name, help_text, collect))
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (), **kwargs: Any) -> HistogramMetric:
+        return self._add(HistogramMetric(name, help_text, labels, **kwargs))
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+api_requests_total = metrics.counter(
+    "darkbot_discord_requests_total", "Discord REST calls by route and outcome.", ("route", "status"))
+api_request_seconds = metrics.histogram(
+    "darkbot_discord_request_seconds", "Discord REST call duration by route, including rate-limit waits.", ("route",))
+ratelimit_hits_total = metrics.counter(
+    "darkbot_discord_ratelimit_hits_total", "429 responses discord.py retried (scope=global also counts as route).", ("scope",))
+ratelimit_wait_seconds_total = metrics.counter(
+    "darkbot_discord_ratelimit_wait_seconds_total", "Seconds discord.py slept on 429 retry-after.")
+mute_pacing_wait_seconds_total = metrics.counter(
+    "darkbot_mute_pacing_wait_seconds_total", "Seconds mute dispatchers waited on their own token buckets.")
+mute_edits_total = metrics.counter(
+    "darkbot_mute_edits_total", "Server-mute edits: sent, saved (coalesced or no-op) and failed.", ("result",))
+failed_edits_total = metrics.counter(
+    "darkbot_failed_edits_total", "Edits Discord rejected, by kind (mute, countdown, progress).", ("kind",))
+swallowed_errors_total = metrics.counter(
+    "darkbot_swallowed_errors_total", "Exceptions ignored by best-effort steps, by site.", ("site",))
+phase_transition_seconds = metrics.histogram(
+    "darkbot_phase_transition_seconds", "Phase deadline to the new segment's mutes queued and countdown posted.", ("phase",))
+alert_start_delay_seconds = metrics.histogram(
+    "darkbot_alert_start_delay_seconds", "One-minute alert playback start after its deadline.")
+loop_lag_seconds = metrics.histogram(
+    "darkbot_event_loop_lag_seconds", "Event-loop scheduling lag, sampled every LOOP_LAG_SAMPLE_SECONDS.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+metrics.gauge("darkbot_active_cycles", "Guilds with a running study/break cycle.",
+              lambda: sum(1 for s in sessions.values() if s.cycle is not None))
+metrics.gauge("darkbot_guild_sessions", "Guilds with tracked state.", lambda: len(sessions))
+metrics.gauge("darkbot_voice_connections", "Open voice connections.", lambda: len(bot.voice_clients))
+
+
+def _swallowed(site: str, error: BaseException) -> None:
+    """Count an exception a best-effort step ignores (logged only with hot-path logging on)."""
+    swallowed_errors_total.inc(site)
+    if LOG_HOT_PATHS:
+        _log(logging.DEBUG, "error.swallowed", site=site, error=repr(error))
+
+
+def _route_guild_id(channel_id: Optional[int], guild_id: Optional[int]) -> int:
+    """The guild a REST route belongs to (0 when it has none or its channel is unknown)."""
+    if guild_id:
+        return int(guild_id)
+    channel = bot.get_channel(int(channel_id)) if channel_id else None
+    guild = getattr(channel, "guild", None)
+    return guild.id if guild is not None else 0
+
+
+def _instrument_http(client: discord.Client) -> None:
+    """Count and time every REST call by its route template (e.g. "PATCH /guilds/{guild_id}/members/{user_id}")."""
+    request = client.http.request
+
+    async def instrumented(route, **kwargs):
+        label = f"{route.method} {route.path}"
+        await api_budget.acquire(_api_class.get())
+        started = clock.now()
+        status = "ok"
+        try:
+            return await request(route, **kwargs)
+        except discord.HTTPException as e:
+            status = str(e.status)
+            raise
+        except Exception:
+            status = "error"
+            raise
+        finally:
+            api_requests_total.inc(label, status)
+            api_request_seconds.observe(clock.now() - started, label)
+            if API_BUDGET_ENABLED:
+                _note_bucket(client.http, route)
+
+    client.http.request = instrumented
+
+
+def _route_ratelimit(http: Any, route: Any) -> Any:
+    """discord.py's rate-limit bucket for the route (a discord.http.Ratelimit), None until it has seen a response."""
+    # Same key discord.py files the route's bucket under
+    bucket_hash = getattr(http, "_bucket_hashes", {}).get(route.key)
+    return getattr(http, "_buckets", {}).get(f"{bucket_hash or route.key}:{route.major_parameters}")
+
+
+def _note_bucket(http: Any, route: Any) -> None:
+    """A call that drained its rate-limit bucket to zero adds a little pressure on the route's guild."""
+    ratelimit = _route_ratelimit(http, route)
+    if ratelimit is None or ratelimit.remaining != 0 or ratelimit.limit <= 1:
+        return
+    guild_id = _route_guild_id(route.channel_id, route.guild_id)
+    if guild_id:
+        api_budget.record(0.25, guild_id)
+
+
+_ROUTE_IDS = re.compile(r"/(guilds|channels)/(\d+)")
+
+
+class _RateLimitLogFilter(logging.Filter):
+    """
+    discord.py's rate-limit hook: counts the 429 retries it logs as warnings and feeds them to the
+    API budget, as pressure on the route's guild (or on everyone, for the global limit).
+    "discord.http" is kept at WARNING so the hook sees them even when "discord" is quieter; records
+    below the "discord" logger's own level are dropped here, so output is unchanged.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        message = record.msg if isinstance(record.msg, str) else ""
+        if message.startswith("We are being rate limited"):
+            ratelimit_hits_total.inc("route")
+            if record.args and len(record.args) >= 2:
+                match = _ROUTE_IDS.search(str(record.args[1]))
+                if match:
+                    is_guild = match.group(1) == "guilds"
+                    guild_id = _route_guild_id(None if is_guild else match.group(2), match.group(2) if is_guild else None)
+                    if guild_id:
+                        api_budget.record(1.0, guild_id)
+            if "Retrying in" in message and record.args:
+                ratelimit_wait_seconds_total.inc(amount=float(record.args[-1]))
+        elif message.startswith("Global rate limit has been hit"):
+            ratelimit_hits_total.inc("global")
+            api_budget.global_limited()
+        return record.levelno >= logging.getLogger("discord").getEffectiveLevel()
+
+
+_instrument_http(bot)
+logging.getLogger("discord.http").addFilter(_RateLimitLogFilter())
+logging.getLogger("discord.http").setLevel(logging.WARNING)
+
+
+async def _sample_loop_lag() -> None:
+    while True:
+        before = clock.now()
+        await clock.sleep(LOOP_LAG_SAMPLE_SECONDS)
+        loop_lag_seconds.observe(max(0.0, clock.now() - before - LOOP_LAG_SAMPLE_SECONDS))
+
+
+# Keeps the metrics endpoint (and the lag sampler) alive once started
+_metrics_runner: Optional[web.AppRunner] = None
+_loop_lag_task: Optional[asyncio.Task] = None
+
+
+async def _start_metrics_server() -> None:
+    """Serve GET /metrics on METRICS_HOST:METRICS_PORT (once; a no-op when METRICS_PORT is 0)."""
+    global _metrics_runner, _loop_lag_task
+    if not METRICS_PORT or _metrics_runner is not None:
+        return
+
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=metrics.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    except OSError as e:
+        _log(logging.ERROR, "metrics.listen_failed", host=METRICS_HOST, port=METRICS_PORT, error=e)
+        await runner.cleanup()
+        return
+    _metrics_runner = runner
+    _loop_lag_task = asyncio.get_running_loop().create_task(_sample_loop_lag())
+    _log(logging.INFO, "metrics.listening", url=f"http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+
+# ---- Scheduler ----
+class TimerHandle:
+    """A single scheduled callback. Cancelling only flips a flag (O(1)); the heap drops it lazily."""
+
+    __slots__ = ("when", "callback", "args", "cancelled", "_owner")
+
+    def __init__(self, owner: "TimerScheduler", when: float, callback: Callable[..., Any], args: Tuple[Any, ...]):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        # Set while the handle still sits in the owner's heap
+        self._owner: Optional[TimerScheduler] = owner
+
+    def cancel(self) -> None:
+        if not self.cancelled:
+            self.cancelled = True
+            # Drop references early so cancelled guilds can be garbage collected
+            self.callback = None
+            self.args = ()
+            if self._owner is not None:
+                self._owner._cancelled_count += 1
+
+
+class TimerScheduler:
+    """
+    One heap of absolute (loop clock) deadlines shared by every guild.
+    A single runner task sleeps until the earliest deadline and dispatches everything
+    that is due in one batch, so thousands of cycles cost one task and one loop timer.
+    """
+
+    # Deadlines this close to the head are dispatched together with it
+    BATCH_SLACK_SECONDS = 0.005
+
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int, TimerHandle]] = []
+        self._seq = itertools.count()
+        self._cancelled_count = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._wakeup_handle: Optional[asyncio.TimerHandle] = None
+        self._runner: Optional[asyncio.Task] = None
+
+    def time(self) -> float:
+        return clock.now()
+
+    def __len__(self) -> int:
+        return len(self._heap) - self._cancelled_count
+
+    def call_at(self, when: float, callback: Callable[..., Any], *args: Any) -> TimerHandle:
+        handle = TimerHandle(self, when, callback, args)
+        heapq.heappush(self._heap, (when, next(self._seq), handle))
+        self._ensure_runner()
+        if self._heap[0][2] is handle:
+            # New earliest deadline: re-arm the single loop timer
+            self._arm()
+        return handle
+
+    def call_later(self, delay: float, callback: Callable[..., Any], *args: Any) -> TimerHandle:
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def _ensure_runner(self) -> None:
+        if self._runner is None or self._runner.done():
+            self._wakeup = asyncio.Event()
+            self._runner = asyncio.get_running_loop().create_task(self._run())
+
+    def _arm(self) -> None:
+        if self._wakeup_handle is not None:
+            self._wakeup_handle.cancel()
+            self._wakeup_handle = None
+        if self._heap and self._wakeup is not None:
+            self._wakeup_handle = asyncio.get_running_loop().call_at(self._heap[0][0], self._wakeup.set)
+
+    def _compact(self) -> None:
+        # Rebuild once more than half of the heap is cancelled entries
+        self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+        heapq.heapify(self._heap)
+        self._cancelled_count = 0
+
+    async def _run(self) -> None:
+        assert self._wakeup is not None
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._cancelled_count > 64 and self._cancelled_count * 2 > len(self._heap):
+                self._compact()
+            horizon = self.time() + self.BATCH_SLACK_SECONDS
+            batch: List[TimerHandle] = []
+            while self._heap and self._heap[0][0] <= horizon:
+                _, _, handle = heapq.heappop(self._heap)
+                handle._owner = None
+                if handle.cancelled:
+                    self._cancelled_count -= 1
+                    continue
+                batch.append(handle)
+            self._arm()
+            if batch:
+                loop.create_task(self._dispatch(batch))
+
+    async def _dispatch(self, batch: List[TimerHandle]) -> None:
+        coros = []
+        for handle in batch:
+            # A handle may be cancelled by an earlier callback in the same batch
+            if handle.cancelled:
+                continue
+            callback, args = handle.callback, handle.args
+            handle.cancelled = True
+            handle.callback = None
+            handle.args = ()
+            try:
+                result = callback(*args)
+            except Exception as e:
+                _log(logging.ERROR, "scheduler.callback_error", error=repr(e))
+                continue
+            if asyncio.iscoroutine(result):
+                coros.append(result)
+        if coros:
+            results = await asyncio.gather(*coros, return_exceptions=True)
+            for result in results:
+                if isinstance(result, Exception):
+                    _log(logging.ERROR, "scheduler.callback_error", error=repr(result))
+
+
+scheduler = TimerScheduler()
+
+
+# ---- Guild actors ----
+# Messages a guild's mailbox holds before senders are suspended
+ACTOR_MAILBOX_SIZE = int(os.environ.get("ACTOR_MAILBOX_SIZE", "256"))
+
+actor_messages_total = metrics.counter(
+    "darkbot_actor_messages_total", "Messages processed by guild actors, by kind (command, timer, voice).", ("kind",))
+actor_backpressure_total = metrics.counter(
+    "darkbot_actor_backpressure_total", "Sends that waited because a guild's mailbox was full.")
+actor_queue_seconds = metrics.histogram(
+    "darkbot_actor_queue_seconds", "Time a message waited in its guild's mailbox before it ran.",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+
+
+class GuildActor:
+    """
+    Runs one guild's commands, cycle timer firings and voice events one at a time, in arrival order,
+    so their awaits never interleave on the guild's session.
+    The mailbox is bounded: senders wait while it is full. A worker task exists only while the
+    mailbox has messages, so idle guilds cost nothing and busy guilds each get their own task.
+    """
+
+    __slots__ = ("guild_id", "_mailbox", "_worker", "processed")
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        # (kind, handler, args, kwargs, result future or None, enqueue time)
+        self._mailbox: asyncio.Queue = asyncio.Queue(ACTOR_MAILBOX_SIZE)
+        self._worker: Optional[asyncio.Task] = None
+        self.processed = 0
+
+    def __len__(self) -> int:
+        return self._mailbox.qsize()
+
+    async def send(self, kind: str, handler: Callable[..., Any], *args: Any) -> None:
+        """Queue `handler(*args)` (sync or async) without waiting for it to run."""
+        await self._put((kind, handler, args, {}, None, clock.now()))
+
+    async def call(self, kind: str, handler: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Queue `handler(*args, **kwargs)` and wait for its result (or exception)."""
+        if self._worker is asyncio.current_task():
+            # Already running on this actor: queuing behind ourselves would deadlock
+            return await _run_handler(handler, args, kwargs)
+        future = asyncio.get_running_loop().create_future()
+        await self._put((kind, handler, args, kwargs, future, clock.now()))
+        return await future
+
+    async def _put(self, message: Tuple) -> None:
+        mailbox = self._mailbox
+        if mailbox.full():
+            actor_backpressure_total.inc()
+        await mailbox.put(message)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        mailbox = self._mailbox
+        while not mailbox.empty():
+            kind, handler, args, kwargs, future, queued_at = mailbox.get_nowait()
+            actor_queue_seconds.observe(clock.now() - queued_at)
+            actor_messages_total.inc(kind)
+            self.processed += 1
+            try:
+                result = await _run_handler(handler, args, kwargs)
+            except Exception as e:
+                if future is None:
+                    _log(logging.ERROR, "actor.handler_error", guild=self.guild_id, kind=kind, error=repr(e))
+                elif not future.done():
+                    future.set_exception(e)
+            else:
+                if future is not None and not future.done():
+                    future.set_result(result)
+
+
+async def _run_handler(handler: Callable[..., Any], args: Tuple, kwargs: Dict[str, Any]) -> Any:
+    result = handler(*args, **kwargs)
+    if asyncio.iscoroutine(result):
+        result = await result
+    return result
+
+
+def _actor(guild_id: int) -> GuildActor:
+    session = _session(guild_id)
+    if session.actor is None:
+        session.actor = GuildActor(guild_id)
+    return session.actor
+
+
+def _in_guild_actor(func: Callable[..., Any]) -> Callable[..., Any]:
+    """Command decorator: run the callback on its guild's actor (outside a guild it runs directly)."""
+
+    @functools.wraps(func)
+    async def wrapper(ctx: commands.Context, *args: Any, **kwargs: Any) -> Any:
+        if ctx.guild is None:
+            return await func(ctx, *args, **kwargs)
+        return await _actor(ctx.guild.id).call("command", func, ctx, *args, **kwargs)
+
+    return wrapper
+
+
+# ---- Session store ----
+class StoredSession(NamedTuple):
+    """One running cycle as persisted. Times are wall-clock epoch seconds so they survive restarts."""
+
+    guild_id: int
+    study_minutes: int
+    break_minutes: int
+    phase: str
+    label: str
+    phase_number: int
+    segment_minutes: int
+    started_wall: float
+    study_count: int
+    pending_extension: int
+    status_channel_id: int
+    status_message_id: int
+    voice_channel_id: int
+    announce_channel_id: int
+
+
+class SessionStore:
+    """
+    SQLite (WAL mode) persistence for running cycles.
+    save()/delete() only record the latest row per guild in memory; rows are committed together
+    in one transaction SESSION_FLUSH_INTERVAL_SECONDS later, off the event loop.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        # guild_id -> latest row, or None to delete
+        self._dirty: Dict[int, Optional[StoredSession]] = {}
+        self._flush_handle: Optional[TimerHandle] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            columns = ", ".join(
+                f"{name} {'TEXT' if name in ('phase', 'label') else 'REAL' if name == 'started_wall' else 'INTEGER'}"
+                + (" PRIMARY KEY" if name == "guild_id" else "")
+                for name in StoredSession._fields
+            )
+            conn.execute(f"CREATE TABLE IF NOT EXISTS sessions ({columns})")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def save(self, session: StoredSession) -> None:
+        self._dirty[session.guild_id] = session
+        self._schedule_flush()
+
+    def delete(self, guild_id: int) -> None:
+        self._dirty[guild_id] = None
+        self._schedule_flush()
+
+    def _schedule_flush(self) -> None:
+        if self._flush_handle is None:
+            self._flush_handle = scheduler.call_later(SESSION_FLUSH_INTERVAL_SECONDS, self.flush)
+
+    async def flush(self) -> None:
+        self._flush_handle = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            dirty, self._dirty = self._dirty, {}
+            if dirty:
+                try:
+                    await asyncio.to_thread(self._write, dirty)
+                except sqlite3.Error as e:
+                    _log(logging.WARNING, "store.write_failed", rows=len(dirty), error=e)
+                    # Newer writes made during the failed attempt win
+                    dirty.update(self._dirty)
+                    self._dirty = dirty
+                    self._schedule_flush()
+
+    def flush_sync(self) -> None:
+        """Write pending rows from outside the event loop (e.g. at shutdown)."""
+        dirty, self._dirty = self._dirty, {}
+        if dirty:
+            self._write(dirty)
+
+    def _write(self, dirty: Dict[int, Optional[StoredSession]]) -> None:
+        conn = self._connection()
+        placeholders = ", ".join("?" for _ in StoredSession._fields)
+        with conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO sessions VALUES ({placeholders})",
+                [row for row in dirty.values() if row is not None],
+            )
+            conn.executemany(
+                "DELETE FROM sessions WHERE guild_id = ?",
+                [(guild_id,) for guild_id, row in dirty.items() if row is None],
+            )
+
+    def load_all(self, shard_ids: Iterable[int] = (), shard_count: int = 0) -> List[StoredSession]:
+        """Every stored cycle, or only those of guilds on `shard_ids` (of `shard_count`) when given."""
+        query = f"SELECT {', '.join(StoredSession._fields)} FROM sessions"
+        shard_ids = list(shard_ids)
+        if shard_ids:
+            query += f" WHERE ((guild_id >> 22) % ?) IN ({', '.join('?' for _ in shard_ids)})"
+        rows = self._connection().execute(query, [shard_count, *shard_ids] if shard_ids else []).fetchall()
+        return [StoredSession(*row) for row in rows]
+
+
+session_store = SessionStore(SESSION_DB_PATH)
+
+
+# ---- API budget ----
+# Every REST call passes one gate paced under Discord's global limit (API_BUDGET=0 turns the gate
+# and the load shedding below off)
+API_BUDGET_ENABLED = os.environ.get("API_BUDGET", "1") == "1"
+API_GLOBAL_PER_SECOND = float(os.environ.get("API_GLOBAL_PER_SECOND", "45"))
+# Rate-limit pressure, per guild: each 429 on one of its routes adds 1 and each of its buckets drained
+# to zero 0.25; a global 429 adds 0.5 for every guild, on a separate score that halves every
+# API_GLOBAL_PRESSURE_HALF_LIFE_SECONDS (the gate's rate cut already answers it), so only a run of
+# global 429s sheds everyone's work. Guild scores halve every API_PRESSURE_HALF_LIFE_SECONDS. At DEGRADED
+# countdown edits are thinned to every DEGRADED_COUNTDOWN_EVERY_MINUTES (plus milestones and the last
+# minute) and cleanup waits CLEANUP_DEFER_SECONDS; at CRITICAL countdown edits stop until the last minute
+API_PRESSURE_HALF_LIFE_SECONDS = 20.0
+API_GLOBAL_PRESSURE = 0.5
+API_GLOBAL_PRESSURE_HALF_LIFE_SECONDS = 5.0
+API_PRESSURE_DEGRADED = 3.0
+API_PRESSURE_CRITICAL = 10.0
+# Scores stop growing here, so a long storm still clears within a few half-lives
+API_PRESSURE_MAX = 2 * API_PRESSURE_CRITICAL
+# A global 429 halves the gate's rate; it climbs back by this many calls/s every second
+API_GATE_RECOVERY_PER_SECOND = 1.0
+DEGRADED_COUNTDOWN_EVERY_MINUTES = 5
+CLEANUP_DEFER_SECONDS = 30.0
+# Call classes, most important first; queued calls leave the gate in this order
+API_CLASSES = ("mute", "alert", "announce", "countdown", "cleanup")
+_API_PRIORITY = {kind: i for i, kind in enumerate(API_CLASSES)}
+
+# The class of the REST calls the current task makes (set with @_api_calls)
+_api_class: "contextvars.ContextVar[str]" = contextvars.ContextVar("api_class", default="announce")
+
+api_gate_wait_seconds = metrics.histogram(
+    "darkbot_api_gate_wait_seconds", "Time REST calls waited at the API budget gate, by class.", ("class",),
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+api_shed_total = metrics.counter(
+    "darkbot_api_shed_total", "Calls skipped or deferred under rate-limit pressure (countdown edits, cleanups).", ("kind",))
+
+
+def _api_calls(kind: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator: REST calls made while the coroutine runs belong to the `kind` class."""
+
+    def decorate(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> Any:
+            token = _api_class.set(kind)
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                _api_class.reset(token)
+
+        return wrapper
+
+    return decorate
+
+
+class TokenBucket:
+    """Pacing on the shared clock: bursts of up to `capacity`, refilled at `rate` tokens per second."""
+
+    __slots__ = ("capacity", "rate", "tokens", "refilled_at")
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = float(capacity)
+        self.rate = rate
+        self.tokens = float(capacity)
+        self.refilled_at = 0.0
+
+    def _refill(self, now: float) -> None:
+        # A hold can put the next refill in the future; nothing accrues before then
+        if now > self.refilled_at:
+            self.tokens = min(self.capacity, self.tokens + (now - self.refilled_at) * self.rate)
+            self.refilled_at = now
+
+    async def take(self) -> float:
+        """Wait until a token is available and take it. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            now = clock.now()
+            self._refill(now)
+            # (a hair under a whole token counts: the sleep for it would not move the clock)
+            if self.tokens >= 1.0 - 1e-9:
+                self.tokens = max(0.0, self.tokens - 1.0)
+                return waited
+            wait = max(0.0, self.refilled_at - now) + (1.0 - self.tokens) / self.rate
+            waited += wait
+            await clock.sleep(wait)
+
+    def try_take(self) -> bool:
+        """Take a token if one is available right now."""
+        self._refill(clock.now())
+        if self.tokens >= 1.0 - 1e-9:
+            self.tokens = max(0.0, self.tokens - 1.0)
+            return True
+        return False
+
+    def refund(self) -> None:
+        """Give back a token that was taken but not spent on a request."""
+        self.tokens += 1.0
+
+    def hold(self, tokens: int, until: float) -> None:
+        """Follow a server-side window: `tokens` more before `until`, when refilling resumes."""
+        if tokens > 0:
+            self.tokens = min(self.capacity, float(tokens))
+            self.refilled_at = max(self.refilled_at, until)
+        else:
+            # One token's refill short of `until`, so the next token lands exactly then
+            self.tokens = 0.0
+            self.refilled_at = max(self.refilled_at, until - 1.0 / self.rate)
+
+
+class SlidingWindow:
+    """
+    At most `rate` calls in any one-second window, like Discord's global limit. Unlike a token bucket,
+    a burst of up to `rate` leaves at once without letting a second burst follow inside the same second.
+    """
+
+    __slots__ = ("rate", "sent")
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        # Loop times of the calls let through in the last second, oldest first
+        self.sent: Deque[float] = deque()
+
+    def _wait(self, now: float) -> float:
+        """Seconds until there is room for one more call (0: room now)."""
+        sent = self.sent
+        while sent and sent[0] <= now - 1.0:
+            sent.popleft()
+        limit = max(1, int(self.rate))
+        if len(sent) < limit:
+            return 0.0
+        # The call that has to age out of the window first (more than one when the rate was just cut)
+        return sent[len(sent) - limit] + 1.0 - now
+
+    async def take(self) -> float:
+        """Wait until the window has room and count one call. Returns the seconds spent waiting."""
+        waited = 0.0
+        while True:
+            now = clock.now()
+            wait = self._wait(now)
+            if wait <= 0.0:
+                self.sent.append(now)
+                return waited
+            waited += wait
+            await clock.sleep(wait)
+
+    def try_take(self) -> bool:
+        """Count one call if the window has room right now."""
+        now = clock.now()
+        if self._wait(now) > 0.0:
+            return False
+        self.sent.append(now)
+        return True
+
+    def refund(self) -> None:
+        """Uncount the last call: it was let through but never sent."""
+        if self.sent:
+            self.sent.pop()
+
+
+class ApiBudget:
+    """
+    Central budget for the bot's REST calls.
+    Calls are limited to API_GLOBAL_PER_SECOND in any one-second window (the rate is halved on each global
+    429, then recovers linearly); when they have to wait, they leave in API_CLASSES order.
+    Rate-limit signals from discord.py raise a decaying pressure score for the guild whose route they
+    hit (or for everyone, on a global 429). A guild's score decides whether its sheddable work
+    (countdown edits, cleanup) runs now; it comes back on its own as the pressure decays.
+    """
+
+    def __init__(self) -> None:
+        # A sliding window rather than a token bucket: a full bucket plus its refill would let up to
+        # twice the rate through in one second
+        self._window = SlidingWindow(API_GLOBAL_PER_SECOND)
+        # (priority, sequence, future) of calls waiting for the gate
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._pump: Optional[asyncio.Task] = None
+        # guild id (0: the global limit) -> [score, last update]; decayed entries are dropped
+        self._pressure: Dict[int, List[float]] = {}
+        self._rate_at = 0.0
+        self._cut_at = float("-inf")
+
+    def pressure(self, guild_id: int = 0) -> float:
+        entry = self._pressure.get(guild_id)
+        if entry is None:
+            return 0.0
+        now = clock.now()
+        half_life = API_PRESSURE_HALF_LIFE_SECONDS if guild_id else API_GLOBAL_PRESSURE_HALF_LIFE_SECONDS
+        score = entry[0] * 0.5 ** ((now - entry[1]) / half_life)
+        if score < 0.05:
+            del self._pressure[guild_id]
+            return 0.0
+        entry[0], entry[1] = score, now
+        return score
+
+    def record(self, weight: float, guild_id: int = 0) -> None:
+        """Add a rate-limit signal for one guild's routes (0: the global limit)."""
+        self._pressure[guild_id] = [min(API_PRESSURE_MAX, self.pressure(guild_id) + weight), clock.now()]
+
+    def global_limited(self) -> None:
+        """A global 429: everyone is under pressure and the gate was pacing too fast, so halve it."""
+        self.record(API_GLOBAL_PRESSURE)
+        if not API_BUDGET_ENABLED:
+            return
+        self._recover()
+        # 429s from one burst all report the same overshoot: cut once per second at most
+        if clock.now() - self._cut_at >= 1.0:
+            self._cut_at = clock.now()
+            self._window.rate = max(1.0, self._window.rate / 2)
+
+    def rate(self) -> float:
+        return self._window.rate
+
+    def _recover(self) -> None:
+        now = clock.now()
+        if self._window.rate < API_GLOBAL_PER_SECOND:
+            self._window.rate = min(API_GLOBAL_PER_SECOND,
+                                    self._window.rate + (now - self._rate_at) * API_GATE_RECOVERY_PER_SECOND)
+        self._rate_at = now
+
+    def level(self, guild_id: int = 0) -> int:
+        """0 normal, 1 degraded, 2 critical. A guild's level includes global pressure."""
+        pressure = max(self.pressure(0), self.pressure(guild_id)) if guild_id else self.pressure(0)
+        return 2 if pressure >= API_PRESSURE_CRITICAL else 1 if pressure >= API_PRESSURE_DEGRADED else 0
+
+    def degraded_guilds(self) -> int:
+        return sum(1 for guild_id in list(self._pressure) if guild_id and self.level(guild_id))
+
+    def allows_countdown(self, guild_id: int, remaining_minutes: int) -> bool:
+        if not API_BUDGET_ENABLED or remaining_minutes <= 1:
+            return True
+        level = self.level(guild_id)
+        if level == 0:
+            return True
+        if level == 1:
+            return remaining_minutes % DEGRADED_COUNTDOWN_EVERY_MINUTES == 0 or remaining_minutes in STATUS_MILESTONES
+        return False
+
+    def allows_cleanup(self, guild_id: int) -> bool:
+        return not API_BUDGET_ENABLED or self.level(guild_id) == 0
+
+    async def acquire(self, kind: str) -> None:
+        """Wait for the gate to let one call of this class through."""
+        if not API_BUDGET_ENABLED:
+            return
+        self._recover()
+        if not self._waiters and self._window.try_take():
+            return
+        started = clock.now()
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (_API_PRIORITY.get(kind, 2), next(self._seq), waiter))
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.get_running_loop().create_task(self._release())
+        await waiter
+        api_gate_wait_seconds.observe(clock.now() - started, kind)
+
+    async def _release(self) -> None:
+        while self._waiters:
+            # The rate recovers while a backlog drains, not only when new calls arrive
+            self._recover()
+            await self._window.take()
+            # Highest priority first; callers that gave up leave their token for the next one
+            while self._waiters:
+                _, _, waiter = heapq.heappop(self._waiters)
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+            else:
+                self._window.refund()
+
+
+api_budget = ApiBudget()
+metrics.gauge("darkbot_api_pressure", "Decaying global rate-limit pressure score.", lambda: api_budget.pressure())
+metrics.gauge("darkbot_api_level", "Global API budget level: 0 normal, 1 degraded, 2 critical.", lambda: api_budget.level())
+metrics.gauge("darkbot_api_gate_rate", "Calls per second the API budget gate currently lets through.",
+              lambda: api_budget.rate())
+metrics.gauge("darkbot_api_degraded_guilds", "Guilds shedding countdown edits and cleanup under rate-limit pressure.",
+              lambda: api_budget.degraded_guilds())
+
+
+# ---- Mute dispatch ----
+# Pacing for PATCH /guilds/{guild_id}/members/{user_id}; Discord buckets that route per guild at
+# 10 requests per 10 s. The bucket also follows the remaining/reset discord.py reads from the headers
+MUTE_BUCKET_CAPACITY = 10
+MUTE_BUCKET_REFILL_PER_SECOND = 1.0
+# Joins to dark-voice within this window are enforced as one batch
+JOIN_BATCH_WINDOW_SECONDS = 0.25
+# Mute reconciliation: base pass interval (0 disables it) and the ceiling its backoff grows to
+RECONCILE_INTERVAL_SECONDS = float(os.environ.get("RECONCILE_INTERVAL_SECONDS", "30"))
+RECONCILE_MAX_INTERVAL_SECONDS = float(os.environ.get("RECONCILE_MAX_INTERVAL_SECONDS", "300"))
+
+
+class MuteDispatcher:
+    """
+    Per-guild queue of desired server-mute states.
+    Only the latest desired state per member is kept, so a mute followed by an unmute before
+    dispatch cancels out. Edits are paced with a token bucket to stay under the route's limit.
+    """
+
+    # The route every mute edit goes through; its major parameter is the guild
+    ROUTE_PATH = "/guilds/{guild_id}/members/{user_id}"
+
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        # member_id -> (member, desired mute, audit reason, waiters)
+        self._pending: Dict[int, Tuple[discord.Member, bool, str, List[asyncio.Future]]] = {}
+        self._inflight: Dict[int, asyncio.Task] = {}
+        self._bucket = TokenBucket(MUTE_BUCKET_CAPACITY, MUTE_BUCKET_REFILL_PER_SECOND)
+        self._worker: Optional[asyncio.Task] = None
+        # Counters: edits actually sent, edits avoided by coalescing/no-op, failed edits
+        self.sent = 0
+        self.saved = 0
+        self.failed = 0
+
+    def busy(self, member_id: int) -> bool:
+        """Whether an edit for the member is still queued or in flight."""
+        return member_id in self._pending or member_id in self._inflight
+
+    def submit(self, member: discord.Member, mute: bool, reason: str) -> None:
+        """Queue the member's desired mute state, replacing any state still waiting for dispatch."""
+        entry = self._pending.get(member.id)
+        if entry is not None:
+            # Superseded before dispatch: keep one entry carrying the newest state
+            self.saved += 1
+            mute_edits_total.inc("saved")
+            waiters = entry[3]
+        else:
+            if member.voice is not None and member.voice.mute == mute and member.id not in self._inflight:
+                self.saved += 1
+                mute_edits_total.inc("saved")
+                return
+            waiters = []
+        self._pending[member.id] = (member, mute, reason, waiters)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._drain())
+
+    async def apply(self, member: discord.Member, mute: bool, reason: str) -> bool:
+        """Queue the member's mute state and wait for it. Returns True if an edit was sent."""
+        self.submit(member, mute, reason)
+        entry = self._pending.get(member.id)
+        if entry is None:
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        entry[3].append(waiter)
+        return await waiter
+
+    async def _take_token(self) -> None:
+        waited = await self._bucket.take()
+        if waited:
+            mute_pacing_wait_seconds_total.inc(amount=waited)
+
+    async def _drain(self) -> None:
+        # Entries submitted while the last edits are in flight are picked up by the outer loop
+        while self._pending or self._inflight:
+            while self._pending:
+                await self._take_token()
+                if not self._pending:
+                    self._bucket.refund()
+                    break
+                member_id = next(iter(self._pending))
+                member, mute, reason, waiters = self._pending.pop(member_id)
+                previous = self._inflight.get(member_id)
+                if previous is not None:
+                    # Keep per-member edits ordered
+                    await asyncio.gather(previous, return_exceptions=True)
+                if member.voice is not None and member.voice.mute == mute:
+                    self.saved += 1
+                    mute_edits_total.inc("saved")
+                    self._bucket.refund()
+                    _resolve_waiters(waiters, False)
+                    continue
+                task = asyncio.get_running_loop().create_task(self._edit(member, mute, reason, waiters))
+                self._inflight[member_id] = task
+            if self._inflight:
+                await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+        if LOG_HOT_PATHS:
+            _log(logging.DEBUG, "mute.drained", guild=self.guild_id, sent=self.sent, saved=self.saved, failed=self.failed)
+
+    @_api_calls("mute")
+    async def _edit(self, member: discord.Member, mute: bool, reason: str, waiters: List[asyncio.Future]) -> None:
+        try:
+            await member.edit(mute=mute, reason=reason)
+        except Exception as e:
+            self.failed += 1
+            mute_edits_total.inc("failed")
+            failed_edits_total.inc("mute")
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+        else:
+            self.sent += 1
+            mute_edits_total.inc("sent")
+            _resolve_waiters(waiters, True)
+        finally:
+            if self._inflight.get(member.id) is asyncio.current_task():
+                del self._inflight[member.id]
+            self._follow_route()
+
+    def _follow_route(self) -> None:
+        """
+        Line the bucket up with the window discord.py last saw for this guild's member route. Edits still in
+        flight may not be counted in that window yet, so they come off what it has left.
+        """
+        route = discord.http.Route("PATCH", self.ROUTE_PATH, guild_id=self.guild_id, user_id=0)
+        ratelimit = _route_ratelimit(bot.http, route)
+        if ratelimit is None or ratelimit.expires is None or ratelimit.is_expired():
+            return
+        self._bucket.hold(ratelimit.remaining - len(self._inflight), ratelimit.expires)
+
+
+def _resolve_waiters(waiters: List[asyncio.Future], result: bool) -> None:
+    for waiter in waiters:
+        if not waiter.done():
+            waiter.set_result(result)
+
+
+def _mute_dispatcher(guild_id: int) -> MuteDispatcher:
+    session = _session(guild_id)
+    if session.mute_dispatcher is None:
+        session.mute_dispatcher = MuteDispatcher(guild_id)
+    return session.mute_dispatcher
+
+
+def _queue_mute(member: discord.Member, mute: bool, reason: str) -> None:
+    """Fire-and-forget: the guild's dispatcher applies the latest state for this member."""
+    _mute_dispatcher(member.guild.id).submit(member, mute, reason)
+
+
+async def _apply_mute(member: discord.Member, mute: bool, reason: str) -> bool:
+    """Queue and wait; raises the edit's exception (e.g. discord.Forbidden) to the caller."""
+    return await _mute_dispatcher(member.guild.id).apply(member, mute, reason)
+
+
+def _queue_join(session: GuildSession, member: discord.Member) -> None:
+    """Gather a joining member; the first join of a burst opens the batch window."""
+    joins = session.pending_joins
+    if joins is None:
+        joins = session.pending_joins = {}
+        scheduler.call_later(JOIN_BATCH_WINDOW_SECONDS, _flush_joins, session)
+    joins[member.id] = member
+
+
+def _flush_joins(session: GuildSession) -> None:
+    """Enforce the phase as it is now on everyone still in dark-voice from the window."""
+    joins, session.pending_joins = session.pending_joins, None
+    if not joins or not session.phase or sessions.get(session.guild_id) is not session:
+        return
+    mute = session.phase == "study"
+    now = clock.now()
+    dispatcher = _mute_dispatcher(session.guild_id)
+    hold = session.unmute_hold or ()
+    for member in joins.values():
+        voice = member.voice
+        if voice is None or voice.channel is None or voice.channel.id != session.voice_channel_id:
+            continue
+        if mute and member.id in hold:
+            continue
+        session.mark_edited(member.id, now)
+        # The dispatcher drops members whose state already matches
+        dispatcher.submit(member, mute, "Learning cycle server mute (join/update)")
+
+
+# ---- Mute reconciliation ----
+reconcile_passes_total = metrics.counter(
+    "darkbot_reconcile_passes_total", "Mute reconciliation passes over running cycles.")
+reconcile_drift_total = metrics.counter(
+    "darkbot_reconcile_drift_total", "Members found in the wrong mute state for their phase, by phase.", ("phase",))
+reconcile_fixed_total = metrics.counter(
+    "darkbot_reconcile_fixed_total", "Drifted members whose mute state the reconciler corrected.")
+# Current pass interval (grows while Discord rate-limits us, shrinks back when it stops)
+_reconcile_interval = RECONCILE_INTERVAL_SECONDS
+metrics.gauge("darkbot_reconcile_interval_seconds", "Seconds until the next mute reconciliation pass.",
+              lambda: _reconcile_interval)
+_reconcile_task: Optional[asyncio.Task] = None
+
+
+def _find_drift(session: GuildSession) -> List[discord.Member]:
+    """Members of the session's dark-voice whose cached mute state disagrees with the phase."""
+    cycle = session.cycle
+    channel = cycle.channel if cycle is not None else None
+    if channel is None or not session.phase:
+        return []
+    mute = session.phase == "study"
+    dispatcher = session.mute_dispatcher
+    hold = session.unmute_hold or ()
+    now = clock.now()
+    me_id = bot.user.id if bot.user else 0
+    drift = []
+    for member in channel.members:
+        voice = member.voice
+        if member.bot or member.id == me_id or voice is None or voice.mute == mute:
+            continue
+        # Skip members with an edit on its way or whose last edit's voice update may not be back yet
+        if dispatcher is not None and dispatcher.busy(member.id):
+            continue
+        if session.edited_recently(member.id, now) or (mute and member.id in hold):
+            continue
+        drift.append(member)
+    return drift
+
+
+async def _reconcile_once() -> Tuple[int, int]:
+    """One pass: queue edits only for drifted members and wait for them. Returns (drifted, fixed)."""
+    reconcile_passes_total.inc()
+    edits = []
+    now = clock.now()
+    for session in list(sessions.values()):
+        drift = _find_drift(session)
+        if not drift:
+            continue
+        mute = session.phase == "study"
+        reconcile_drift_total.inc(session.phase, amount=len(drift))
+        dispatcher = _mute_dispatcher(session.guild_id)
+        for member in drift:
+            session.mark_edited(member.id, now)
+            edits.append(dispatcher.apply(member, mute, "Learning cycle server mute (reconcile)"))
+    if not edits:
+        return 0, 0
+    results = await asyncio.gather(*edits, return_exceptions=True)
+    fixed = sum(1 for result in results if result is True)
+    reconcile_fixed_total.inc(amount=fixed)
+    _log(logging.INFO, "reconcile.drift", drifted=len(edits), fixed=fixed)
+    return len(edits), fixed
+
+
+def _under_pressure(hits_before: float) -> bool:
+    """Discord answered 429 since the last pass, or a guild still has mute edits queued."""
+    hits = sum(ratelimit_hits_total.values.values())
+    return hits > hits_before or any(
+        s.mute_dispatcher is not None and s.mute_dispatcher._pending for s in sessions.values()
+    )
+
+
+async def _reconcile_loop() -> None:
+    """
+    Every RECONCILE_INTERVAL_SECONDS, compare each running cycle's phase with the cached voice mute
+    state of its dark-voice members and correct only the ones that drifted (dropped voice events
+    after a reconnect, edits that failed). Under rate-limit pressure the interval doubles, up to
+    RECONCILE_MAX_INTERVAL_SECONDS (where passes run regardless), and halves back once things are quiet.
+    """
+    global _reconcile_interval
+    while True:
+        hits_before = sum(ratelimit_hits_total.values.values())
+        await clock.sleep(_reconcile_interval)
+        if _under_pressure(hits_before):
+            if _reconcile_interval < RECONCILE_MAX_INTERVAL_SECONDS:
+                _reconcile_interval = min(_reconcile_interval * 2, RECONCILE_MAX_INTERVAL_SECONDS)
+                continue
+            # Already at the ceiling: reconcile anyway, so drift is never left in place indefinitely
+        else:
+            _reconcile_interval = max(_reconcile_interval / 2, RECONCILE_INTERVAL_SECONDS)
+        try:
+            await _reconcile_once()
+        except Exception as e:
+            _swallowed("reconcile.pass", e)
+
+
+def _start_reconciler() -> None:
+    global _reconcile_task
+    if RECONCILE_INTERVAL_SECONDS > 0 and _reconcile_task is None:
+        _reconcile_task = asyncio.get_running_loop().create_task(_reconcile_loop())
+
+
+# ---- Channel index ----
+def _is_dark_voice_name(name: str) -> bool:
+    # Exact name or prefix (handles renamed countdown)
+    return name.startswith(DARK_VOICE_CHANNEL_NAME)
+
+
+def _index_guild_channels(guild: discord.Guild) -> GuildSession:
+    """(Re)build the guild's dark-voice/dark-chat index with one scan over its channels."""
+    session = _session(guild.id)
+    session.dark_voice = None
+    session.dark_chat = None
+    for channel in guild.voice_channels:
+        if channel.name == DARK_VOICE_CHANNEL_NAME:
+            session.dark_voice = channel
+            break
+        if session.dark_voice is None and _is_dark_voice_name(channel.name):
+            session.dark_voice = channel
+    for channel in guild.text_channels:
+        if channel.name == DARK_CHAT_CHANNEL_NAME:
+            session.dark_chat = channel
+            break
+    session.channels_indexed = True
+    return session
+
+
+def _dark_channels(guild: discord.Guild) -> GuildSession:
+    """The guild's session with its channel index built (avoids scanning every channel on each lookup)."""
+    session = _session(guild.id)
+    if not session.channels_indexed:
+        # Not indexed yet (e.g. event before on_ready); build it once
+        _index_guild_channels(guild)
+    return session
+
+
+def _channel_affects_index(channel: discord.abc.GuildChannel) -> bool:
+    session = sessions.get(channel.guild.id)
+    if session is not None and (channel == session.dark_voice or channel == session.dark_chat):
+        return True
+    if isinstance(channel, discord.VoiceChannel):
+        return _is_dark_voice_name(channel.name)
+    if isinstance(channel, discord.TextChannel):
+        return channel.name == DARK_CHAT_CHANNEL_NAME
+    return False
 
 
 async def _get_dark_voice_channel(ctx: commands.Context) -> Optional[discord.VoiceChannel]:
@@ -68,289 +1527,986 @@ async def _get_dark_voice_channel(ctx: commands.Context) -> Optional[discord.Voi
     if ctx.guild is None:
         return None
     # Try by stored ID first
-    vc_id = guild_id_to_voice_channel_id.get(ctx.guild.id)
+    vc_id = _session(ctx.guild.id).voice_channel_id
     if vc_id:
         ch = ctx.guild.get_channel(vc_id)
         if isinstance(ch, discord.VoiceChannel):
             return ch
-    # Fallback: exact name, then prefix (handles renamed countdown)
-    for channel in ctx.guild.voice_channels:
-        if channel.name == DARK_VOICE_CHANNEL_NAME or channel.name.startswith(DARK_VOICE_CHANNEL_NAME):
-            return channel
+    # Fallback: indexed channel by exact name, then prefix (handles renamed countdown)
+    return _dark_channels(ctx.guild).dark_voice
+
+
+def _target_voice_id(guild: discord.Guild, session: GuildSession) -> int:
+    """ID of the voice channel the guild's cycle enforces (0 if there is none)."""
+    if not session.voice_channel_id:
+        channel = _dark_channels(guild).dark_voice
+        if channel is not None:
+            session.voice_channel_id = channel.id
+    return session.voice_channel_id
+
+
+def _get_dark_text_channel(guild: discord.Guild) -> Optional[discord.TextChannel]:
+    return _dark_channels(guild).dark_chat
+
+
+dark_chat_create_total = metrics.counter(
+    "darkbot_dark_chat_create_total",
+    "Attempts to create a missing dark-chat (created, failed) and attempts skipped by the negative cache.",
+    ("result",))
+
+
+async def _get_or_create_dark_text_channel(guild: discord.Guild) -> Optional[discord.TextChannel]:
+    session = _dark_channels(guild)
+    channel = session.dark_chat
+    if channel is not None:
+        return channel
+    if session.dark_chat_retry_at > clock.now():
+        # Creation failed recently and nothing relevant changed since: don't spend another request on it
+        dark_chat_create_total.inc("skipped")
+        return session.dark_chat_fallback
+    if session.dark_chat_creating is not None:
+        return await asyncio.shield(session.dark_chat_creating)
+    creating = session.dark_chat_creating = asyncio.ensure_future(_create_dark_text_channel(guild, session))
+
+    def created(_: asyncio.Future) -> None:
+        # Cleared when the request finishes, not when the first caller does: one that is cancelled
+        # must not let a second create start while this one is in flight
+        if session.dark_chat_creating is creating:
+            session.dark_chat_creating = None
+
+    creating.add_done_callback(created)
+    return await asyncio.shield(creating)
+
+
+async def _create_dark_text_channel(guild: discord.Guild, session: GuildSession) -> Optional[discord.TextChannel]:
+    # Try to create the channel if missing
+    try:
+        channel = await guild.create_text_channel(DARK_CHAT_CHANNEL_NAME, reason="Create dark-chat for bot messages")
+        # Index right away instead of waiting for the channel-create event
+        session.dark_chat = channel
+        session.dark_chat_retry_at = 0.0
+        session.dark_chat_fallback = None
+        dark_chat_create_total.inc("created")
+        return channel
+    except Exception as e:
+        # Fallback: the channel the cycle was started from, else the system channel; remember both
+        # for DARK_CHAT_RETRY_SECONDS
+        _swallowed("dark_chat.create", e)
+        dark_chat_create_total.inc("failed")
+        session.dark_chat_retry_at = clock.now() + DARK_CHAT_RETRY_SECONDS
+        announce = guild.get_channel(session.announce_channel_id) if session.announce_channel_id else None
+        session.dark_chat_fallback = announce if isinstance(announce, discord.TextChannel) else guild.system_channel
+        return session.dark_chat_fallback
+
+
+def _retry_dark_chat(guild: discord.Guild) -> None:
+    """Something that decides whether dark-chat can be created (or where to fall back) changed."""
+    session = sessions.get(guild.id)
+    if session is not None and session.dark_chat_retry_at:
+        session.dark_chat_retry_at = 0.0
+        session.dark_chat_fallback = None
+
+
+dark_chat_messages_total = metrics.counter(
+    "darkbot_dark_chat_messages_total",
+    "Dark-chat announcements: sent (requests), merged into another send, superseded by a newer status line.",
+    ("result",))
+
+
+class DarkChatOutbox:
+    """
+    Per-guild queue of dark-chat announcements.
+    The first message goes out at once; messages queued while a send is in flight or waiting on the
+    channel's pacing are joined into one message of up to MESSAGE_MAX_LENGTH characters. A keyed
+    message (a status line) replaces the queued one with the same key. The channel is resolved
+    (and created if missing) once per send, not once per message.
+    """
+
+    def __init__(self, guild: discord.Guild):
+        self.guild = guild
+        # Queued messages, oldest first: (key or None, content)
+        self._queue: List[Tuple[Optional[str], str]] = []
+        self._bucket = TokenBucket(DARK_CHAT_BUCKET_CAPACITY, DARK_CHAT_BUCKET_REFILL_PER_SECOND)
+        self._worker: Optional[asyncio.Task] = None
+        # Counters: requests sent, messages that rode along in another send, status lines replaced
+        self.sent = 0
+        self.merged = 0
+        self.superseded = 0
+
+    def post(self, content: str, key: Optional[str] = None) -> None:
+        if key is not None:
+            for i, (queued_key, _) in enumerate(self._queue):
+                if queued_key == key:
+                    del self._queue[i]
+                    self.superseded += 1
+                    dark_chat_messages_total.inc("superseded")
+                    break
+        self._queue.append((key, content))
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.get_running_loop().create_task(self._drain())
+
+    def _take_batch(self) -> str:
+        """Pop the longest run of queued messages that fits in one message."""
+        parts = [self._queue.pop(0)[1]]
+        length = len(parts[0])
+        while self._queue and length + 1 + len(self._queue[0][1]) <= MESSAGE_MAX_LENGTH:
+            content = self._queue.pop(0)[1]
+            parts.append(content)
+            length += 1 + len(content)
+        merged = len(parts) - 1
+        if merged:
+            self.merged += merged
+            dark_chat_messages_total.inc("merged", amount=merged)
+        return "\n".join(parts)
+
+    @_api_calls("announce")
+    async def _drain(self) -> None:
+        while self._queue:
+            await self._bucket.take()
+            if not self._queue:
+                self._bucket.refund()
+                break
+            content = self._take_batch()
+            channel = await _get_or_create_dark_text_channel(self.guild)
+            if channel is None:
+                continue
+            try:
+                await channel.send(content)
+            except Exception as e:
+                _swallowed("dark_chat.send", e)
+            else:
+                self.sent += 1
+                dark_chat_messages_total.inc("sent")
+
+
+async def _send_in_dark_chat(guild: Optional[discord.Guild], message: str, key: Optional[str] = None) -> None:
+    """
+    Queue an announcement for the guild's dark-chat; it is sent (possibly merged with others) shortly.
+    Messages with the same `key` are status lines: a newer one replaces the one still waiting.
+    """
+    if guild is None:
+        return
+    session = _session(guild.id)
+    if session.outbox is None:
+        session.outbox = DarkChatOutbox(guild)
+    session.outbox.post(message, key)
+
+
+async def _update_channel_name(guild: discord.Guild, phase: str, minutes: int, seconds: int = 0, phase_number: int = 0, total_minutes: int = 0) -> None:
+    """Deprecated: We no longer rename the voice channel; kept for compatibility."""
+    return
+
+
+# Every countdown format the bot has posted, e.g. "[B #0: 02]", "[S #1: 49/50]", "[S #1: 50/50 <t:1700000000:R>]",
+# "[S #1: 50 min <t:1700000000:R>]"
+COUNTDOWN_PATTERN = re.compile(r"^\[[SB] #\d+: \d{2}(?:/\d{2}| min)?(?: <t:\d+:R>)?\]$")
+
+
+def _countdown_content(label: str, phase_number: int, remaining_minutes: Optional[int], total_minutes: int = 0,
+                       ends_at: int = 0) -> str:
+    """The status line; without `remaining_minutes` it shows only the segment's length (and end, if given)."""
+    ends = f" <t:{ends_at}:R>" if ends_at else ""
+    if remaining_minutes is None:
+        return f"[{label} #{phase_number}: {total_minutes:02d} min{ends}]"
+    if total_minutes > 0:
+        return f"[{label} #{phase_number}: {remaining_minutes:02d}/{total_minutes:02d}{ends}]"
+    return f"[{label} #{phase_number}: {remaining_minutes:02d}{ends}]"
+
+
+def _status_content(status: "_StatusMessage", remaining_minutes: int, posting: bool = False) -> Optional[str]:
+    """
+    What the status message should show with `remaining_minutes` left, per STATUS_MODE.
+    None means leave the message as it is (no request).
+    """
+    label = 'S' if status.label.lower().startswith('s') else 'B'
+    if STATUS_MODE not in ("timestamp", "hybrid"):
+        return _countdown_content(label, status.phase_number, remaining_minutes, status.minutes)
+    if STATUS_MODE == "timestamp":
+        # Never edited, so a minutes-left figure would be stale at once: the client counts down <t:END:R>
+        return _countdown_content(label, status.phase_number, None, status.minutes, ends_at=status.ends_wall) if posting else None
+    if posting or remaining_minutes in STATUS_MILESTONES:
+        return _countdown_content(label, status.phase_number, remaining_minutes, status.minutes, ends_at=status.ends_wall)
     return None
 
 
-def _get_dark_text_channel(guild: discord.Guild) -> Optional[discord.TextChannel]:
-    for channel in guild.text_channels:
-        if channel.name == DARK_CHAT_CHANNEL_NAME:
-            return channel
-    return None
+class _StatusMessage:
+    """
+    One segment's status message in dark-chat and what it counts down.
+    Every segment gets its own, so the finished segment's last edit never lands on the next one's message.
+    """
+
+    __slots__ = ("label", "phase_number", "minutes", "ends_wall", "channel", "message", "rendered", "lock")
+
+    def __init__(self, label: str, phase_number: int, minutes: int, ends_wall: int,
+                 message: Optional[discord.PartialMessage] = None):
+        self.label = label
+        self.phase_number = phase_number
+        self.minutes = minutes
+        # Epoch second the segment ends, shown as <t:END:R> in timestamp/hybrid status messages
+        self.ends_wall = ends_wall
+        self.channel: Optional[discord.TextChannel] = message.channel if message is not None else None
+        self.message: Optional[discord.Message] = message
+        # Content the message currently shows; edits are serialized so a slow one never lands last
+        self.rendered: Optional[str] = None
+        self.lock = asyncio.Lock()
+
+
+class _Cycle:
+    """
+    Scheduling state of one guild's running study/break cycle.
+    The cycle owns at most one pending scheduler handle at a time, so stopping it is O(1).
+    """
+
+    __slots__ = (
+        "guild", "study_minutes", "break_minutes", "channel",
+        "phase", "label", "phase_number", "minutes", "started_at", "step",
+        "status", "handle", "preconnect_handle", "alert_task",
+    )
+
+    def __init__(self, guild: discord.Guild, study_minutes: int, break_minutes: int):
+        self.guild = guild
+        self.study_minutes = study_minutes
+        self.break_minutes = break_minutes
+        self.channel: Optional[discord.VoiceChannel] = None
+        # Current segment: phase is "study"/"break", label is "Study", "Break" or "Break+"
+        self.phase = "study"
+        self.label = "Study"
+        self.phase_number = 0
+        self.minutes = 0
+        self.started_at = 0.0
+        self.step = 0
+        # The current segment's status message
+        self.status: Optional[_StatusMessage] = None
+        self.handle: Optional[TimerHandle] = None
+        # Warms the voice connection ahead of the segment's one-minute alert
+        self.preconnect_handle: Optional[TimerHandle] = None
+        # The one-minute alert while it plays; stopping the cycle cancels it
+        self.alert_task: Optional[asyncio.Task] = None
+
+
+
+def _beside_actor(coro: Coroutine[Any, Any, Any]) -> None:
+    """
+    Run REST-bound work in its own task, like the one-minute alert, so the guild's actor only
+    changes state and never waits on requests. A segment's _StatusMessage keeps its status requests in order.
+    """
+    asyncio.get_running_loop().create_task(coro)
+
+
+@_api_calls("countdown")
+async def _start_countdown(cycle: _Cycle, status: _StatusMessage, started_at: Optional[float] = None) -> None:
+    """
+    Always start a NEW status message in dark-chat for each phase.
+    For a fresh segment, `started_at` is its start: the time until the post is its phase transition time.
+    """
+    guild = cycle.guild
+    text_channel = await _get_or_create_dark_text_channel(guild)
+    status.channel = text_channel
+    if text_channel is None:
+        return
+    # Edits queued meanwhile wait for the post
+    async with status.lock:
+        if not _cycle_is_current(cycle) or cycle.status is not status:
+            return
+        try:
+            content = _status_content(status, status.minutes - cycle.step, posting=True)
+            status.message = await text_channel.send(content)
+            status.rendered = content
+            _remember_countdown_message(status.message)
+            if not _cycle_is_current(cycle):
+                # !stop ran while the post was in flight and could not delete it
+                _forget_countdown_message(guild.id, status.message.id)
+                await _delete_message_ids(text_channel, [status.message.id])
+                return
+            if cycle.status is status:
+                _session(guild.id).status_message_id = status.message.id
+                _persist_cycle(cycle)
+        except Exception as e:
+            _swallowed("countdown.start", e)
+            return
+    if started_at is not None:
+        phase_transition_seconds.observe(scheduler.time() - started_at, "study" if status.label == "Study" else "break")
+
+
+@_api_calls("countdown")
+async def _edit_countdown(cycle: _Cycle, status: _StatusMessage, remaining_minutes: int) -> None:
+    """
+    Edit a segment's status message to show the minutes left.
+    Nothing is sent when the rendered text is unchanged; edits run one at a time, in order.
+    """
+    if status.message is None or status.channel is None:
+        return
+    content = _status_content(status, remaining_minutes)
+    if content is None or content == status.rendered:
+        return
+    if not api_budget.allows_countdown(cycle.guild.id, remaining_minutes):
+        # Under rate-limit pressure: skip this minute; a later edit shows the current value
+        api_shed_total.inc("countdown")
+        return
+    async with status.lock:
+        # Nothing is edited (or recreated) for a cycle that was stopped while this waited
+        if content == status.rendered or status.message is None or not _cycle_is_current(cycle):
+            return
+        try:
+            await status.message.edit(content=content)
+            status.rendered = content
+        except Exception:
+            # If edit fails, try to recreate a new status message and continue
+            failed_edits_total.inc("countdown")
+            try:
+                status.message = await status.channel.send(content)
+                status.rendered = content
+                _remember_countdown_message(status.message)
+                if not _cycle_is_current(cycle):
+                    # !stop ran while the send was in flight: nothing is left to resume or to show
+                    _forget_countdown_message(cycle.guild.id, status.message.id)
+                    await _delete_message_ids(status.channel, [status.message.id])
+                    return
+                if cycle.status is status:
+                    _session(cycle.guild.id).status_message_id = status.message.id
+                    _persist_cycle(cycle)
+            except Exception as e:
+                _swallowed("countdown.recreate", e)
+
+
+@_api_calls("countdown")
+async def _finish_countdown(cycle: _Cycle, status: _StatusMessage) -> None:
+    """Final update to 0, leaving the message as the finished segment's last status."""
+    try:
+        await _edit_countdown(cycle, status, 0)
+    finally:
+        # Best-effort cleanup of older countdown messages like "[B #0: 00/02]"; this one and newer stay
+        keep_from = status.message.id if status.message is not None else 0
+        try:
+            await _cleanup_countdown_messages_in_dark_chat(cycle.guild, keep_from=keep_from)
+        except Exception as e:
+            _swallowed("countdown.cleanup", e)
+
+
+async def _mute_all_in_channel(channel: discord.VoiceChannel, mute: bool) -> None:
+    """
+    Apply server mute to ALL members currently connected in the voice channel.
+    Edits are queued on the guild's MuteDispatcher rather than sent all at once.
+    Requires the bot to have the Mute Members permission in the guild/channel.
+    """
+    if not channel.members:
+        return
+    for member in channel.members:
+        # Do not server-mute the bot itself, otherwise it cannot play alert audio
+        if member.bot or (bot.user and member.id == bot.user.id):
+            continue
+        # Only attempt if the member is in a voice state in this channel
+        if member.voice is None or member.voice.channel != channel:
+            continue
+        # Redundant edits are dropped by the dispatcher; failures are counted there
+        _queue_mute(member, mute, "Learning cycle server mute")
+
+
+def _cycle_is_current(cycle: _Cycle) -> bool:
+    session = sessions.get(cycle.guild.id)
+    return session is not None and session.cycle is cycle
+
+
+def _schedule_cycle(cycle: _Cycle, when: float, step: Callable[..., Any], *args: Any) -> None:
+    """Arm the cycle's single timer; when it fires, the step is queued on the guild's actor."""
+    cycle.handle = scheduler.call_at(when, _actor(cycle.guild.id).send, "timer", step, cycle, *args)
+
+
+def _start_cycle(guild: discord.Guild, study_minutes: int, break_minutes: int) -> _Cycle:
+    """
+    Register a cycle for the guild: enforce mute during study, then unmute during break,
+    repeating until !stop. Every step after this runs from the shared scheduler.
+    """
+    cycle = _Cycle(guild, study_minutes, break_minutes)
+    _session(guild.id).cycle = cycle
+    _schedule_cycle(cycle, scheduler.time(), _begin_study)
+    return cycle
+
+
+def _cancel_cycle(guild_id: int) -> Optional[_Cycle]:
+    """Forget the guild's cycle and cancel its single pending timer (O(1))."""
+    session = sessions.get(guild_id)
+    cycle = session.cycle if session is not None else None
+    if cycle is not None:
+        session.cycle = None
+        # The debounce table only matters while a cycle mutes members
+        session.recent_edits = None
+        for handle in (cycle.handle, cycle.preconnect_handle):
+            if handle is not None:
+                handle.cancel()
+        cycle.handle = cycle.preconnect_handle = None
+        if cycle.alert_task is not None:
+            # An alert still connecting or playing would otherwise reconnect after !stop's disconnect
+            cycle.alert_task.cancel()
+            cycle.alert_task = None
+    return cycle
+
+
+def _persist_cycle(cycle: _Cycle) -> None:
+    """Queue a snapshot of the cycle for the session store (coalesced per guild)."""
+    guild_id = cycle.guild.id
+    session = _session(guild_id)
+    status_msg = cycle.status.message if cycle.status is not None else None
+    session_store.save(StoredSession(
+        guild_id=guild_id,
+        study_minutes=cycle.study_minutes,
+        break_minutes=cycle.break_minutes,
+        phase=cycle.phase,
+        label=cycle.label,
+        phase_number=cycle.phase_number,
+        segment_minutes=cycle.minutes,
+        started_wall=clock.wall() - (scheduler.time() - cycle.started_at),
+        study_count=session.study_count,
+        pending_extension=session.pending_break_extension,
+        status_channel_id=status_msg.channel.id if status_msg is not None else 0,
+        status_message_id=status_msg.id if status_msg is not None else 0,
+        voice_channel_id=cycle.channel.id if cycle.channel is not None else 0,
+        announce_channel_id=session.announce_channel_id,
+    ))
+
+
+def _fast_forward(stored: StoredSession, now_wall: float) -> Tuple[StoredSession, bool]:
+    """
+    Replay the segments that ended while the bot was down, following the same rules as _end_segment.
+    Whole study+break periods are skipped arithmetically, so however old the session is this takes
+    a handful of steps. Returns the segment running at now_wall and whether it differs from the stored one.
+    """
+    advanced = False
+    skipped = False
+    while True:
+        ended_at = stored.started_wall + stored.segment_minutes * SECONDS_PER_MINUTE
+        if ended_at > now_wall:
+            break
+        advanced = True
+        if stored.phase == "study" and stored.pending_extension == 0 and not skipped:
+            # From a study start with no extension queued, the cycle repeats with a fixed period
+            skipped = True
+            gap = stored.break_minutes * SECONDS_PER_MINUTE if stored.break_minutes > 0 else 1
+            period = stored.study_minutes * SECONDS_PER_MINUTE + gap
+            periods = int((now_wall - stored.started_wall) // period)
+            if periods > 0:
+                count = stored.study_count + periods
+                stored = stored._replace(phase_number=count + 1, segment_minutes=stored.study_minutes,
+                                         started_wall=stored.started_wall + periods * period, study_count=count)
+                continue
+        if stored.phase == "study":
+            count = stored.study_count + 1
+            if stored.break_minutes > 0:
+                stored = stored._replace(phase="break", label="Break", phase_number=0,
+                                         segment_minutes=stored.break_minutes, started_wall=ended_at, study_count=count)
+            else:
+                stored = stored._replace(phase_number=count + 1, started_wall=ended_at + 1, study_count=count)
+        elif stored.label == "Break" and stored.pending_extension > 0:
+            stored = stored._replace(label="Break+", segment_minutes=stored.pending_extension,
+                                     started_wall=ended_at, pending_extension=0)
+        else:
+            stored = stored._replace(phase="study", label="Study", phase_number=stored.study_count + 1,
+                                     segment_minutes=stored.study_minutes, started_wall=ended_at)
+    if advanced:
+        stored = stored._replace(status_channel_id=0, status_message_id=0)
+    return stored, advanced
+
+
+async def _resume_sessions() -> int:
+    """
+    Restart every stored cycle from its absolute deadline instead of from scratch. Returns count resumed.
+    Each cycle is registered here and its segment begins on the guild's actor, so on_ready is not held
+    up by the guilds' mutes and status messages.
+    """
+    try:
+        # Cluster workers share the store; each one only resumes the guilds on its own shards
+        stored_sessions = await asyncio.to_thread(session_store.load_all, SHARD_IDS, SHARD_COUNT)
+    except sqlite3.Error as e:
+        _log(logging.ERROR, "store.load_failed", error=e)
+        return 0
+    now_wall = clock.wall()
+    resumed = 0
+    for stored in stored_sessions:
+        guild = bot.get_guild(stored.guild_id)
+        if guild is None or _is_cycle_running(guild.id):
+            continue
+        stored, _ = _fast_forward(stored, now_wall)
+        cycle = _Cycle(guild, stored.study_minutes, stored.break_minutes)
+        session = _session(guild.id)
+        session.cycle = cycle
+        session.study_count = stored.study_count
+        session.pending_break_extension = stored.pending_extension
+        session.announce_channel_id = stored.announce_channel_id
+        channel = guild.get_channel(stored.voice_channel_id)
+        if not isinstance(channel, discord.VoiceChannel):
+            channel = _dark_channels(guild).dark_voice
+        if channel is not None:
+            session.voice_channel_id = channel.id
+        cycle.channel = channel
+        status_msg = None
+        status_channel = guild.get_channel(stored.status_channel_id)
+        if stored.status_message_id and isinstance(status_channel, discord.TextChannel):
+            # Same segment as before the restart: keep editing its status message
+            status_msg = status_channel.get_partial_message(stored.status_message_id)
+        started_at = scheduler.time() - (now_wall - stored.started_wall)
+        _schedule_cycle(cycle, scheduler.time(), _resume_segment, stored, started_at, status_msg)
+        resumed += 1
+    if resumed:
+        _log(logging.INFO, "store.resumed", cycles=resumed)
+    return resumed
+
+
+async def _resume_segment(
+    cycle: _Cycle, stored: StoredSession, started_at: float, status_msg: Optional[discord.PartialMessage]
+) -> None:
+    if not _cycle_is_current(cycle):
+        return
+    # Steps are counted when the resume runs, not when it was queued
+    step = max(0, int((scheduler.time() - started_at) // SECONDS_PER_MINUTE))
+    await _begin_segment(
+        cycle, stored.phase, stored.segment_minutes, stored.label, stored.phase_number,
+        started_at=started_at, step=min(step, stored.segment_minutes), status_msg=status_msg,
+    )
+
+
+async def _begin_study(cycle: _Cycle, started_at: Optional[float] = None) -> None:
+    if not _cycle_is_current(cycle):
+        return
+    guild = cycle.guild
+    channel = _dark_channels(guild).dark_voice
+    if channel is None:
+        # If channel is missing, retry a bit later; do not end the cycle
+        _schedule_cycle(cycle, scheduler.time() + 15, _begin_study)
+        return
+    cycle.channel = channel
+    _session(guild.id).voice_channel_id = channel.id
+    study_phase_number = _session(guild.id).study_count + 1
+    await _begin_segment(cycle, "study", cycle.study_minutes, "Study", study_phase_number, started_at=started_at)
+
+
+async def _begin_segment(
+    cycle: _Cycle,
+    phase: str,
+    minutes: int,
+    label: str,
+    phase_number: int,
+    started_at: Optional[float] = None,
+    step: int = 0,
+    status_msg: Optional[discord.PartialMessage] = None,
+) -> None:
+    """
+    Switch the guild to a new phase segment and schedule its next minute step.
+    A segment that follows another starts at that segment's end deadline, not whenever the
+    announcements in between finished, so phase boundaries never drift.
+    A resumed segment passes its original start time, the steps already elapsed and its status message.
+    """
+    session = _session(cycle.guild.id)
+    session.phase = phase
+    # A new phase re-applies to everyone, including members held unmuted by !unmute
+    session.unmute_hold = None
+    cycle.phase = phase
+    cycle.label = label
+    cycle.phase_number = phase_number
+    cycle.minutes = minutes
+    cycle.started_at = scheduler.time() if started_at is None else started_at
+    cycle.step = step
+    ends_wall = round(clock.wall() + cycle.started_at + minutes * SECONDS_PER_MINUTE - scheduler.time())
+    cycle.status = status = _StatusMessage(label, phase_number, minutes, ends_wall, status_msg)
+    session.status_message_id = status_msg.id if status_msg is not None else 0
+    # Deadlines are absolute from the segment start, so slow edits or alerts never push them back
+    _schedule_cycle(cycle, cycle.started_at + (step + 1) * SECONDS_PER_MINUTE, _on_cycle_step)
+    alert_at = cycle.started_at + (minutes - 1) * SECONDS_PER_MINUTE
+    if minutes > 1 and step < minutes - 1 and cycle.channel is not None and os.path.isfile(ALERT_AUDIO_FULL_PATH):
+        cycle.preconnect_handle = scheduler.call_at(
+            max(cycle.started_at, alert_at - VOICE_PRECONNECT_SECONDS), voice_pool.preconnect, cycle.guild, cycle.channel
+        )
+    _persist_cycle(cycle)
+    if cycle.channel is not None:
+        await _mute_all_in_channel(cycle.channel, mute=(phase == "study"))
+    if status_msg is not None:
+        _beside_actor(_edit_countdown(cycle, status, minutes - step))
+    else:
+        _beside_actor(_start_countdown(cycle, status, cycle.started_at if step == 0 else None))
+
+
+async def _on_cycle_step(cycle: _Cycle) -> None:
+    """
+    Runs on every minute boundary of a segment: countdown edit, one-minute alert, or phase end.
+    Only state changes happen here; the countdown's requests run beside the actor.
+    """
+    if not _cycle_is_current(cycle):
+        return
+    # The step comes from the clock: if the loop stalled past several boundaries, catch up at once
+    cycle.step = min(cycle.minutes, max(cycle.step + 1, _elapsed_steps(cycle)))
+    remaining = cycle.minutes - cycle.step
+    if remaining > 0:
+        _schedule_cycle(cycle, cycle.started_at + (cycle.step + 1) * SECONDS_PER_MINUTE, _on_cycle_step)
+        if remaining == 1 and cycle.channel is not None:
+            # Playback takes seconds: run it beside the actor so the guild's mailbox keeps moving
+            cycle.alert_task = asyncio.get_running_loop().create_task(
+                _one_minute_alert(cycle.guild, cycle.channel, phase_name=cycle.phase,
+                                  deadline=cycle.started_at + cycle.step * SECONDS_PER_MINUTE)
+            )
+        _beside_actor(_edit_countdown(cycle, cycle.status, remaining))
+        return
+    # The next segment starts first so its mutes and status go out on time; the finished
+    # segment's final edit and cleanup follow
+    finished = cycle.status
+    _session(cycle.guild.id).status_message_id = 0
+    await _end_segment(cycle)
+    if finished is not None:
+        _beside_actor(_finish_countdown(cycle, finished))
+
+
+def _elapsed_steps(cycle: _Cycle) -> int:
+    """Whole minutes since the segment started (scheduler batches may fire a few ms early)."""
+    elapsed = scheduler.time() - cycle.started_at + TimerScheduler.BATCH_SLACK_SECONDS
+    return int(elapsed // SECONDS_PER_MINUTE)
+
+
+async def _end_segment(cycle: _Cycle) -> None:
+    guild = cycle.guild
+    # The next segment starts exactly where this one was due to end
+    ended_at = cycle.started_at + cycle.minutes * SECONDS_PER_MINUTE
+    if cycle.phase == "study":
+        # Study finished → increment counter and announce
+        try:
+            session = _session(guild.id)
+            session.study_count += 1
+            _persist_cycle(cycle)
+            count_num = session.study_count
+            await _send_in_dark_chat(
+                guild,
+                f"✅ Finished {cycle.study_minutes}m. cycle: {count_num}.",
+                key="finished",
+            )
+        except Exception as e:
+            _swallowed("cycle.announce", e)
+        if not _cycle_is_current(cycle):
+            return
+        # Break phase: unmute everyone. If break_minutes is 0, go back to study after a second
+        if cycle.break_minutes > 0:
+            await _begin_segment(cycle, "break", cycle.break_minutes, "Break", 0, started_at=ended_at)
+        else:
+            _schedule_cycle(cycle, ended_at + 1, _begin_study, ended_at + 1)
+        return
+    if cycle.label == "Break":
+        # After the scheduled break, apply a one-time extension if queued
+        session = _session(guild.id)
+        extra, session.pending_break_extension = session.pending_break_extension, 0
+        if extra and extra > 0:
+            await _begin_segment(cycle, "break", extra, "Break+", 0, started_at=ended_at)
+            return
+    await _begin_study(cycle, started_at=ended_at)
+
+
+# ---- Alert audio ----
+class PreencodedAudio(discord.AudioSource):
+    """
+    Plays a shared list of pre-encoded Opus frames.
+    Frames are handed to the voice client as-is: no ffmpeg subprocess and no per-play encoding.
+    """
 
+    def __init__(self, frames: List[bytes]):
+        self._frames = frames
+        self._index = 0
 
-async def _get_or_create_dark_text_channel(guild: discord.Guild) -> Optional[discord.TextChannel]:
-    channel = _get_dark_text_channel(guild)
-    if channel is not None:
-        return channel
-    # Try to create the channel if missing
-    try:
-        channel = await guild.create_text_channel(DARK_CHAT_CHANNEL_NAME, reason="Create dark-chat for bot messages")
-        return channel
-    except Exception:
-        # Fallback: try system channel if creation fails
-        return guild.system_channel
+    def read(self) -> bytes:
+        if self._index >= len(self._frames):
+            return b""
+        frame = self._frames[self._index]
+        self._index += 1
+        return frame
 
+    def is_opus(self) -> bool:
+        return True
 
-async def _send_in_dark_chat(guild: Optional[discord.Guild], message: str) -> None:
-    if guild is None:
-        return
-    channel = await _get_or_create_dark_text_channel(guild)
-    if channel is not None:
-        try:
-            await channel.send(message)
-        except Exception:
-            pass
 
+# Decoded, volume-adjusted and Opus-encoded alert frames shared by every guild (None = not loaded)
+alert_opus_frames: Optional[List[bytes]] = None
+_ALERT_CACHE_MAGIC = b"DBOPUS1\n"
 
-async def _update_channel_name(guild: discord.Guild, phase: str, minutes: int, seconds: int = 0, phase_number: int = 0, total_minutes: int = 0) -> None:
-    """Deprecated: We no longer rename the voice channel; kept for compatibility."""
-    return
 
+def _alert_cache_key(path: str) -> bytes:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}:{ALERT_VOLUME}\n".encode()
 
-async def _countdown_task(guild: discord.Guild, total_seconds: int, phase: str, phase_number: int, total_minutes: int = 0) -> None:
-    """Countdown timer that updates a single status message in dark-chat instead of renaming channel."""
+
+def _read_alert_cache(path: str, key: bytes) -> Optional[List[bytes]]:
     try:
-        remaining = total_seconds
-        label = 'S' if phase.lower().startswith('s') else 'B'
-        text_channel = await _get_or_create_dark_text_channel(guild)
-        if text_channel is None:
-            return
-        # Always start a NEW status message for each phase
-        content = f"[{label} #{phase_number}: {remaining // 60:02d}/{total_minutes:02d}]" if total_minutes > 0 else f"[{label} #{phase_number}: {remaining // 60:02d}]"
-        status_msg = await text_channel.send(content)
-        guild_id_to_status_message_id[guild.id] = status_msg.id
-        # Loop and edit every minute
-        while remaining > 0:
-            await asyncio.sleep(60)
-            remaining -= 60
-            guild_id_to_remaining_time[guild.id] = max(remaining, 0)
-            content = f"[{label} #{phase_number}: {max(remaining,0) // 60:02d}/{total_minutes:02d}]" if total_minutes > 0 else f"[{label} #{phase_number}: {max(remaining,0) // 60:02d}]"
-            try:
-                await status_msg.edit(content=content)
-            except Exception:
-                # If edit fails, try to recreate a new status message and continue
-                try:
-                    status_msg = await text_channel.send(content)
-                    guild_id_to_status_message_id[guild.id] = status_msg.id
-                except Exception:
-                    pass
-        # Final update to 0 and leave the message as the last status
-        final_content = f"[{label} #{phase_number}: 00/{total_minutes:02d}]" if total_minutes > 0 else f"[{label} #{phase_number}: 00]"
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    header = _ALERT_CACHE_MAGIC + key
+    if not data.startswith(header):
+        return None
+    frames: List[bytes] = []
+    view = memoryview(data)
+    offset = len(header)
+    while offset + 2 <= len(data):
+        (length,) = struct.unpack_from(">H", data, offset)
+        offset += 2
+        frames.append(bytes(view[offset:offset + length]))
+        offset += length
+    return frames
+
+
+def _write_alert_cache(path: str, key: bytes, frames: List[bytes]) -> None:
+    # Cluster workers may rebuild the cache at the same time; each writes its own temporary file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(_ALERT_CACHE_MAGIC + key)
+        for frame in frames:
+            f.write(struct.pack(">H", len(frame)))
+            f.write(frame)
+    os.replace(tmp_path, path)
+
+
+def _encode_alert_frames(path: str) -> List[bytes]:
+    """Decode the file with ffmpeg once, apply the volume and Opus-encode every 20ms frame."""
+    if not discord.opus.is_loaded():
+        discord.opus._load_default()
+    encoder = discord.opus.Encoder()
+    source = discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(path), volume=ALERT_VOLUME)
+    frames: List[bytes] = []
+    try:
+        while True:
+            pcm = source.read()
+            if not pcm:
+                break
+            if len(pcm) < encoder.FRAME_SIZE:
+                pcm += b"\x00" * (encoder.FRAME_SIZE - len(pcm))
+            frames.append(encoder.encode(pcm, encoder.SAMPLES_PER_FRAME))
+    finally:
+        source.cleanup()
+    return frames
+
+
+def _load_alert_frames() -> Optional[List[bytes]]:
+    """Load alert frames from the on-disk cache, or encode them and refresh the cache. Blocking."""
+    if not os.path.isfile(ALERT_AUDIO_FULL_PATH):
+        return None
+    key = _alert_cache_key(ALERT_AUDIO_FULL_PATH)
+    frames = _read_alert_cache(ALERT_CACHE_PATH, key)
+    if frames:
+        return frames
+    frames = _encode_alert_frames(ALERT_AUDIO_FULL_PATH)
+    if frames:
         try:
-            await status_msg.edit(content=final_content)
-        except Exception:
-            pass
-        finally:
-            # Always clear the stored message ID
-            guild_id_to_status_message_id.pop(guild.id, None)
-            guild_id_to_remaining_time[guild.id] = 0
-            # Best-effort cleanup of older countdown messages like "[B #0: 00/02]" (keep latest)
-            try:
-                await _cleanup_countdown_messages_in_dark_chat(guild)
-            except Exception:
-                pass
-    except asyncio.CancelledError:
-        pass
+            _write_alert_cache(ALERT_CACHE_PATH, key, frames)
+        except OSError as e:
+            _log(logging.WARNING, "alert.cache_write_failed", path=ALERT_CACHE_PATH, error=e)
+    return frames or None
 
 
-async def _mute_all_in_channel(channel: discord.VoiceChannel, mute: bool) -> None:
-    """
-    Apply server mute to ALL members currently connected in the voice channel.
-    Requires the bot to have the Mute Members permission in the guild/channel.
-    """
-    if not channel.members:
+async def _preload_alert_audio() -> None:
+    global alert_opus_frames
+    if alert_opus_frames is not None:
         return
-    tasks = []
-    for member in channel.members:
-        # Do not server-mute the bot itself, otherwise it cannot play alert audio
-        if member.bot or (bot.user and member.id == bot.user.id):
-            continue
-        # Only attempt if the member is in a voice state in this channel
-        if member.voice is None or member.voice.channel != channel:
-            continue
-        # Avoid redundant edits when possible
-        if member.voice.mute == mute:
-            continue
-        tasks.append(member.edit(mute=mute, reason="Learning cycle server mute"))
-    if tasks:
-        # Best-effort: ignore failures for individual members
-        results = await asyncio.gather(*tasks, return_exceptions=True)
-        # Optional: could log exceptions if needed
+    try:
+        alert_opus_frames = await asyncio.to_thread(_load_alert_frames)
+        if alert_opus_frames:
+            _log(logging.INFO, "alert.preloaded", frames=len(alert_opus_frames))
+    except Exception as e:
+        # Alerts fall back to decoding with ffmpeg on every play
+        _log(logging.WARNING, "alert.preload_failed", error=e)
 
 
-async def _cycle_task(guild: discord.Guild, study_minutes: int, break_minutes: int) -> None:
+def _alert_source() -> discord.AudioSource:
+    if alert_opus_frames:
+        return PreencodedAudio(alert_opus_frames)
+    # Wrap with volume control in case the file is quiet
+    return discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(ALERT_AUDIO_FULL_PATH), volume=ALERT_VOLUME)
+
+
+# ---- Voice connections ----
+class VoicePool:
     """
-    Background loop per guild: enforce mute (speak=False) during study, then unmute (speak=True)
-    during break, repeating until cancelled by !stop or task cancellation.
+    Keeps voice connections warm around one-minute alerts.
+    Connections are opened VOICE_PRECONNECT_SECONDS before an alert, kept idle for
+    VOICE_IDLE_TTL_SECONDS after it, and capped at MAX_VOICE_CONNECTIONS across guilds
+    (the least recently used idle connection is evicted first).
     """
-    try:
-        while True:
-            channel = discord.utils.get(guild.voice_channels, name=DARK_VOICE_CHANNEL_NAME)
-            if channel is None:
-                # If channel is missing, wait a bit and retry; do not crash the task
-                await asyncio.sleep(15)
-                continue
 
-            # Study phase: server mute everyone
-            guild_id_to_phase[guild.id] = "study"
-            await _mute_all_in_channel(channel, mute=True)
-            
-            # Start countdown timer for study phase
-            study_phase_number = guild_id_to_study_count.get(guild.id, 0) + 1
-            if guild_id_to_timer_task.get(guild.id):
-                guild_id_to_timer_task[guild.id].cancel()
-            guild_id_to_timer_task[guild.id] = bot.loop.create_task(
-                _countdown_task(guild, study_minutes * 60, "Study", study_phase_number, study_minutes)
-            )
-            
-            if study_minutes > 1:
-                await asyncio.sleep((study_minutes - 1) * 60)
-                await _one_minute_alert(guild, channel, phase_name="study")
-                await asyncio.sleep(60)
-            else:
-                await asyncio.sleep(study_minutes * 60)
+    def __init__(self) -> None:
+        # guild_id -> idle-since (loop time), least recently used first
+        self._idle: "OrderedDict[int, float]" = OrderedDict()
+        self._busy: set = set()
+        self._connecting: Dict[int, asyncio.Task] = {}
+        # How late each alert started relative to its deadline (seconds), most recent last
+        self.alert_delays: Deque[float] = deque(maxlen=1000)
 
-            # Study finished → increment counter and announce
-            try:
-                guild_id_to_study_count[guild.id] = guild_id_to_study_count.get(guild.id, 0) + 1
-                announce_channel = None
-                ch_id = guild_id_to_announce_channel_id.get(guild.id)
-                if ch_id:
-                    announce_channel = guild.get_channel(ch_id)
-                if announce_channel is None:
-                    announce_channel = _get_dark_text_channel(guild)
-                if announce_channel is not None:
-                    count_num = guild_id_to_study_count[guild.id]
-                    await _send_in_dark_chat(
-                        guild,
-                        f"✅ Finished {study_minutes}m. cycle: {count_num}."
-                    )
-            except Exception:
-                pass
-
-            # Break phase: unmute everyone
-            # If break_minutes is 0, skip quickly
-            if break_minutes > 0:
-                guild_id_to_phase[guild.id] = "break"
-                await _mute_all_in_channel(channel, mute=False)
-                
-                # Start countdown timer for break phase
-                if guild_id_to_timer_task.get(guild.id):
-                    guild_id_to_timer_task[guild.id].cancel()
-                guild_id_to_timer_task[guild.id] = bot.loop.create_task(
-                    _countdown_task(guild, break_minutes * 60, "Break", 0, break_minutes)
-                )
-                
-                if break_minutes > 1:
-                    await asyncio.sleep((break_minutes - 1) * 60)
-                    await _one_minute_alert(guild, channel, phase_name="break")
-                    await asyncio.sleep(60)
-                else:
-                    await asyncio.sleep(break_minutes * 60)
-
-                # After the scheduled break, apply a one-time extension if queued
-                extra = guild_id_to_pending_break_extension_minutes.pop(guild.id, 0)
-                if extra and extra > 0:
-                    # Start an additional break segment
-                    guild_id_to_phase[guild.id] = "break"
-                    await _mute_all_in_channel(channel, mute=False)
-                    if guild_id_to_timer_task.get(guild.id):
-                        guild_id_to_timer_task[guild.id].cancel()
-                    guild_id_to_timer_task[guild.id] = bot.loop.create_task(
-                        _countdown_task(guild, extra * 60, "Break+", 0, extra)
-                    )
-                    if extra > 1:
-                        await asyncio.sleep((extra - 1) * 60)
-                        await _one_minute_alert(guild, channel, phase_name="break")
-                        await asyncio.sleep(60)
-                    else:
-                        await asyncio.sleep(extra * 60)
-            else:
-                await asyncio.sleep(1)
-    except asyncio.CancelledError:
-        # On cancellation, try to leave the channel unmuted (server unmute)
+    def connection_count(self) -> int:
+        return len(bot.voice_clients)
+
+    def preconnect(self, guild: discord.Guild, channel: discord.VoiceChannel) -> None:
+        """Start connecting in the background so the alert finds a ready connection."""
+        if guild.id in self._connecting or self.is_connected_to(guild, channel):
+            return
+        if not self._make_room(guild.id):
+            _log(logging.WARNING, "voice.cap_reached", guild=guild.id, action="preconnect", cap=MAX_VOICE_CONNECTIONS)
+            return
+        task = asyncio.get_running_loop().create_task(self._connect(guild, channel))
+        self._connecting[guild.id] = task
+        task.add_done_callback(lambda _t, gid=guild.id: self._connecting.pop(gid, None))
+        # Pre-connected but unused connections expire like idle ones
+        self._mark_idle(guild.id)
+
+    async def acquire(self, guild: discord.Guild, channel: discord.VoiceChannel) -> Optional[discord.VoiceClient]:
+        """Return a voice client connected to the channel, reusing a warm one when possible."""
+        self._idle.pop(guild.id, None)
+        self._busy.add(guild.id)
+        pending = self._connecting.get(guild.id)
+        if pending is not None:
+            await asyncio.gather(pending, return_exceptions=True)
+        if not self.is_connected_to(guild, channel) and not self._make_room(guild.id):
+            _log(logging.WARNING, "voice.cap_reached", guild=guild.id, action="skip_alert", cap=MAX_VOICE_CONNECTIONS)
+            return None
+        return await self._connect(guild, channel)
+
+    def release(self, guild: discord.Guild) -> None:
+        """Playback finished: keep the connection warm until the idle TTL expires."""
+        self._busy.discard(guild.id)
+        if guild.voice_client is not None:
+            self._mark_idle(guild.id)
+
+    def forget(self, guild_id: int) -> None:
+        self._idle.pop(guild_id, None)
+        self._busy.discard(guild_id)
+        task = self._connecting.pop(guild_id, None)
+        if task is not None:
+            task.cancel()
+
+    def record_alert_delay(self, guild_id: int, delay: float) -> None:
+        self.alert_delays.append(delay)
+        alert_start_delay_seconds.observe(max(0.0, delay))
+        if LOG_HOT_PATHS:
+            _log(logging.DEBUG, "alert.started", guild=guild_id, delay_ms=round(delay * 1000))
+
+    def alert_delay_summary(self) -> Dict[str, float]:
+        delays = sorted(self.alert_delays)
+        if not delays:
+            return {"count": 0}
+        return {
+            "count": len(delays),
+            "p50": delays[len(delays) // 2],
+            "p99": delays[min(len(delays) - 1, int(len(delays) * 0.99))],
+            "max": delays[-1],
+        }
+
+    def is_connected_to(self, guild: discord.Guild, channel: discord.VoiceChannel) -> bool:
+        vc = guild.voice_client
+        return vc is not None and vc.is_connected() and vc.channel == channel
+
+    def _mark_idle(self, guild_id: int) -> None:
+        if guild_id in self._busy:
+            return
+        stamp = scheduler.time()
+        self._idle[guild_id] = stamp
+        self._idle.move_to_end(guild_id)
+        scheduler.call_at(stamp + VOICE_IDLE_TTL_SECONDS, self._expire, guild_id, stamp)
+
+    def _make_room(self, guild_id: int) -> bool:
+        """Evict least recently used idle connections until one more fits under the cap."""
+        connected = {vc.guild.id for vc in bot.voice_clients if isinstance(vc, discord.VoiceClient)}
+        if guild_id in connected:
+            return True
+        count = len(connected) + len(self._connecting)
+        while count >= MAX_VOICE_CONNECTIONS and self._idle:
+            victim_id, _ = self._idle.popitem(last=False)
+            if victim_id == guild_id:
+                continue
+            guild = bot.get_guild(victim_id)
+            if guild is not None and guild.voice_client is not None:
+                asyncio.get_running_loop().create_task(_disconnect_voice(guild))
+                count -= 1
+        return count < MAX_VOICE_CONNECTIONS
+
+    async def _connect(self, guild: discord.Guild, channel: discord.VoiceChannel) -> Optional[discord.VoiceClient]:
+        voice_client = guild.voice_client
         try:
-            channel = discord.utils.get(guild.voice_channels, name=DARK_VOICE_CHANNEL_NAME)
-            if channel is not None:
-                await _mute_all_in_channel(channel, mute=False)
-            guild_id_to_phase[guild.id] = None
-            # Reset study counter for this guild when the cycle stops
-            guild_id_to_study_count[guild.id] = 0
-        finally:
-            raise
+            if voice_client is None or not voice_client.is_connected():
+                if LOG_HOT_PATHS:
+                    _log(logging.DEBUG, "voice.connecting", guild=guild.id, channel=channel.id)
+                voice_client = await channel.connect(timeout=8.0, reconnect=False)
+            elif voice_client.channel != channel:
+                if LOG_HOT_PATHS:
+                    _log(logging.DEBUG, "voice.moving", guild=guild.id, channel=channel.id)
+                await voice_client.move_to(channel)
+        except discord.ClientException as e:
+            _log(logging.WARNING, "voice.connect_failed", guild=guild.id, error=e)
+            return None
+        except discord.Forbidden as e:
+            _log(logging.WARNING, "voice.forbidden", guild=guild.id, error=e)
+            return None
+        except asyncio.TimeoutError:
+            _log(logging.WARNING, "voice.connect_timeout", guild=guild.id)
+            return None
+        return voice_client
+
+    async def _expire(self, guild_id: int, stamp: float) -> None:
+        if self._idle.get(guild_id) != stamp:
+            # Used again (or evicted) since this expiry was scheduled
+            return
+        del self._idle[guild_id]
+        guild = bot.get_guild(guild_id)
+        if guild is not None:
+            await _disconnect_voice(guild)
+
 
+voice_pool = VoicePool()
 
-async def _one_minute_alert(guild: discord.Guild, channel: discord.VoiceChannel, phase_name: str) -> None:
+
+@_api_calls("alert")
+async def _one_minute_alert(guild: discord.Guild, channel: discord.VoiceChannel, phase_name: str, deadline: Optional[float] = None) -> None:
     """
     Attempt to signal that 1 minute remains in the current phase by:
     - Playing a short sound in the voice channel if ALERT_AUDIO_PATH exists and FFmpeg/voice is available
     - Sending a text message in the system channel as a fallback
+    `deadline` is the scheduler time the alert was due at; lateness is recorded on voice_pool.
     """
     # Try to play a short sound in the voice channel
     try:
         file_exists = os.path.isfile(ALERT_AUDIO_FULL_PATH)
-        print(f"[alert] file_exists={file_exists} path={ALERT_AUDIO_FULL_PATH}")
+        if LOG_HOT_PATHS:
+            _log(logging.DEBUG, "alert.begin", guild=guild.id, phase=phase_name, audio=file_exists)
         if file_exists:
-            voice_client = discord.utils.get(bot.voice_clients, guild=guild)
-            try:
-                if voice_client is None or not voice_client.is_connected():
-                    print("[alert] connecting to voice...")
-                    voice_client = await channel.connect(timeout=8.0, reconnect=False)
-                elif voice_client.channel != channel:
-                    print("[alert] moving voice client to target channel...")
-                    await voice_client.move_to(channel)
-            except discord.ClientException as e:
-                print(f"[alert] voice connect/move error: {e}")
-                return
-            except discord.Forbidden as e:
-                print(f"[alert] missing permission to connect/move: {e}")
-                return
-
-            # Ensure the bot member itself is not server-muted before playing
+            was_warm = voice_pool.is_connected_to(guild, channel)
             try:
-                me = guild.me
-                if me is not None and me.voice is not None and me.voice.mute:
-                    print("[alert] bot is server-muted; attempting to unmute self...")
-                    await me.edit(mute=False, reason="Enable alert playback")
-            except Exception as e:
-                print(f"[alert] failed to unmute bot user: {e}")
+                voice_client = await voice_pool.acquire(guild, channel)
+                if voice_client is None:
+                    return
 
-            if voice_client is not None and not voice_client.is_playing():
+                # Ensure the bot member itself is not server-muted before playing
                 try:
-                    # Wrap with volume control in case the file is quiet
-                    source = discord.PCMVolumeTransformer(
-                        discord.FFmpegPCMAudio(ALERT_AUDIO_FULL_PATH), volume=1.1
-                    )
-                    # Wait a brief moment before starting playback
-                    await asyncio.sleep(0.2)
-                    voice_client.play(source)
-                    print("[alert] playing alert audio...")
-                    # Wait briefly (up to 1 second) so a beep can be heard
-                    waited = 0.0
-                    while voice_client.is_playing() and waited < 1.0:
-                        await asyncio.sleep(0.1)
-                        waited += 0.1
-                    if not voice_client.is_playing():
-                        print("[alert] playback finished or did not start.")
-                    # Wait a brief moment after playback
-                    await asyncio.sleep(0.2)
+                    me = guild.me
+                    if me is not None and me.voice is not None and me.voice.mute:
+                        _log(logging.INFO, "alert.unmute_self", guild=guild.id)
+                        await _apply_mute(me, False, "Enable alert playback")
                 except Exception as e:
-                    print(f"[alert] playback error: {e}")
-                finally:
-                    # Disconnect after playback to free the voice connection
-                    await _disconnect_voice(guild)
+                    _log(logging.WARNING, "alert.unmute_self_failed", guild=guild.id, error=e)
+
+                if not voice_client.is_playing():
+                    try:
+                        source = _alert_source()
+                        if not was_warm:
+                            # Wait a brief moment before starting playback on a fresh connection
+                            await clock.sleep(0.2)
+                        voice_client.play(source)
+                        if deadline is not None:
+                            voice_pool.record_alert_delay(guild.id, scheduler.time() - deadline)
+                        # Wait briefly (up to 1 second) so a beep can be heard
+                        waited = 0.0
+                        while voice_client.is_playing() and waited < 1.0:
+                            await clock.sleep(0.1)
+                            waited += 0.1
+                        # Wait a brief moment after playback
+                        await clock.sleep(0.2)
+                    except Exception as e:
+                        _log(logging.WARNING, "alert.playback_failed", guild=guild.id, error=e)
+            finally:
+                # Every path out (errors and cancellation included) hands the guild back to the pool;
+                # the connection stays warm until the idle TTL expires
+                voice_pool.release(guild)
     except Exception as e:
         # Log and fall back
-        print(f"[alert] unexpected error: {e}")
+        _log(logging.ERROR, "alert.failed", guild=guild.id, error=repr(e))
 
     # # Text fallback/duplicate notice
     # try:
@@ -364,86 +2520,442 @@ async def _one_minute_alert(guild: discord.Guild, channel: discord.VoiceChannel,
 
 
 def _is_cycle_running(guild_id: int) -> bool:
-    task = guild_id_to_task.get(guild_id)
-    return task is not None and not task.done()
+    session = sessions.get(guild_id)
+    return session is not None and session.cycle is not None
 
 
 async def _disconnect_voice(guild: discord.Guild) -> None:
     """Disconnect the bot's voice client in this guild if connected."""
-    vc = discord.utils.get(bot.voice_clients, guild=guild)
+    voice_pool.forget(guild.id)
+    vc = guild.voice_client
     if vc is not None and vc.is_connected():
         try:
             await vc.disconnect(force=True)
-        except Exception:
-            pass
+        except Exception as e:
+            _swallowed("voice.disconnect", e)
 
 
-async def _purge_bot_messages_in_channel(channel: discord.TextChannel, batch_size: int = 1000, max_rounds: int = 10) -> int:
-    """Delete the bot's messages in the given channel. Returns number deleted.
-    Uses purge in batches; limited to recent messages Discord allows for bulk deletion.
+@_api_calls("cleanup")
+async def _delete_message_ids(channel: discord.abc.Messageable, message_ids: List[int]) -> int:
     """
-    total = 0
-    try:
-        for _ in range(max_rounds):
-            deleted = await channel.purge(limit=batch_size, check=lambda m: m.author == bot.user)
-            count = len(deleted)
-            total += count
-            if count == 0:
-                break
-    except discord.Forbidden:
-        pass
-    except Exception:
-        pass
-    return total
+    Delete messages by ID with as few requests as possible: bulk-delete in chunks of up to 100
+    for messages inside Discord's 14-day bulk window, single deletes for anything older.
+    Returns number deleted.
+    """
+    now = datetime.datetime.fromtimestamp(clock.wall(), datetime.timezone.utc)
+    cutoff = discord.utils.time_snowflake(now - BULK_DELETE_MAX_AGE)
+    recent = [mid for mid in message_ids if mid > cutoff]
+    old = [mid for mid in message_ids if mid <= cutoff]
+    deleted = 0
+    for i in range(0, len(recent), 100):
+        chunk = recent[i:i + 100]
+        try:
+            # One ID falls back to a single delete inside discord.py
+            await channel.delete_messages([discord.Object(id=mid) for mid in chunk])
+            deleted += len(chunk)
+        except discord.HTTPException:
+            # e.g. one of them is already gone: delete the chunk one by one instead
+            old.extend(chunk)
+    for mid in old:
+        try:
+            await channel.get_partial_message(mid).delete()
+            deleted += 1
+        except discord.HTTPException as e:
+            _swallowed("message.delete", e)
+    return deleted
+
+
+def _remember_countdown_message(message: discord.Message) -> None:
+    guild = message.guild
+    if guild is None:
+        return
+    session = _session(guild.id)
+    if session.countdown_messages is None:
+        session.countdown_messages = deque(maxlen=COUNTDOWN_REGISTRY_SIZE)
+    session.countdown_messages.append((message.channel.id, message.id))
+
+
+def _forget_countdown_message(guild_id: int, message_id: int) -> None:
+    session = sessions.get(guild_id)
+    registry = session.countdown_messages if session is not None else None
+    if registry:
+        for entry in list(registry):
+            if entry[1] == message_id:
+                registry.remove(entry)
+
 
+# Guilds with a countdown cleanup waiting for rate-limit pressure to ease
+_deferred_cleanups: Set[int] = set()
 
-async def _cleanup_countdown_messages_in_dark_chat(guild: discord.Guild, limit: int = 500) -> int:
-    """Delete older countdown-looking messages in dark-chat, keeping the most recent one.
+
+def _retry_cleanup(guild: discord.Guild, keep_from: int) -> None:
+    """Runs on the guild's actor; the deletes themselves go beside it."""
+    _deferred_cleanups.discard(guild.id)
+    if bot.get_guild(guild.id) is None:
+        # Left the guild while the cleanup was deferred
+        return
+    _beside_actor(_cleanup_countdown_messages_in_dark_chat(guild, keep_from=keep_from))
+
+
+@_api_calls("cleanup")
+async def _cleanup_countdown_messages_in_dark_chat(guild: discord.Guild, limit: int = 500, keep_from: int = 0) -> int:
+    """Delete older countdown messages the bot posted, keeping the most recent one
+    (and, with keep_from, every message from that ID on).
+    Uses the per-guild registry; dark-chat history is scanned only once after a restart.
+    Under rate-limit pressure the cleanup is retried after CLEANUP_DEFER_SECONDS instead.
     Returns number deleted.
     """
+    if not api_budget.allows_cleanup(guild.id):
+        if guild.id not in _deferred_cleanups:
+            _deferred_cleanups.add(guild.id)
+            api_shed_total.inc("cleanup")
+            scheduler.call_later(CLEANUP_DEFER_SECONDS, _actor(guild.id).send, "timer", _retry_cleanup, guild, keep_from)
+        return 0
     text_channel = await _get_or_create_dark_text_channel(guild)
     if text_channel is None:
         return 0
-    countdown_pattern = re.compile(r"^\[[SB] #\d+: \d{2}(?:/\d{2})?\]$")
+    session = _session(guild.id)
+    if session.countdown_messages is None:
+        session.countdown_messages = deque(maxlen=COUNTDOWN_REGISTRY_SIZE)
+    registry = session.countdown_messages
     try:
-        # Fetch recent messages to find countdowns
-        countdown_messages = []
-        async for m in text_channel.history(limit=limit):
-            if m.author == bot.user and isinstance(m.content, str) and countdown_pattern.match(m.content):
-                countdown_messages.append(m)
-        # Keep the latest one, delete the rest
-        to_delete = countdown_messages[1:] if len(countdown_messages) > 1 else []
+        if not session.countdown_history_scanned:
+            # Countdowns posted before a restart are not in the registry: find them once
+            session.countdown_history_scanned = True
+            known = set(registry)
+            async for m in text_channel.history(limit=limit):
+                if m.author == bot.user and isinstance(m.content, str) and COUNTDOWN_PATTERN.match(m.content):
+                    known.add((text_channel.id, m.id))
+            registry.clear()
+            # Snowflakes grow over time, so sorting by ID orders oldest first
+            registry.extend(sorted(known, key=lambda entry: entry[1]))
+        if len(registry) <= 1:
+            return 0
+        # Keep the latest one (and anything from keep_from on), delete the rest
+        newest = max(entry[1] for entry in registry)
+        keep_from = min(keep_from or newest, newest)
+        by_channel: Dict[int, List[int]] = {}
+        kept = []
+        for channel_id, message_id in registry:
+            if message_id >= keep_from:
+                kept.append((channel_id, message_id))
+            else:
+                by_channel.setdefault(channel_id, []).append(message_id)
+        registry.clear()
+        registry.extend(kept)
         count = 0
-        for m in to_delete:
-            try:
-                await m.delete()
-                count += 1
-            except Exception:
-                pass
+        for channel_id, message_ids in by_channel.items():
+            channel = text_channel if channel_id == text_channel.id else guild.get_channel(channel_id)
+            if isinstance(channel, discord.TextChannel):
+                count += await _delete_message_ids(channel, message_ids)
         return count
-    except Exception:
+    except Exception as e:
+        _swallowed("countdown.cleanup", e)
         return 0
 
 
-@bot.command(name="clear")
+
+# ---- Purge engine ----
+class PurgeJob:
+    """
+    One !clear or !clearcommands run: scans the guild's text channels concurrently
+    (at most PURGE_CONCURRENCY at a time) and deletes matching messages in bulk where Discord allows it.
+    Progress and the final count are reported in dark-chat; the job can be cancelled.
+    """
+
+    def __init__(self, guild: Optional[discord.Guild], check: Callable[[discord.Message], bool], label: str,
+                 limit: int = PURGE_MESSAGES_PER_CHANNEL):
+        self.guild = guild
+        self.check = check
+        self.label = label
+        # Most recent messages scanned per channel
+        self.limit = limit
+        self.scanned = 0
+        self.deleted = 0
+        self.channels_total = 0
+        self.channels_done = 0
+        self.task: Optional[asyncio.Task] = None
+        self._progress_msg: Optional[discord.Message] = None
+
+    async def run(self, channels: List[discord.TextChannel], report: bool = True) -> int:
+        self.channels_total = len(channels)
+        semaphore = asyncio.Semaphore(PURGE_CONCURRENCY)
+        work: Optional[asyncio.Future] = None
+        try:
+            if report:
+                # Posted before any scan starts, so every scan already knows to keep the progress message
+                await self._report(f"🧹 {self.label}: started on {self.channels_total} channels.")
+            work = asyncio.ensure_future(asyncio.gather(*(self._purge_channel(ch, semaphore) for ch in channels)))
+            while True:
+                done, _ = await asyncio.wait({work}, timeout=PURGE_PROGRESS_INTERVAL_SECONDS)
+                if done:
+                    break
+                if report:
+                    await self._report(
+                        f"🧹 {self.label}: {self.deleted} deleted, "
+                        f"{self.channels_done}/{self.channels_total} channels done."
+                    )
+        except asyncio.CancelledError:
+            if work is not None:
+                work.cancel()
+                await asyncio.gather(work, return_exceptions=True)
+            if report:
+                await self._report(f"⏹️ {self.label}: cancelled after {self.deleted} deleted.")
+            raise
+        if report:
+            await self._report(f"🧹 {self.label}: done, {self.deleted} deleted in {self.channels_total} channels.")
+        return self.deleted
+
+    @_api_calls("cleanup")
+    async def _purge_channel(self, channel: discord.TextChannel, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            batch: List[int] = []
+            try:
+                async for m in channel.history(limit=self.limit):
+                    self.scanned += 1
+                    if self._progress_msg is not None and m.id == self._progress_msg.id:
+                        continue
+                    if self.check(m):
+                        batch.append(m.id)
+                        if len(batch) >= 100:
+                            count = await _delete_message_ids(channel, batch)
+                            self.deleted += count
+                            batch = []
+                if batch:
+                    count = await _delete_message_ids(channel, batch)
+                    self.deleted += count
+            except discord.HTTPException as e:
+                # Missing access to this channel: skip it
+                _swallowed("purge.channel", e)
+            finally:
+                self.channels_done += 1
+
+    async def _report(self, content: str) -> None:
+        if self.guild is None:
+            return
+        try:
+            if self._progress_msg is None:
+                text_channel = await _get_or_create_dark_text_channel(self.guild)
+                if text_channel is not None:
+                    self._progress_msg = await text_channel.send(content)
+            else:
+                await self._progress_msg.edit(content=content)
+        except Exception as e:
+            failed_edits_total.inc("progress")
+            _swallowed("purge.report", e)
+
+
+
+async def _run_purge_job(ctx: commands.Context, check: Callable[[discord.Message], bool], label: str, action: Optional[str],
+                         limit: int = PURGE_MESSAGES_PER_CHANNEL) -> None:
+    """Start a purge job for the guild, or cancel the running one with `action == "cancel"`."""
+    guild = ctx.guild
+    if guild is None:
+        return
+    session = _session(guild.id)
+    running = session.purge_job
+    if action is not None and action.lower() == "cancel":
+        if running is not None and running.task is not None:
+            running.task.cancel()
+        else:
+            await _send_in_dark_chat(guild, "ℹ️ Nothing to cancel.")
+        return
+    if running is not None:
+        await _send_in_dark_chat(guild, f"A clear is already running. Use {COMMAND_SIGIL}clear cancel to stop it.")
+        return
+    job = PurgeJob(guild, check, label, limit)
+    job.task = asyncio.current_task()
+    session.purge_job = job
+    try:
+        await job.run(list(guild.text_channels))
+    except asyncio.CancelledError:
+        pass
+    finally:
+        session.purge_job = None
+
+
+@bot.hybrid_command(name="clear")
+@app_commands.describe(action="\"cancel\" stops a running clear")
 @commands.guild_only()
-async def clear_bot_messages(ctx: commands.Context):
-    """Delete previous messages sent by this bot across all text channels in the server."""
+async def clear_bot_messages(ctx: commands.Context, action: Optional[str] = None):
+    """Delete previous messages sent by this bot across all text channels in the server.
+    Usage: !clear (or !clear cancel to stop a running clear)
+    """
     if ctx.guild is None:
         return
-    deleted_total = 0
-    for ch in ctx.guild.text_channels:
-        deleted_total += await _purge_bot_messages_in_channel(ch)
+    await _run_purge_job(ctx, lambda m: m.author == bot.user, "Clearing bot messages", action)
+
+
+# ---- Slash commands ----
+# Every command is a hybrid command: "/learn 50 10" and "!learn 50 10" run the same callback.
+# Replies still go to dark-chat; an interaction only gets a short private acknowledgement.
+command_sync_total = metrics.counter(
+    "darkbot_command_sync_total", "Slash-command tree syncs at startup (synced, unchanged, failed).", ("result",))
+
+
+@bot.before_invoke
+async def _ack_interaction(ctx: commands.Context) -> None:
+    # Discord wants an answer within 3 seconds; commands may wait on their guild's actor longer
+    if ctx.interaction is not None and not ctx.interaction.response.is_done():
+        try:
+            await ctx.defer(ephemeral=True)
+        except discord.HTTPException as e:
+            _swallowed("interaction.defer", e)
+
+
+@bot.after_invoke
+async def _finish_interaction(ctx: commands.Context) -> None:
+    # Runs once the callback completed; failures are answered by on_command_error
+    if ctx.interaction is None or ctx.command_failed:
+        return
+    channel = None
+    if ctx.guild is not None:
+        channels = _dark_channels(ctx.guild)
+        channel = channels.dark_chat or channels.dark_chat_fallback
+    content = f"✅ Done. Replies are in {channel.mention}." if channel is not None else "✅ Done."
+    try:
+        await ctx.send(content, ephemeral=True)
+    except discord.HTTPException as e:
+        _swallowed("interaction.reply", e)
+
+
+@bot.event
+async def on_command_error(ctx: commands.Context, error: commands.CommandError):
+    # An unanswered interaction shows "The application did not respond" to the member
+    if ctx.interaction is not None:
+        content = f"⚠️ {error}" if isinstance(error, (commands.UserInputError, commands.CheckFailure)) else "⚠️ That command failed."
+        try:
+            await ctx.send(content, ephemeral=True)
+        except discord.HTTPException as e:
+            _swallowed("interaction.error", e)
+    await commands.Bot.on_command_error(bot, ctx, error)
+
+
+async def _sync_commands() -> None:
+    """Sync the slash commands with Discord, unless they match the set last synced (COMMAND_SYNC_PATH)."""
+    if SHARD_IDS and 0 not in SHARD_IDS:
+        # Commands belong to the application, not a shard: in a cluster only shard 0's worker syncs them
+        return
+    payload = [command.to_dict(bot.tree) for command in bot.tree.get_commands()]
+    digest = hashlib.sha256(json.dumps([bot.application_id, payload], sort_keys=True).encode()).hexdigest()
+    try:
+        with open(COMMAND_SYNC_PATH) as f:
+            if f.read().strip() == digest:
+                command_sync_total.inc("unchanged")
+                return
+    except OSError:
+        pass
+    try:
+        synced = await bot.tree.sync()
+    except discord.HTTPException as e:
+        command_sync_total.inc("failed")
+        _log(logging.WARNING, "commands.sync_failed", error=e)
+        return
+    command_sync_total.inc("synced")
+    _log(logging.INFO, "commands.synced", commands=len(synced))
+    try:
+        with open(COMMAND_SYNC_PATH, "w") as f:
+            f.write(digest)
+    except OSError as e:
+        _swallowed("commands.sync_state", e)
+
+
+# Stored cycles are resumed on the first on_ready only
+_sessions_resumed = False
 
 
 @bot.event
 async def on_ready():
-    print(f"Logged in as {bot.user} (ID: {bot.user.id})")
-    print("------")
+    _log(logging.INFO, "bot.ready", user=bot.user, user_id=bot.user.id, guilds=len(bot.guilds),
+         shards=",".join(map(str, SHARD_IDS)) or bot.shard_count or 1)
+    for guild in bot.guilds:
+        _index_guild_channels(guild)
+    global _sessions_resumed
+    if not _sessions_resumed:
+        # on_ready fires again after reconnects; resume stored cycles only once
+        _sessions_resumed = True
+        await _start_metrics_server()
+        await _resume_sessions()
+        _start_reconciler()
+        await _sync_commands()
+    await _preload_alert_audio()
+
+
+@bot.event
+async def on_guild_join(guild: discord.Guild):
+    _index_guild_channels(guild)
+
+
+@bot.event
+async def on_guild_remove(guild: discord.Guild):
+    # Drop everything tracked for the guild; a running cycle can no longer reach it
+    _cancel_cycle(guild.id)
+    sessions.pop(guild.id, None)
+    # Nor should it come back on the next start
+    session_store.delete(guild.id)
+
+
+@bot.event
+async def on_guild_channel_create(channel: discord.abc.GuildChannel):
+    _retry_dark_chat(channel.guild)
+    if _channel_affects_index(channel):
+        _index_guild_channels(channel.guild)
+
+
+@bot.event
+async def on_guild_channel_delete(channel: discord.abc.GuildChannel):
+    session = sessions.get(channel.guild.id)
+    if session is not None and session.voice_channel_id == channel.id:
+        session.voice_channel_id = 0
+    if _channel_affects_index(channel):
+        _index_guild_channels(channel.guild)
+
+
+@bot.event
+async def on_guild_channel_update(before: discord.abc.GuildChannel, after: discord.abc.GuildChannel):
+    if before.overwrites != after.overwrites:
+        # e.g. Manage Channels granted on a category
+        _retry_dark_chat(after.guild)
+    # Only renames (or position changes among candidates) can change which channel is indexed
+    if before.name != after.name or before.position != after.position:
+        if _channel_affects_index(before) or _channel_affects_index(after):
+            _index_guild_channels(after.guild)
+
+
+@bot.event
+async def on_guild_role_create(role: discord.Role):
+    _retry_dark_chat(role.guild)
+
+
+@bot.event
+async def on_guild_role_delete(role: discord.Role):
+    _retry_dark_chat(role.guild)
+
+
+@bot.event
+async def on_guild_role_update(before: discord.Role, after: discord.Role):
+    if before.permissions != after.permissions:
+        _retry_dark_chat(after.guild)
+
+
+@bot.event
+async def on_guild_update(before: discord.Guild, after: discord.Guild):
+    # A new system channel changes the fallback
+    if before.system_channel != after.system_channel:
+        _retry_dark_chat(after)
+
+
+@bot.event
+async def on_member_update(before: discord.Member, after: discord.Member):
+    # Roles given to or taken from the bot itself
+    if bot.user is not None and after.id == bot.user.id and before.roles != after.roles:
+        _retry_dark_chat(after.guild)
 
 
-@bot.command(name="learn")
+@bot.hybrid_command(name="learn")
+@app_commands.describe(study_minutes="Minutes of each study phase (1-1440)", break_minutes="Minutes of each break (0-1440)")
 @commands.guild_only()
+@_in_guild_actor
 async def learn(ctx: commands.Context, study_minutes: int, break_minutes: int):
     """
     Start the study/break cycle in the fixed voice channel "dark-voice".
@@ -462,7 +2974,7 @@ async def learn(ctx: commands.Context, study_minutes: int, break_minutes: int):
         return
 
     if _is_cycle_running(ctx.guild.id):
-        await _send_in_dark_chat(ctx.guild, "A learning cycle is already running in this server. Use !stop to end it.")
+        await _send_in_dark_chat(ctx.guild, f"A learning cycle is already running in this server. Use {COMMAND_SIGIL}stop to end it.")
         return
 
     channel = await _get_dark_voice_channel(ctx)
@@ -470,194 +2982,240 @@ async def learn(ctx: commands.Context, study_minutes: int, break_minutes: int):
         await _send_in_dark_chat(ctx.guild, f"Voice channel '{DARK_VOICE_CHANNEL_NAME}' was not found. Please create it.")
         return
 
+    # Remember where to announce counts (the channel where the command was invoked) before the first
+    # announcement, which falls back to it if dark-chat cannot be created
+    _session(ctx.guild.id).announce_channel_id = ctx.channel.id
+
     # Immediate server mute to start
     try:
         await _send_in_dark_chat(
         ctx.guild,
-        f"▶️ Start study {study_minutes}m / break {break_minutes}m.  !stop to end.",
+        f"▶️ Start study {study_minutes}m / break {break_minutes}m.  {COMMAND_SIGIL}stop to end.",
     )
 
         await _mute_all_in_channel(channel, mute=True)
-        guild_id_to_phase[ctx.guild.id] = "study"
+        _session(ctx.guild.id).phase = "study"
     except discord.Forbidden:
         await _send_in_dark_chat(ctx.guild, "I need the 'Mute Members' permission to server mute in that channel.")
         return
 
-    task = bot.loop.create_task(_cycle_task(ctx.guild, study_minutes, break_minutes))
-    guild_id_to_task[ctx.guild.id] = task
-    # Remember where to announce counts (the channel where the command was invoked)
-    guild_id_to_announce_channel_id[ctx.guild.id] = ctx.channel.id
+    _start_cycle(ctx.guild, study_minutes, break_minutes)
+    session = _session(ctx.guild.id)
     # Reset study count at start of a new cycle
-    guild_id_to_study_count[ctx.guild.id] = 0
-    
-    # Store original channel name to restore later
+    session.study_count = 0
+
+    # Remember the voice channel the cycle enforces
     try:
-        channel = discord.utils.get(ctx.guild.voice_channels, name=DARK_VOICE_CHANNEL_NAME)
+        channel = _dark_channels(ctx.guild).dark_voice
         if channel:
-            guild_id_to_original_channel_name[ctx.guild.id] = channel.name
-            guild_id_to_voice_channel_id[ctx.guild.id] = channel.id
-    except Exception:
-        pass
+            session.voice_channel_id = channel.id
+    except Exception as e:
+        _swallowed("learn.remember_channel", e)
     # Clear any previous status message pointer
-    guild_id_to_status_message_id.pop(ctx.guild.id, None)
+    session.status_message_id = 0
     # Clear any leftover queued extension
-    guild_id_to_pending_break_extension_minutes.pop(ctx.guild.id, None)
+    session.pending_break_extension = 0
 
 
-@bot.command(name="stop")
+@bot.hybrid_command(name="stop")
 @commands.guild_only()
+@_in_guild_actor
 async def stop_cycle(ctx: commands.Context):
-    """Stop the running learning cycle and reset channel permissions."""
+    """Stop the running learning cycle and reset the dark-voice channel.
+    Replies first, then tears down concurrently beside the actor: unmute, rename, voice disconnect, status cleanup.
+    """
     if ctx.guild is None:
         await _send_in_dark_chat(None, "This command can only be used in a server.")
         return
 
-    task = guild_id_to_task.get(ctx.guild.id)
-    if task is None or task.done():
-        await _send_in_dark_chat(ctx.guild, "ℹ️ No cycle running.")
+    if not _is_cycle_running(ctx.guild.id):
+        await _send_in_dark_chat(ctx.guild, "ℹ️ No cycle running.", key="no-cycle")
         return
 
+    guild = ctx.guild
+    session = _session(guild.id)
     # Clear phase first to avoid any event-based remute during stop
-    guild_id_to_phase[ctx.guild.id] = None
+    session.phase = None
 
-    # Capture completed study count before the task resets it
-    completed_count = guild_id_to_study_count.get(ctx.guild.id, 0)
+    # Capture completed study count before the cycle resets it
+    completed_count = session.study_count
 
-    # Cancel countdown timer
-    timer_task = guild_id_to_timer_task.get(ctx.guild.id)
-    if timer_task:
-        timer_task.cancel()
-        guild_id_to_timer_task.pop(ctx.guild.id, None)
+    # Cancel the cycle's pending phase/countdown timer and reset the study counter
+    _cancel_cycle(guild.id)
+    session_store.delete(guild.id)
+    session.study_count = 0
+    # Clear any queued break extension and the status message pointer for the next cycle
+    session.pending_break_extension = 0
+    status_msg_id, session.status_message_id = session.status_message_id, 0
 
-    task.cancel()
-    try:
-        await task
-    except asyncio.CancelledError:
-        pass
-    finally:
-        guild_id_to_task.pop(ctx.guild.id, None)
+    await _send_in_dark_chat(guild, f"📘 study finished: {completed_count} cycles.")
 
-    # Ensure channel is left unmuted (server unmute)
     channel = await _get_dark_voice_channel(ctx)
     if channel is not None:
-        try:
-            await _mute_all_in_channel(channel, mute=False)
-            # Safety: after a tiny delay, unmute again in case of race with prior loop step
-            await asyncio.sleep(0.5)
-            await _mute_all_in_channel(channel, mute=False)
-        except discord.Forbidden:
-            # If we cannot reset, at least inform the user
-            await _send_in_dark_chat(ctx.guild, "Stopped. I could not reset channel permissions; please check Manage Channels permission.")
-            return
+        # The phase is cleared, so no join or voice update re-mutes anyone; the unmutes supersede any
+        # cycle mutes still queued and run after ones in flight, so one pass is enough
+        await _mute_all_in_channel(channel, mute=False)
+    _beside_actor(_stop_teardown(guild, channel, status_msg_id))
 
-    # Restore original channel name
-    try:
-        channel: Optional[discord.VoiceChannel] = None
-        vc_id = guild_id_to_voice_channel_id.get(ctx.guild.id)
-        if vc_id:
-            ch = ctx.guild.get_channel(vc_id)
-            if isinstance(ch, discord.VoiceChannel):
-                channel = ch
-        if channel is None:
-            for ch in ctx.guild.voice_channels:
-                if ch.name.startswith(DARK_VOICE_CHANNEL_NAME):
-                    channel = ch
-                    break
-        if channel:
-            original_name = guild_id_to_original_channel_name.get(ctx.guild.id, DARK_VOICE_CHANNEL_NAME)
-            # Keep voice channel name constant per user request; set to base name
-            await channel.edit(name=DARK_VOICE_CHANNEL_NAME)
-    except Exception:
-        pass
 
-    # Disconnect from voice if connected
-    await _disconnect_voice(ctx.guild)
+async def _stop_teardown(guild: discord.Guild, channel: Optional[discord.VoiceChannel], status_msg_id: int) -> None:
+    steps = [_disconnect_voice(guild), _stop_cleanup_status(guild, status_msg_id)]
+    if channel is not None and channel.name != DARK_VOICE_CHANNEL_NAME:
+        steps.append(_stop_rename(channel))
+    await asyncio.gather(*steps)
 
-    # Clean up any remaining status messages
-    try:
-        status_msg_id = guild_id_to_status_message_id.get(ctx.guild.id)
-        if status_msg_id:
-            text_channel = _get_dark_text_channel(ctx.guild)
-            if text_channel:
-                try:
-                    status_msg = await text_channel.fetch_message(status_msg_id)
-                    await status_msg.delete()
-                except Exception:
-                    pass
-    except Exception:
-        pass
 
-    # Best-effort cleanup of any leftover countdown messages like "[B #0: 00/02]" (keep latest)
+async def _stop_rename(channel: discord.VoiceChannel) -> None:
+    # Keep voice channel name constant per user request; set to base name
     try:
-        await _cleanup_countdown_messages_in_dark_chat(ctx.guild)
-    except Exception:
-        pass
+        await channel.edit(name=DARK_VOICE_CHANNEL_NAME)
+    except Exception as e:
+        _swallowed("stop.rename", e)
 
-    # Clear any queued break extension
-    guild_id_to_pending_break_extension_minutes.pop(ctx.guild.id, None)
 
-    # Send stop confirmation and summary
-    await _send_in_dark_chat(ctx.guild, f"📘 study finished: {completed_count} cycles.")
-    # Clear status message pointer for next cycle/phase
-    guild_id_to_status_message_id.pop(ctx.guild.id, None)
+async def _stop_cleanup_status(guild: discord.Guild, status_msg_id: int) -> None:
+    """Delete the cycle's status message and any leftover countdown messages (keeps the latest older one)."""
+    text_channel = _get_dark_text_channel(guild)
+    steps = []
+    if status_msg_id and text_channel is not None:
+        _forget_countdown_message(guild.id, status_msg_id)
+        steps.append(_delete_message_ids(text_channel, [status_msg_id]))
+    steps.append(_cleanup_countdown_messages_in_dark_chat(guild))
+    for result in await asyncio.gather(*steps, return_exceptions=True):
+        if isinstance(result, Exception):
+            _swallowed("stop.cleanup", result)
 
 
 @bot.event
 async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
     """
     When a user joins/leaves/moves, ensure their mute state matches current phase if a cycle is running.
+    Joins are gathered for JOIN_BATCH_WINDOW_SECONDS and enforced as one batch.
     """
+    session = sessions.get(member.guild.id)
+    if session is None or not session.phase:
+        return
+    target_id = session.voice_channel_id or _target_voice_id(member.guild, session)
+    joined_id = after.channel.id if after.channel is not None else 0
+    left_id = before.channel.id if before.channel is not None else 0
+    # Fast path: events that neither enter nor leave dark-voice stop here
+    if not target_id or (joined_id != target_id and left_id != target_id):
+        return
     # Ignore bot state changes (including this bot), so we don't mute ourselves when joining to play the alert
     if member.bot:
         return
-    guild = member.guild
-    phase = guild_id_to_phase.get(guild.id)
-    if not phase:
+    joined = joined_id == target_id
+    # Only events that would edit someone's mute go through the mailbox
+    if not _dark_voice_edit_needed(session, member, after, joined):
         return
+    # Enforced in order with the guild's commands and cycle steps
+    await _actor(member.guild.id).send("voice", _on_dark_voice_update, member, after, joined)
 
-    # Only act if the target channel is dark-voice
-    target_channel: Optional[discord.VoiceChannel] = None
-    vc_id = guild_id_to_voice_channel_id.get(guild.id)
-    if vc_id:
-        ch = guild.get_channel(vc_id)
-        if isinstance(ch, discord.VoiceChannel):
-            target_channel = ch
-    if target_channel is None:
-        # Fallback: name startswith to cope with renamed channel (countdown suffix)
-        for ch in guild.voice_channels:
-            if ch.name == DARK_VOICE_CHANNEL_NAME or ch.name.startswith(DARK_VOICE_CHANNEL_NAME):
-                target_channel = ch
-                break
-    if target_channel is None:
-        return
 
-    joined_channel = after.channel
-    left_channel = before.channel
+def _dark_voice_edit_needed(session: GuildSession, member: discord.Member, after: discord.VoiceState,
+                            joined: bool) -> bool:
+    """Whether a dark-voice event leaves the member in the wrong mute state. Changes nothing."""
+    if joined:
+        # Enforce current phase - always apply, ignore cooldown for joins
+        mute = session.phase == "study"
+        if mute and session.unmute_hold and member.id in session.unmute_hold:
+            return False
+        # Already in the open join batch, whose flush enforces the state the member is in by then
+        if session.pending_joins and member.id in session.pending_joins:
+            return False
+        return after.mute != mute
+    # Member left the channel: best-effort unmute if still muted
+    return member.voice is not None and member.voice.mute and not session.edited_recently(member.id, clock.now())
 
-    try:
-        if joined_channel and target_channel and joined_channel.id == target_channel.id:
-            # Enforce current phase - always apply, ignore cooldown for joins
-            desired_mute = phase == "study"
-            current_mute = after.mute
-            if current_mute != desired_mute:
-                now = time.time()
-                key = (guild.id, member.id)
-                recent_member_edit_time[key] = now
-                await member.edit(mute=desired_mute, reason="Learning cycle server mute (join/update)")
-        elif left_channel and target_channel and left_channel.id == target_channel.id and (not joined_channel or joined_channel.id != target_channel.id):
-            # Member left the channel: best-effort unmute if still muted
-            if member.voice is not None and member.voice.mute:
-                now = time.time()
-                key = (guild.id, member.id)
-                last = recent_member_edit_time.get(key, 0.0)
-                if now - last >= PER_MEMBER_EDIT_COOLDOWN_SECONDS:
-                    recent_member_edit_time[key] = now
-                    await member.edit(mute=False, reason="Learning cycle cleanup (left channel)")
-    except discord.Forbidden:
-        pass
+
+def _on_dark_voice_update(member: discord.Member, after: discord.VoiceState, joined: bool) -> None:
+    """A member entered (or changed state in) dark-voice, or left it; runs on the guild's actor."""
+    session = sessions.get(member.guild.id)
+    # The cycle may have stopped or changed phase while the event waited in the mailbox
+    if session is None or not session.phase or not _dark_voice_edit_needed(session, member, after, joined):
+        return
+    if joined:
+        _queue_join(session, member)
+    else:
+        session.mark_edited(member.id, clock.now())
+        _queue_mute(member, False, "Learning cycle cleanup (left channel)")
 
 
-@bot.command(name="unmute")
+async def _unmute_everyone(guild: discord.Guild, reason: str) -> Tuple[int, int]:
+    """
+    Server-unmute every muted voice member of the guild, collected in one pass over its voice channels.
+    All edits go to the guild's MuteDispatcher at once, so they run concurrently at the route's pace;
+    queued re-mutes for these members are superseded and the running cycle holds them unmuted until
+    its next phase boundary. Progress is reported in dark-chat. Returns (unmuted, failed).
+    """
+    session = _session(guild.id)
+    dispatcher = _mute_dispatcher(guild.id)
+    me_id = bot.user.id if bot.user else 0
+    targets: List[discord.Member] = []
+    for channel in itertools.chain(guild.voice_channels, guild.stage_channels):
+        for member in channel.members:
+            if member.id == me_id or member.voice is None:
+                continue
+            # A member with a mute still queued or in flight is not muted yet, but is about to be
+            if member.voice.mute or dispatcher.busy(member.id):
+                targets.append(member)
+    session.hold_unmuted(member.id for member in targets)
+    if not targets:
+        await _send_in_dark_chat(guild, "🔊 Nobody is server-muted.")
+        return 0, 0
+
+    unmuted = failed = 0
+    forbidden: Optional[discord.Forbidden] = None
+
+    async def unmute(member: discord.Member) -> None:
+        nonlocal unmuted, failed, forbidden
+        try:
+            if await dispatcher.apply(member, False, reason):
+                unmuted += 1
+        except discord.Forbidden as e:
+            failed += 1
+            forbidden = e
+        except Exception as e:
+            failed += 1
+            _swallowed("unmute.member", e)
+
+    total = len(targets)
+    progress_msg: Optional[discord.Message] = None
+
+    async def report(content: str) -> None:
+        nonlocal progress_msg
+        try:
+            if progress_msg is None:
+                text_channel = await _get_or_create_dark_text_channel(guild)
+                if text_channel is not None:
+                    progress_msg = await text_channel.send(content)
+            else:
+                await progress_msg.edit(content=content)
+        except Exception as e:
+            failed_edits_total.inc("progress")
+            _swallowed("unmute.report", e)
+
+    work = asyncio.ensure_future(asyncio.gather(*(unmute(member) for member in targets)))
+    reported = -1
+    while True:
+        done, _ = await asyncio.wait({work}, timeout=UNMUTE_PROGRESS_INTERVAL_SECONDS)
+        if done:
+            break
+        if unmuted + failed != reported:
+            reported = unmuted + failed
+            await report(f"🔊 Unmuting: {reported}/{total} done.")
+    if forbidden is not None and unmuted == 0:
+        raise forbidden
+    summary = f"🔊 Unmuted {unmuted} member{'s' if unmuted != 1 else ''}."
+    if failed:
+        summary += f" {failed} could not be unmuted."
+    await report(summary)
+    _log(logging.INFO, "unmute.all", guild=guild.id, targets=total, unmuted=unmuted, failed=failed)
+    return unmuted, failed
+
+
+@bot.hybrid_command(name="unmute")
+@app_commands.describe(member="Member to unmute (everyone in the server when omitted)")
 @commands.guild_only()
 async def unmute_command(ctx: commands.Context, member: Optional[discord.Member] = None):
     """Server-unmute a mentioned member, or everyone in the server if no mention."""
@@ -666,28 +3224,25 @@ async def unmute_command(ctx: commands.Context, member: Optional[discord.Member]
     try:
         if member is None:
             # No mention -> unmute everyone in the server
-            unmuted_count = 0
-            for voice_channel in ctx.guild.voice_channels:
-                for member_in_channel in voice_channel.members:
-                    if member_in_channel.voice and member_in_channel.voice.mute:
-                        try:
-                            await member_in_channel.edit(mute=False, reason=f"Server-wide unmute by {ctx.author}")
-                            unmuted_count += 1
-                        except Exception:
-                            pass
+            await _unmute_everyone(ctx.guild, f"Server-wide unmute by {ctx.author}")
             return
         # Unmute specific user
-        await member.edit(mute=False, reason=f"Manual unmute by {ctx.author}")
+        _session(ctx.guild.id).hold_unmuted((member.id,))
+        await _apply_mute(member, False, f"Manual unmute by {ctx.author}")
     except discord.Forbidden:
         await _send_in_dark_chat(ctx.guild, "🔒 Can't unmute: missing permission or role below target.")
     except Exception as e:
         await _send_in_dark_chat(ctx.guild, f"⚠️ Unmute failed: {e}")
 
 
-@bot.command(name="clearcommands")
+@bot.hybrid_command(name="clearcommands")
+@app_commands.describe(action="\"cancel\" stops a running clear")
 @commands.guild_only()
-async def clear_bot_commands(ctx: commands.Context):
-    """Delete messages that are commands to this bot (starting with supported ! commands)."""
+async def clear_bot_commands(ctx: commands.Context, action: Optional[str] = None):
+    """Delete messages that are commands to this bot (starting with supported ! commands).
+    Usage: !clearcommands (or !clearcommands cancel to stop a running clear)
+    With COMMAND_MODE=slash the bot cannot read other members' messages, so it finds none.
+    """
     if ctx.guild is None:
         return
     prefixes = ("!")
@@ -704,17 +3259,13 @@ async def clear_bot_commands(ctx: commands.Context):
         except Exception:
             return False
         return cmd in known
-    deleted_total = 0
-    for ch in ctx.guild.text_channels:
-        try:
-            deleted = await ch.purge(limit=1000, check=is_command_msg)
-            deleted_total += len(deleted)
-        except Exception:
-            pass
+    await _run_purge_job(ctx, is_command_msg, "Clearing bot commands", action, limit=CLEARCOMMANDS_MESSAGES_PER_CHANNEL)
 
 
-@bot.command(name="extendbreak")
+@bot.hybrid_command(name="extendbreak")
+@app_commands.describe(extra_minutes="Minutes to add to the next break (1-1440)")
 @commands.guild_only()
+@_in_guild_actor
 async def extend_break_once(ctx: commands.Context, extra_minutes: int):
     """Queue a one-time extension to the current/next break while the cycle is running.
     Usage: !extendbreak 5
@@ -725,23 +3276,172 @@ async def extend_break_once(ctx: commands.Context, extra_minutes: int):
         await _send_in_dark_chat(ctx.guild, "Please provide EXTRA minutes between 1 and 1440.")
         return
     if not _is_cycle_running(ctx.guild.id):
-        await _send_in_dark_chat(ctx.guild, "No running cycle. Use !learn first.")
+        await _send_in_dark_chat(ctx.guild, f"No running cycle. Use {COMMAND_SIGIL}learn first.")
         return
     # Set/overwrite the pending extension; it will apply after the current scheduled break completes
-    guild_id_to_pending_break_extension_minutes[ctx.guild.id] = extra_minutes
-    await _send_in_dark_chat(ctx.guild, f"🕒 Will extend the break by {extra_minutes} minute(s) once.")
+    session = _session(ctx.guild.id)
+    session.pending_break_extension = extra_minutes
+    cycle = session.cycle
+    if cycle is not None and cycle.started_at:
+        _persist_cycle(cycle)
+    await _send_in_dark_chat(ctx.guild, f"🕒 Will extend the break by {extra_minutes} minute(s) once.", key="extend")
+
+
+# ---- Cluster ----
+# Discord accepts one IDENTIFY per 5 seconds; worker starts, first ones and restarts alike, are spaced so
+# their shards do not collide
+IDENTIFY_INTERVAL_SECONDS = 5.0
+# A worker that exits with an error is restarted after this delay, doubled for every failure in a row
+# up to the maximum; a worker that ran for CLUSTER_STABLE_SECONDS starts over from the base delay
+CLUSTER_RESTART_BACKOFF_SECONDS = 5.0
+CLUSTER_RESTART_BACKOFF_MAX_SECONDS = 300.0
+CLUSTER_STABLE_SECONDS = 600.0
+# On shutdown, workers still running after this long are killed
+CLUSTER_STOP_TIMEOUT_SECONDS = 30.0
+# How often the supervisor checks on its workers
+CLUSTER_POLL_SECONDS = 0.5
+
+
+def _shard_ranges(workers: int, shard_count: int) -> List[List[int]]:
+    """Contiguous shard ids for each worker, as even as possible."""
+    return [list(range(shard_count * i // workers, shard_count * (i + 1) // workers)) for i in range(workers)]
+
+
+def _worker_env(index: int, shard_ids: List[int], shard_count: int, workers: int) -> Dict[str, str]:
+    """Environment for one cluster worker: its shards, its share of the global API limit, its metrics port."""
+    env = dict(os.environ, CLUSTER_WORKERS="1", SHARD_COUNT=str(shard_count), SHARD_IDS=",".join(map(str, shard_ids)))
+    # The global limit is per bot token, so the workers split it
+    env["API_GLOBAL_PER_SECOND"] = f"{API_GLOBAL_PER_SECOND / workers:g}"
+    if METRICS_PORT:
+        env["METRICS_PORT"] = str(METRICS_PORT + index)
+    return env
+
+
+def _worker_command() -> List[str]:
+    """argv of a cluster worker: this script, run by the same interpreter."""
+    return [sys.executable, os.path.abspath(__file__)]
+
+
+def _recommended_shard_count(token: str) -> int:
+    """Discord's recommended shard count for the bot (GET /gateway/bot)."""
+
+    async def fetch() -> int:
+        http = discord.http.HTTPClient(asyncio.get_running_loop())
+        try:
+            await http.static_login(token)
+            shards, _, _ = await http.get_bot_gateway()
+            return shards
+        finally:
+            await http.close()
+
+    return asyncio.run(fetch())
+
+
+class _ClusterWorker:
+    """One worker process of the cluster and its restart state."""
+
+    __slots__ = ("index", "shard_ids", "proc", "started_at", "start_at", "backoff", "done")
+
+    def __init__(self, index: int, shard_ids: List[int]):
+        self.index = index
+        self.shard_ids = shard_ids
+        self.proc: Optional[subprocess.Popen] = None
+        self.started_at = 0.0
+        self.start_at = 0.0
+        self.backoff = 0.0
+        # Exited cleanly, or stopped with the cluster: not restarted
+        self.done = False
+
+
+def _supervise(token: str) -> None:
+    """
+    Run CLUSTER_WORKERS copies of this script, each on its own contiguous range of shards, until they all exit.
+    Workers that fail are restarted with backoff; SIGINT/SIGTERM stop the cluster (workers get SIGINT and
+    shut down as on Ctrl+C, flushing their sessions).
+    """
+    shard_count = SHARD_COUNT
+    if not shard_count:
+        try:
+            shard_count = _recommended_shard_count(token)
+        except (discord.DiscordException, OSError) as e:
+            _log(logging.ERROR, "cluster.gateway_failed", error=e)
+            return
+    shard_count = max(shard_count, CLUSTER_WORKERS)
+    workers = [_ClusterWorker(index, shard_ids)
+               for index, shard_ids in enumerate(_shard_ranges(CLUSTER_WORKERS, shard_count))]
+    # No worker starts before this: each start holds it back by one identify interval per shard started
+    identify_at = time.monotonic()
+    _log(logging.INFO, "cluster.start", workers=len(workers), shards=shard_count)
+    stopping_at: Optional[float] = None
+
+    def stop(signum, frame) -> None:
+        nonlocal stopping_at
+        if stopping_at is None:
+            stopping_at = time.monotonic()
+            _log(logging.INFO, "cluster.stopping", signal=signal.Signals(signum).name)
+            for worker in workers:
+                if worker.proc is not None and worker.proc.poll() is None:
+                    worker.proc.send_signal(signal.SIGINT)
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    while True:
+        now = time.monotonic()
+        for worker in workers:
+            proc = worker.proc
+            if proc is not None and proc.poll() is not None:
+                worker.proc = None
+                ran = now - worker.started_at
+                if stopping_at is not None or proc.returncode == 0:
+                    worker.done = True
+                    _log(logging.INFO, "cluster.worker_exited", worker=worker.index, code=proc.returncode)
+                else:
+                    if ran >= CLUSTER_STABLE_SECONDS or not worker.backoff:
+                        worker.backoff = CLUSTER_RESTART_BACKOFF_SECONDS
+                    else:
+                        worker.backoff = min(worker.backoff * 2, CLUSTER_RESTART_BACKOFF_MAX_SECONDS)
+                    worker.start_at = now + worker.backoff
+                    _log(logging.WARNING, "cluster.worker_failed", worker=worker.index, code=proc.returncode,
+                         ran=round(ran, 1), restart_in=worker.backoff)
+            if worker.proc is None and not worker.done:
+                if stopping_at is not None:
+                    worker.done = True
+                elif now >= worker.start_at and now >= identify_at:
+                    worker.started_at = now
+                    identify_at = now + IDENTIFY_INTERVAL_SECONDS * len(worker.shard_ids)
+                    # Own session: a terminal's Ctrl+C reaches the supervisor only, which forwards it once
+                    worker.proc = subprocess.Popen(
+                        _worker_command(),
+                        env=_worker_env(worker.index, worker.shard_ids, shard_count, len(workers)),
+                        start_new_session=True,
+                    )
+                    _log(logging.INFO, "cluster.worker_started", worker=worker.index, pid=worker.proc.pid,
+                         shards=",".join(map(str, worker.shard_ids)))
+        if all(worker.done for worker in workers):
+            return
+        if stopping_at is not None and now - stopping_at > CLUSTER_STOP_TIMEOUT_SECONDS:
+            for worker in workers:
+                if worker.proc is not None and worker.proc.poll() is None:
+                    _log(logging.WARNING, "cluster.worker_killed", worker=worker.index)
+                    worker.proc.kill()
+        time.sleep(CLUSTER_POLL_SECONDS)
 
 
 def _run():
     # Prefer hardcoded token if replaced; otherwise fallback to environment variable
     token = BOT_TOKEN 
+    _configure_logging()
     if not token:
-        print(
-            "No Discord token found. Either set BOT_TOKEN in the file (replace the placeholder), "
-         
-        )
+        _log(logging.ERROR, "bot.no_token", hint="set BOT_TOKEN in the file or the tokenbot environment variable")
+        return
+    if CLUSTER_WORKERS > 1:
+        _supervise(token)
         return
-    bot.run(token)
+    try:
+        bot.run(token)
+    finally:
+        # Commit anything still waiting for the next batched flush
+        session_store.flush_sync()
 
 
 if __name__ == "__main__":
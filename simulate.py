@@ -0,0 +1,314 @@
+"""
+Virtual-time simulation: full study/break cycles for many guilds at event-loop speed.
+
+The bot runs unchanged on VirtualTimeLoop, an asyncio loop whose clock jumps straight to the next
+timer whenever nothing is ready, so a `!learn 50 10` day passes in seconds. main.clock is swapped
+for a VirtualClock so persisted wall times follow. Discord is fake_discord.FakeDiscord.
+
+Every mute, one-minute alert, countdown post/edit, announcement and delete is recorded on a
+timeline and checked against the schedule the commands imply (including !extendbreak).
+
+Usage:
+    python simulate.py [--guilds 50] [--members 10] [--study 50] [--break 10] [--days 1]
+                       [--extend 5] [--status-mode edit|timestamp|hybrid] [--milestones 10,5,1]
+                       [--timeline timeline.csv] [--check]
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import logging
+import os
+import re
+import selectors
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+os.environ.setdefault("tokenbot", "")
+_tmp = tempfile.TemporaryDirectory()
+os.environ["SESSION_DB_PATH"] = os.path.join(_tmp.name, "sessions.db")
+
+import main  # noqa: E402
+from fake_discord import FakeDiscord, FakeGuild  # noqa: E402
+
+# "[S #1: 49/50]", with " <t:END:R>" in hybrid mode; timestamp mode posts "[S #1: 50 min <t:END:R>]"
+_COUNTDOWN_RE = re.compile(r"\[(S|B) #(\d+): (?:(\d+)/)?(\d+)(?: min)?(?: <t:(\d+):R>)?\]$")
+
+
+class _VirtualSelector(selectors.DefaultSelector):
+    """Never blocks on timers: when nothing is ready, move the loop's clock to the next deadline."""
+
+    def __init__(self, loop: "VirtualTimeLoop"):
+        super().__init__()
+        self._loop = loop
+
+    def select(self, timeout: Optional[float] = None):
+        ready = super().select(0)
+        if ready or timeout == 0:
+            return ready
+        if self._loop.executor_jobs or timeout is None:
+            # Worker threads (session store commits) run in real time: wait for them instead
+            return super().select(None if timeout is None else min(timeout, 0.05))
+        self._loop.virtual_now += timeout
+        return []
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """asyncio loop on a virtual clock; sleeps, call_at and rate-limit waits take no real time."""
+
+    def __init__(self) -> None:
+        self.virtual_now = 0.0
+        self.executor_jobs = 0
+        super().__init__(_VirtualSelector(self))
+
+    def time(self) -> float:
+        return self.virtual_now
+
+    def run_in_executor(self, executor, func, *args):
+        future = super().run_in_executor(executor, func, *args)
+        self.executor_jobs += 1
+        future.add_done_callback(self._executor_done)
+        return future
+
+    def _executor_done(self, future: asyncio.Future) -> None:
+        self.executor_jobs -= 1
+
+
+class VirtualClock(main.Clock):
+    """Wall time that advances with the virtual loop, starting at the real time of the run."""
+
+    def __init__(self, loop: VirtualTimeLoop):
+        self._loop = loop
+        self._wall_start = time.time()
+        self._loop_start = loop.time()
+
+    def wall(self) -> float:
+        return self._wall_start + (self._loop.time() - self._loop_start)
+
+
+def expected_segments(study: int, brk: int, extend: int, extend_at: Optional[float],
+                      horizon: float) -> List[Tuple[float, str, int, int]]:
+    """(start offset, label, number, minutes) of every segment `!learn study brk` should run."""
+    segments = []
+    t, number = 0.0, 0
+    while t < horizon:
+        number += 1
+        segments.append((t, "S", number, study))
+        t += study * 60
+        if brk <= 0:
+            t += 1
+            continue
+        segments.append((t, "B", 0, brk))
+        t += brk * 60
+        # The extension is consumed by the first scheduled break that ends after it was queued
+        if extend_at is not None and extend_at < t:
+            segments.append((t, "B", 0, extend))
+            t += extend * 60
+            extend_at = None
+    return segments
+
+
+class Simulation:
+    def __init__(self, args: argparse.Namespace, loop: VirtualTimeLoop):
+        self.args = args
+        self.loop = loop
+        self.clock = VirtualClock(loop)
+        self.server = FakeDiscord(latency=args.latency, wall=self.clock.wall)
+        self.guilds: List[FakeGuild] = [self.server.add_guild(members=args.members) for _ in range(args.guilds)]
+        self.index = {guild.id: i for i, guild in enumerate(self.guilds)}
+        # (virtual seconds, guild index, kind, detail)
+        self.timeline: List[Tuple[float, int, str, str]] = []
+        # guild index -> virtual time its !extendbreak was handled
+        self.extended_at: Dict[int, float] = {}
+        self.server.observers.append(self._observe)
+
+    def _record(self, guild_id: int, kind: str, detail: str) -> None:
+        self.timeline.append((self.loop.time(), self.index.get(guild_id, -1), kind, detail))
+
+    def _observe(self, kind: str, guild: FakeGuild, data: Dict[str, Any]) -> None:
+        if kind == "member_edit":
+            self._record(guild.id, "mute" if data["mute"] else "unmute", str(data["user_id"]))
+        elif kind == "message_create":
+            content = data["content"]
+            self._record(guild.id, "countdown" if _COUNTDOWN_RE.match(content) else "announce", content)
+        elif kind == "message_edit":
+            self._record(guild.id, "countdown_edit", data["content"])
+        elif kind in ("message_delete", "message_bulk_delete"):
+            self._record(guild.id, "delete", str(len(data.get("ids", [data.get("id")]))))
+
+    def _trace_alerts(self) -> None:
+        one_minute_alert = main._one_minute_alert
+
+        async def traced(guild, channel, phase_name, deadline=None):
+            self._record(guild.id, "alert", phase_name)
+            return await one_minute_alert(guild, channel, phase_name=phase_name, deadline=deadline)
+
+        main._one_minute_alert = traced
+
+    async def run(self) -> None:
+        args = self.args
+        bot = main.bot
+        self._trace_alerts()
+        await self.server.attach(bot)
+        self.server.gateway.ready()
+        await bot.wait_until_ready()
+        # Start the guilds spread over the stagger window, as real servers would be
+        for i, guild in enumerate(self.guilds):
+            self.server.gateway.message(guild, guild.general_id, guild.owner_id, f"!learn {args.study} {args.brk}")
+            await asyncio.sleep(args.stagger / len(self.guilds))
+        if args.extend:
+            # Every other guild queues a one-time break extension halfway through its first study phase
+            await asyncio.sleep(args.study * 60 / 2)
+            for i, guild in enumerate(self.guilds):
+                if i % 2 == 0:
+                    self.server.gateway.message(guild, guild.general_id, guild.owner_id, f"!extendbreak {args.extend}")
+                    self.extended_at[i] = self.loop.time()
+                    await asyncio.sleep(args.stagger / len(self.guilds))
+        await asyncio.sleep(args.days * 86400 - self.loop.time())
+        for guild in self.guilds:
+            self.server.gateway.message(guild, guild.general_id, guild.owner_id, "!stop")
+        await asyncio.sleep(30)
+
+    def check(self) -> List[str]:
+        """Compare the timeline with the schedule each guild's commands imply. Returns problems."""
+        args = self.args
+        by_guild: Dict[int, List[Tuple[float, str, str]]] = defaultdict(list)
+        for t, guild, kind, detail in self.timeline:
+            if kind in ("countdown", "countdown_edit", "alert"):
+                by_guild[guild].append((t, kind, detail))
+        problems: List[str] = []
+        deviations: Dict[str, List[float]] = defaultdict(list)
+        for guild, events in sorted(by_guild.items()):
+            starts = [(t, d) for t, k, d in events if k == "countdown" and _is_segment_start(d)]
+            if not starts:
+                problems.append(f"guild {guild}: no countdown posted")
+                continue
+            anchor = starts[0][0]
+            extend_at = self.extended_at.get(guild)
+            expected = expected_segments(args.study, args.brk, args.extend if extend_at is not None else 0,
+                                         None if extend_at is None else extend_at - anchor,
+                                         # Posts carry the fake latency: the last one may land a hair before
+                                         # its ideal offset from the first
+                                         events[-1][0] - anchor + args.tolerance)
+            segment = -1
+            for t, kind, detail in events:
+                if kind == "countdown" and _is_segment_start(detail):
+                    segment += 1
+                    if segment >= len(expected):
+                        problems.append(f"guild {guild}: unexpected segment {detail} at {t:.1f}s")
+                        break
+                    offset, label, number, minutes = expected[segment]
+                    match = _COUNTDOWN_RE.match(detail)
+                    if match.group(1, 2, 4) != (label, str(number), f"{minutes:02d}"):
+                        problems.append(f"guild {guild}: segment {segment} is {detail}, expected "
+                                        f"{main._countdown_content(label, number, minutes, minutes)}")
+                        break
+                    deviations["phase start"].append(t - anchor - offset)
+                    if match.group(5):
+                        # The <t:END:R> the client counts down to, against the expected end in wall time
+                        deviations["status end"].append(int(match.group(5)) - self._wall_at(anchor + offset + minutes * 60))
+                    continue
+                if segment < 0:
+                    continue
+                offset, label, number, minutes = expected[segment]
+                if kind == "alert":
+                    deviations["alert"].append(t - anchor - offset - (minutes - 1) * 60)
+                else:
+                    match = _COUNTDOWN_RE.match(detail)
+                    if segment > 0 and match.group(1, 2, 4) != (label, str(number), f"{minutes:02d}"):
+                        # A segment's final edit lands just after the next segment has posted
+                        offset, label, number, minutes = expected[segment - 1]
+                    remaining = int(match.group(3))
+                    deviations["countdown edit"].append(t - anchor - offset - (minutes - remaining) * 60)
+        for name, values in deviations.items():
+            worst = max(values, key=abs)
+            print(f"{name:<15} n={len(values):<7} mean={sum(values) / len(values) * 1000:+.0f}ms "
+                  f"worst={worst * 1000:+.0f}ms")
+            if abs(worst) > args.tolerance:
+                problems.append(f"{name}: off by {worst:.2f}s (tolerance {args.tolerance}s)")
+        return problems
+
+    def _wall_at(self, loop_time: float) -> float:
+        return self.clock._wall_start + loop_time - self.clock._loop_start
+
+    def report(self, real_seconds: float) -> None:
+        args = self.args
+        simulated = self.loop.time()
+        kinds = Counter(kind for _, _, kind, _ in self.timeline)
+        calls = sum(self.server.calls.values())
+        print(f"simulated {simulated / 3600:.1f}h x {args.guilds} guilds in {real_seconds:.1f}s real "
+              f"({simulated / real_seconds:.0f}x)")
+        print("timeline: " + ", ".join(f"{kind}={n}" for kind, n in sorted(kinds.items())))
+        days = max(simulated / 86400, 1e-9)
+        print(f"status mode={main.STATUS_MODE} countdown edits={kinds['countdown_edit']} "
+              f"({kinds['countdown_edit'] / args.guilds / days:.0f}/guild/day)")
+        print(f"api calls={calls} ({calls / args.guilds / days:.0f}/guild/day) "
+              f"429s={sum(self.server.ratelimited.values())}")
+
+    def write_timeline(self, path: str) -> None:
+        with open(path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(["seconds", "guild", "kind", "detail"])
+            for t, guild, kind, detail in self.timeline:
+                writer.writerow([f"{t:.3f}", guild, kind, detail])
+
+
+def _is_segment_start(content: str) -> bool:
+    match = _COUNTDOWN_RE.match(content)
+    return match is not None and match.group(3) in (None, match.group(4))
+
+
+def main_cli() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=50)
+    parser.add_argument("--members", type=int, default=10)
+    parser.add_argument("--study", type=int, default=50)
+    parser.add_argument("--break", dest="brk", type=int, default=10)
+    parser.add_argument("--days", type=float, default=1.0)
+    parser.add_argument("--extend", type=int, default=5, help="!extendbreak minutes for every other guild (0 = off)")
+    parser.add_argument("--stagger", type=float, default=60.0, help="seconds over which guilds send their commands")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake HTTP round trip in (virtual) seconds")
+    parser.add_argument("--status-mode", choices=("edit", "timestamp", "hybrid"), help="override STATUS_MODE")
+    parser.add_argument("--milestones", help="override STATUS_MILESTONES, e.g. 10,5,1")
+    parser.add_argument("--timeline", help="write the timeline as CSV to this path")
+    parser.add_argument("--check", action="store_true", help="exit non-zero if the schedule check finds problems")
+    parser.add_argument("--tolerance", type=float, default=1.0, help="allowed timing error in seconds")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own output")
+    args = parser.parse_args()
+
+    main.ALERT_AUDIO_FULL_PATH = os.path.join(_tmp.name, "no-alert.mp3")
+    if args.status_mode:
+        main.STATUS_MODE = args.status_mode
+    if args.milestones is not None:
+        main.STATUS_MILESTONES = frozenset(int(m) for m in args.milestones.split(",") if m.strip())
+    logging.getLogger("discord").setLevel(logging.ERROR)
+    if args.verbose:
+        main._configure_logging("DEBUG")
+        main.LOG_HOT_PATHS = True
+    loop = VirtualTimeLoop()
+    asyncio.set_event_loop(loop)
+    sim = Simulation(args, loop)
+    main.clock = sim.clock
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    start = time.perf_counter()
+    with output:
+        try:
+            loop.run_until_complete(sim.run())
+        finally:
+            main.session_store.flush_sync()
+    sim.report(time.perf_counter() - start)
+    problems = sim.check()
+    if args.timeline:
+        sim.write_timeline(args.timeline)
+    for problem in problems[:20]:
+        print("PROBLEM:", problem)
+    if args.check and problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()